@@ -0,0 +1,67 @@
+"""Adds attraction_event signup_count column
+
+Revision ID: 9b1f2c7d4e60
+Revises: 3893ac4b43ae
+Create Date: 2026-10-17 11:02:19.517463
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1f2c7d4e60'
+down_revision = '3893ac4b43ae'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    if is_sqlite:
+        with op.batch_alter_table('attraction_event', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+            batch_op.add_column(sa.Column('signup_count', sa.Integer(), server_default='0', nullable=False))
+    else:
+        op.add_column('attraction_event', sa.Column('signup_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        'UPDATE attraction_event SET signup_count = ('
+        'SELECT count(*) FROM attraction_signup '
+        'WHERE attraction_signup.attraction_event_id = attraction_event.id)')
+
+
+def downgrade():
+    op.drop_column('attraction_event', 'signup_count')
@@ -0,0 +1,96 @@
+"""Adds attendee cellphone_e164 column
+
+Revision ID: a6c1e4f9b205
+Revises: f3a9d2c6b871
+Create Date: 2026-10-17 15:37:12.651840
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c1e4f9b205'
+down_revision = 'f3a9d2c6b871'
+branch_labels = None
+depends_on = None
+
+import phonenumbers
+from phonenumbers import PhoneNumberFormat
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import select, table
+import sideboard.lib.sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+attendee_table = table(
+    'attendee',
+    sa.Column('id', sideboard.lib.sa.UUID()),
+    sa.Column('cellphone', sa.Unicode()),
+    sa.Column('cellphone_e164', sa.Unicode()),
+)
+
+
+def _e164_phone_number(phone_number):
+    try:
+        return phonenumbers.format_number(phonenumbers.parse(phone_number, 'US'), PhoneNumberFormat.E164)
+    except phonenumbers.NumberParseException:
+        return ''
+
+
+def upgrade():
+    if is_sqlite:
+        with op.batch_alter_table('attendee', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+            batch_op.add_column(sa.Column('cellphone_e164', sa.Unicode(), server_default='', nullable=False))
+    else:
+        op.add_column('attendee', sa.Column('cellphone_e164', sa.Unicode(), server_default='', nullable=False))
+
+    connection = op.get_bind()
+    attendees = connection.execute(
+        select([attendee_table.c.id, attendee_table.c.cellphone]).where(attendee_table.c.cellphone != '')).fetchall()
+    rows = [{'attendee_id': id, 'e164': _e164_phone_number(cellphone)} for id, cellphone in attendees]
+    rows = [row for row in rows if row['e164']]
+    if rows:
+        connection.execute(
+            attendee_table.update()
+            .where(attendee_table.c.id == sa.bindparam('attendee_id'))
+            .values(cellphone_e164=sa.bindparam('e164')), rows)
+
+    op.create_index(op.f('ix_attendee_cellphone_e164'), 'attendee', ['cellphone_e164'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_attendee_cellphone_e164'), table_name='attendee')
+    op.drop_column('attendee', 'cellphone_e164')
@@ -0,0 +1,68 @@
+"""Adds attraction_checkin_operation table
+
+Revision ID: b8d3f6a2c417
+Revises: a6c1e4f9b205
+Create Date: 2026-10-17 17:02:44.318205
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3f6a2c417'
+down_revision = 'a6c1e4f9b205'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+import sideboard.lib.sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    op.create_table('attraction_checkin_operation',
+    sa.Column('id', sideboard.lib.sa.UUID(), nullable=False),
+    sa.Column('idempotency_key', sa.Unicode(), server_default='', nullable=False),
+    sa.Column('attraction_signup_id', sideboard.lib.sa.UUID(), nullable=True),
+    sa.Column('checkin_time', sideboard.lib.sa.UTCDateTime(), nullable=True),
+    sa.Column('synced_time', sideboard.lib.sa.UTCDateTime(), nullable=False),
+    sa.Column('error', sa.Unicode(), server_default='', nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_attraction_checkin_operation')),
+    sa.UniqueConstraint('idempotency_key', name=op.f('uq_attraction_checkin_operation_idempotency_key'))
+    )
+
+
+def downgrade():
+    op.drop_table('attraction_checkin_operation')
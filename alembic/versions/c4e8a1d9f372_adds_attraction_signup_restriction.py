@@ -0,0 +1,107 @@
+"""Adds attraction_signup restriction columns and indexes
+
+Revision ID: c4e8a1d9f372
+Revises: 9b1f2c7d4e60
+Create Date: 2026-10-17 12:20:41.108262
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1d9f372'
+down_revision = '9b1f2c7d4e60'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+import sideboard.lib.sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+PER_FEATURE = 1
+PER_ATTRACTION = 2
+
+
+def _backfill_restriction(restriction, group_column):
+    """
+    Copies the attraction's current restriction onto its signups, except
+    for any signups which already break it, so the unique indexes can be
+    built. Only the earliest signup in each group keeps the restriction.
+    """
+    op.execute(
+        'UPDATE attraction_signup SET restriction = {restriction} '
+        'WHERE attraction_id IN (SELECT id FROM attraction WHERE restriction = {restriction}) '
+        'AND NOT EXISTS ('
+        'SELECT 1 FROM attraction_signup AS earlier '
+        'WHERE earlier.attendee_id = attraction_signup.attendee_id '
+        'AND earlier.{group_column} = attraction_signup.{group_column} '
+        'AND (earlier.signup_time < attraction_signup.signup_time '
+        'OR (earlier.signup_time = attraction_signup.signup_time AND earlier.id < attraction_signup.id)))'.format(
+            restriction=restriction, group_column=group_column))
+
+
+def upgrade():
+    if is_sqlite:
+        with op.batch_alter_table('attraction_signup', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+            batch_op.add_column(sa.Column('attraction_feature_id', sideboard.lib.sa.UUID(), nullable=True))
+            batch_op.add_column(sa.Column('restriction', sa.Integer(), server_default='0', nullable=False))
+            batch_op.create_foreign_key(op.f('fk_attraction_signup_attraction_feature_id_attraction_feature'), 'attraction_feature', ['attraction_feature_id'], ['id'])
+    else:
+        op.add_column('attraction_signup', sa.Column('attraction_feature_id', sideboard.lib.sa.UUID(), nullable=True))
+        op.add_column('attraction_signup', sa.Column('restriction', sa.Integer(), server_default='0', nullable=False))
+        op.create_foreign_key(op.f('fk_attraction_signup_attraction_feature_id_attraction_feature'), 'attraction_signup', 'attraction_feature', ['attraction_feature_id'], ['id'])
+
+    op.execute(
+        'UPDATE attraction_signup SET attraction_feature_id = ('
+        'SELECT attraction_feature_id FROM attraction_event '
+        'WHERE attraction_event.id = attraction_signup.attraction_event_id)')
+    _backfill_restriction(PER_FEATURE, 'attraction_feature_id')
+    _backfill_restriction(PER_ATTRACTION, 'attraction_id')
+
+    op.create_index('uq_attraction_signup_once_per_feature', 'attraction_signup', ['attraction_feature_id', 'attendee_id'], unique=True,
+                    postgresql_where=sa.text('restriction = {}'.format(PER_FEATURE)),
+                    sqlite_where=sa.text('restriction = {}'.format(PER_FEATURE)))
+    op.create_index('uq_attraction_signup_once_per_attraction', 'attraction_signup', ['attraction_id', 'attendee_id'], unique=True,
+                    postgresql_where=sa.text('restriction = {}'.format(PER_ATTRACTION)),
+                    sqlite_where=sa.text('restriction = {}'.format(PER_ATTRACTION)))
+
+
+def downgrade():
+    op.drop_index('uq_attraction_signup_once_per_attraction', table_name='attraction_signup')
+    op.drop_index('uq_attraction_signup_once_per_feature', table_name='attraction_signup')
+    op.drop_constraint(op.f('fk_attraction_signup_attraction_feature_id_attraction_feature'), 'attraction_signup', type_='foreignkey')
+    op.drop_column('attraction_signup', 'restriction')
+    op.drop_column('attraction_signup', 'attraction_feature_id')
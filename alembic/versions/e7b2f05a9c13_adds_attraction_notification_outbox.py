@@ -0,0 +1,162 @@
+"""Adds attraction_notification_outbox table
+
+Revision ID: e7b2f05a9c13
+Revises: c4e8a1d9f372
+Create Date: 2026-10-17 13:41:07.286315
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2f05a9c13'
+down_revision = 'c4e8a1d9f372'
+branch_labels = None
+depends_on = None
+
+from datetime import timedelta
+from uuid import uuid4
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import select, table
+import sideboard.lib.sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+attraction_table = table(
+    'attraction',
+    sa.Column('id', sideboard.lib.sa.UUID()),
+    sa.Column('advance_notices', sideboard.lib.sa.JSON()),
+    sa.Column('advance_checkin', sa.Integer()),
+)
+
+
+attraction_event_table = table(
+    'attraction_event',
+    sa.Column('id', sideboard.lib.sa.UUID()),
+    sa.Column('attraction_id', sideboard.lib.sa.UUID()),
+    sa.Column('start_time', sideboard.lib.sa.UTCDateTime()),
+)
+
+
+attraction_signup_table = table(
+    'attraction_signup',
+    sa.Column('id', sideboard.lib.sa.UUID()),
+    sa.Column('attraction_event_id', sideboard.lib.sa.UUID()),
+    sa.Column('attendee_id', sideboard.lib.sa.UUID()),
+    sa.Column('signup_time', sideboard.lib.sa.UTCDateTime()),
+    sa.Column('checkin_time', sideboard.lib.sa.UTCDateTime()),
+)
+
+
+attraction_notification_table = table(
+    'attraction_notification',
+    sa.Column('attraction_event_id', sideboard.lib.sa.UUID()),
+    sa.Column('attendee_id', sideboard.lib.sa.UUID()),
+    sa.Column('ident', sa.Unicode()),
+)
+
+
+def _get_ident(attraction_event_id, advance_notice):
+    if advance_notice == -1:
+        return str(attraction_event_id)
+    return '{}_{}'.format(attraction_event_id, advance_notice)
+
+
+def _backfill_outbox(outbox_table):
+    """
+    Schedules the notifications that haven't been sent yet for every signup
+    that isn't checked in, the same way the AttractionNotificationOutbox
+    mapper events do for new signups.
+    """
+    connection = op.get_bind()
+    signup, event, attraction = attraction_signup_table, attraction_event_table, attraction_table
+
+    sent_idents = set(tuple(row) for row in connection.execute(select([
+        attraction_notification_table.c.attendee_id,
+        attraction_notification_table.c.attraction_event_id,
+        attraction_notification_table.c.ident])))
+
+    signups = connection.execute(
+        select([
+            signup.c.id,
+            signup.c.attendee_id,
+            signup.c.attraction_event_id,
+            signup.c.signup_time,
+            signup.c.checkin_time,
+            event.c.start_time,
+            attraction.c.advance_checkin,
+            attraction.c.advance_notices])
+        .select_from(
+            signup
+            .join(event, signup.c.attraction_event_id == event.c.id)
+            .join(attraction, event.c.attraction_id == attraction.c.id)))
+
+    rows = []
+    for (id, attendee_id, attraction_event_id, signup_time, checkin_time, start_time,
+            advance_checkin, advance_notices) in signups:
+        if checkin_time and checkin_time.year > 1:
+            continue
+        for advance_notice in sorted(set([-1] + (advance_notices or []))):
+            if advance_notice == -1:
+                due_at = signup_time
+            else:
+                advance_notice = max(0, advance_notice) + max(0, advance_checkin)
+                due_at = start_time - timedelta(seconds=advance_notice)
+            if (attendee_id, attraction_event_id, _get_ident(attraction_event_id, advance_notice)) not in sent_idents:
+                rows.append({'id': str(uuid4()), 'attraction_signup_id': id, 'advance_notice': advance_notice, 'due_at': due_at})
+
+    if rows:
+        op.bulk_insert(outbox_table, rows)
+
+
+def upgrade():
+    outbox_table = op.create_table('attraction_notification_outbox',
+    sa.Column('id', sideboard.lib.sa.UUID(), nullable=False),
+    sa.Column('attraction_signup_id', sideboard.lib.sa.UUID(), nullable=False),
+    sa.Column('advance_notice', sa.Integer(), nullable=False),
+    sa.Column('due_at', sideboard.lib.sa.UTCDateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['attraction_signup_id'], ['attraction_signup.id'], name=op.f('fk_attraction_notification_outbox_attraction_signup_id_attraction_signup')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_attraction_notification_outbox')),
+    sa.UniqueConstraint('attraction_signup_id', 'advance_notice', name=op.f('uq_attraction_notification_outbox_attraction_signup_id'))
+    )
+    op.create_index(op.f('ix_attraction_notification_outbox_due_at'), 'attraction_notification_outbox', ['due_at'], unique=False)
+
+    _backfill_outbox(outbox_table)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_attraction_notification_outbox_due_at'), table_name='attraction_notification_outbox')
+    op.drop_table('attraction_notification_outbox')
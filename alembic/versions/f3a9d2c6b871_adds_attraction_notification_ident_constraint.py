@@ -0,0 +1,75 @@
+"""Adds unique attendee_id, ident constraint to attraction_notification
+
+Revision ID: f3a9d2c6b871
+Revises: e7b2f05a9c13
+Create Date: 2026-10-17 14:52:33.904127
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2c6b871'
+down_revision = 'e7b2f05a9c13'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    # Only the earliest copy of any notification that was recorded twice is kept
+    op.execute(
+        'DELETE FROM attraction_notification WHERE EXISTS ('
+        'SELECT 1 FROM attraction_notification AS earlier '
+        'WHERE earlier.attendee_id = attraction_notification.attendee_id '
+        'AND earlier.ident = attraction_notification.ident '
+        'AND (earlier.sent_time < attraction_notification.sent_time '
+        'OR (earlier.sent_time = attraction_notification.sent_time AND earlier.id < attraction_notification.id)))')
+
+    if is_sqlite:
+        with op.batch_alter_table('attraction_notification', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+            batch_op.create_unique_constraint(op.f('uq_attraction_notification_attendee_id'), ['attendee_id', 'ident'])
+    else:
+        op.create_unique_constraint(op.f('uq_attraction_notification_attendee_id'), 'attraction_notification', ['attendee_id', 'ident'])
+
+
+def downgrade():
+    if is_sqlite:
+        with op.batch_alter_table('attraction_notification', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+            batch_op.drop_constraint(op.f('uq_attraction_notification_attendee_id'), type_='unique')
+    else:
+        op.drop_constraint(op.f('uq_attraction_notification_attendee_id'), 'attraction_notification', type_='unique')
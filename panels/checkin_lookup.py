@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from itertools import chain
+from threading import RLock
+from time import monotonic
+
+from sqlalchemy import event as sa_event, inspect
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from uber.config import c
+from uber.models.types import utcmin
+from panels.models import Attendee, AttractionEvent, AttractionFeature, \
+    AttractionSignup, time_span_label
+
+
+__all__ = ['CheckinLookupCache', 'checkin_lookup_cache', 'lookup_checkin_signups']
+
+
+# The attendee columns shown by attractions_admin/checkin.html
+_ATTENDEE_COLUMNS = ['id', 'first_name', 'last_name', 'badge_num', 'email', 'cellphone', 'birthdate', 'zip_code']
+
+# Changes to these AttractionEvent and AttractionFeature attributes change
+# every cached signup they appear in
+_EVENT_ATTRS = ['start_time', 'duration', 'location', 'attraction_feature_id']
+_FEATURE_ATTRS = ['name']
+
+
+class CheckinLookupCache:
+    """
+    A least recently used cache of check-in lookups, keyed by
+    `(badge_num, attraction_id)`.
+
+    Entries are dropped when a committed transaction changes the attendee or
+    their signups, and otherwise expire after `ttl` seconds. Invalidation
+    only reaches this process, so the ttl bounds how stale a lookup can be
+    after a change made by another process, or by a bulk query that skips
+    the session.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, clock=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = RLock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the lookup cached for `key`, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, attendee_id, result = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, attendee_id, result):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, attendee_id, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, attendee_ids=None, badge_nums=None):
+        """
+        Drops the lookups of the given attendees and badge numbers, or every
+        lookup if neither is given.
+        """
+        with self._lock:
+            if attendee_ids is None and badge_nums is None:
+                self._entries.clear()
+                return
+
+            attendee_ids, badge_nums = set(attendee_ids or []), set(badge_nums or [])
+            for key, (expires, attendee_id, result) in list(self._entries.items()):
+                if attendee_id in attendee_ids or key[0] in badge_nums:
+                    del self._entries[key]
+
+
+checkin_lookup_cache = CheckinLookupCache()
+
+
+def _signup_dict(row):
+    return {
+        'id': row.id,
+        'is_checked_in': row.checkin_time > utcmin.datetime,
+        'event': {
+            'start_time': row.start_time,
+            'location_label': c.EVENT_LOCATIONS.get(row.location, ''),
+            'time_span_label': time_span_label(row.start_time, row.duration),
+            'feature': {'name': row.feature_name}}}
+
+
+def lookup_checkin_signups(session, badge_num, attraction_id=None):
+    """
+    Returns the attendee with the given badge number and their signups, with
+    just the fields that attractions_admin/checkin.html shows, or None if no
+    attendee has that badge number.
+
+    This only loads the columns it needs, using one query for the attendee
+    and one for their signups, and the result is kept in
+    `checkin_lookup_cache`.
+    """
+    key = (badge_num, attraction_id)
+    result = checkin_lookup_cache.get(key)
+    if result is not None:
+        return result
+
+    columns = [getattr(Attendee, name) for name in _ATTENDEE_COLUMNS]
+    attendee = session.query(*columns).filter(Attendee.badge_num == badge_num).first()
+    if not attendee:
+        return None
+
+    query = session.query(
+        AttractionSignup.id,
+        AttractionSignup.checkin_time,
+        AttractionEvent.start_time,
+        AttractionEvent.duration,
+        AttractionEvent.location,
+        AttractionFeature.name.label('feature_name')) \
+        .join(AttractionEvent, AttractionSignup.attraction_event_id == AttractionEvent.id) \
+        .join(AttractionFeature, AttractionEvent.attraction_feature_id == AttractionFeature.id) \
+        .filter(AttractionSignup.attendee_id == attendee.id) \
+        .order_by(AttractionEvent.start_time)
+    if attraction_id:
+        query = query.filter(AttractionSignup.attraction_id == attraction_id)
+
+    result = {
+        'signups': [_signup_dict(row) for row in query],
+        'attendee': dict(zip(_ATTENDEE_COLUMNS, attendee))}
+    checkin_lookup_cache.put(key, attendee.id, result)
+    return result
+
+
+def _has_changes(instance, attrs):
+    state = inspect(instance)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def _track_checkin_changes(session, flush_context):
+    attendee_ids = session.info.setdefault('checkin_lookup_attendee_ids', set())
+    badge_nums = session.info.setdefault('checkin_lookup_badge_nums', set())
+    for instance in chain(session.new, session.deleted, session.dirty):
+        if isinstance(instance, AttractionSignup):
+            attendee_ids.add(instance.attendee_id)
+            attendee_ids.update(inspect(instance).attrs.attendee_id.history.deleted)
+        elif isinstance(instance, Attendee):
+            if instance in session.dirty and not _has_changes(instance, _ATTENDEE_COLUMNS):
+                continue
+            attendee_ids.add(instance.id)
+            badge_nums.update(inspect(instance).attrs.badge_num.history.deleted)
+        elif isinstance(instance, AttractionEvent):
+            if instance in session.dirty and not _has_changes(instance, _EVENT_ATTRS):
+                continue
+            session.info['checkin_lookup_clear'] = True
+        elif isinstance(instance, AttractionFeature):
+            if instance in session.dirty and not _has_changes(instance, _FEATURE_ATTRS):
+                continue
+            session.info['checkin_lookup_clear'] = True
+
+
+def _apply_checkin_changes(session):
+    attendee_ids = session.info.pop('checkin_lookup_attendee_ids', None)
+    badge_nums = session.info.pop('checkin_lookup_badge_nums', None)
+    if session.info.pop('checkin_lookup_clear', False):
+        checkin_lookup_cache.invalidate()
+    elif attendee_ids or badge_nums:
+        checkin_lookup_cache.invalidate(attendee_ids, badge_nums)
+
+
+def _discard_checkin_changes(session, *args):
+    session.info.pop('checkin_lookup_attendee_ids', None)
+    session.info.pop('checkin_lookup_badge_nums', None)
+    session.info.pop('checkin_lookup_clear', None)
+
+
+sa_event.listen(SQLAlchemySession, 'after_flush', _track_checkin_changes)
+sa_event.listen(SQLAlchemySession, 'after_commit', _apply_checkin_changes)
+sa_event.listen(SQLAlchemySession, 'after_rollback', _discard_checkin_changes)
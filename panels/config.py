@@ -92,6 +92,7 @@ else:
 
 schedule_menu.extend([
     MenuItem(name='Edit Schedule', access=c.STUFF, href='../schedule/edit'),
+    MenuItem(name='All Panelist Schedules', access=c.STUFF, href='../schedule/all_panelist_schedules'),
     MenuItem(name='Attractions', href='../attractions_admin/')])
 
 c.MENU.submenu.insert(2, MenuItem(name='Schedule', access=[c.STUFF, c.PEOPLE, c.REG_AT_CON], submenu=schedule_menu))
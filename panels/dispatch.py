@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+
+
+__all__ = ['TokenBucket', 'Dispatcher']
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens
+    per second. Each call to `acquire()` takes a token, blocking until one
+    is available, so callers never average more than `rate` calls per second
+    no matter how many threads share the bucket.
+
+    The `clock` and `sleep` functions can be replaced so tests and
+    benchmarks can run against simulated time.
+    """
+
+    def __init__(self, rate, burst=1, clock=monotonic, sleep=sleep):
+        assert rate > 0, 'TokenBucket rate must be positive'
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self.lock = Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available, returning how many seconds to wait
+        before trying again if not, or 0 on success.
+        """
+        with self.lock:
+            self._refill()
+            # Refilling accumulates rounding error, which could otherwise
+            # leave us waiting on a sliver of a token that never arrives
+            if self.tokens >= 1 - 1e-9:
+                self.tokens = max(0.0, self.tokens - 1)
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Takes a token, blocking until one is available."""
+        wait = self.try_acquire()
+        while wait:
+            self.sleep(wait)
+            wait = self.try_acquire()
+
+
+class Dispatcher:
+    """
+    Runs network calls on a pool of worker threads, rate limited per channel.
+
+    The thread that owns the database session submits work and collects the
+    results from the returned futures, so a slow provider never holds up
+    the database work, and each channel is held to its own rate limit no
+    matter how many workers are sending at once::
+
+        with Dispatcher(8, {'sms': TokenBucket(10)}) as dispatcher:
+            future = dispatcher.submit(send_text, to, body)
+            ...
+
+    Inside a submitted function, `dispatcher.throttle(channel)` blocks until
+    the channel's bucket allows another message to be sent.
+    """
+
+    def __init__(self, workers, buckets):
+        self.buckets = buckets
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def throttle(self, channel):
+        bucket = self.buckets.get(channel)
+        if bucket:
+            bucket.acquire()
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
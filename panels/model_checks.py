@@ -1,21 +1,65 @@
+from sqlalchemy import Interval, literal_column
+
 from panels import *
 
 
 Event.required = [('name', 'Event Name')]
 
 
+# Postgres can add half hours to a timestamp, so it evaluates the whole overlap
+# predicate itself; elsewhere (e.g. the sqlite test database) the end times
+# of the events in the window are compared in Python
+_HALF_HOUR_INTERVAL = literal_column("interval '30 minutes'", type_=Interval)
+
+
+def _max_event_duration():
+    """
+    The longest an Event can last, in half hours. Events are scheduled with
+    one of the c.EVENT_DURATION_OPTS durations.
+    """
+    return max(duration for duration, label in c.EVENT_DURATION_OPTS)
+
+
+def _first_overlapping_event(event, other_event_id=None):
+    """
+    Returns the name of the earliest Event in the same location whose time
+    range overlaps `event`, ignoring `event` itself and `other_event_id`.
+
+    An event can only overlap `event` if it starts before `event` ends, and
+    no earlier than the longest possible event before `event` starts. So the
+    check is a range scan of the (location, start_time) index over that
+    window instead of over everything earlier in the room, and only the
+    columns the check needs are fetched rather than whole Events. An event
+    longer than any of c.EVENT_DURATION_OPTS which starts before the window
+    is not found.
+    """
+    if not event.duration:
+        return None
+
+    earliest_start = event.start_time - timedelta(minutes=30 * _max_event_duration())
+    query = event.session.query(Event.name, Event.start_time, Event.duration).filter(
+        Event.location == event.location,
+        Event.id != event.id,
+        Event.id != other_event_id,
+        Event.duration > 0,
+        Event.start_time > earliest_start,
+        Event.start_time < event.end_time).order_by(Event.start_time)
+
+    if event.session.bind.dialect.name == 'postgresql':
+        return query.with_entities(Event.name) \
+            .filter(Event.start_time + Event.duration * _HALF_HOUR_INTERVAL > event.start_time) \
+            .limit(1).scalar()
+
+    for name, start_time, duration in query:
+        if start_time + timedelta(minutes=30 * duration) > event.start_time:
+            return name
+
+
 @validation.Event
 def overlapping_events(event, other_event_id=None):
-    existing = {}
-    for e in event.session.query(Event).filter(Event.location == event.location,
-                                               Event.id != event.id,
-                                               Event.id != other_event_id).all():
-        for hh in e.half_hours:
-            existing[hh] = e.name
-
-    for hh in event.half_hours:
-        if hh in existing:
-            return '"{}" overlaps with the time/duration you specified for "{}"'.format(existing[hh], event.name)
+    existing = _first_overlapping_event(event, other_event_id)
+    if existing:
+        return '"{}" overlaps with the time/duration you specified for "{}"'.format(existing, event.name)
 
 
 PanelApplication.required = [
@@ -1,3 +1,7 @@
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy.schema import Index
+
 from panels import *
 from panels.config import panels_config as config
 
@@ -17,6 +21,56 @@ class SessionMixin:
     def panel_applicants(self):
         return self.query(PanelApplicant).options(joinedload(PanelApplicant.application)).order_by('first_name', 'last_name')
 
+    def panelist_names_by_event(self):
+        """
+        Returns a dict mapping each Event id to the sorted full names of its
+        assigned panelists, built from a single query rather than lazy
+        loading every event's panelists and their attendees.
+        """
+        names = defaultdict(list)
+        for event_id, first_name, last_name in self.query(
+                AssignedPanelist.event_id, Attendee.first_name, Attendee.last_name) \
+                .join(Attendee, AssignedPanelist.attendee_id == Attendee.id):
+            names[event_id].append('{} {}'.format(first_name, last_name))
+        for event_names in names.values():
+            event_names.sort()
+        return names
+
+    def current_and_upcoming_events(self, now):
+        """
+        Returns a tuple of `(current, upcoming)` Events for schedule/now.
+
+        `current` holds the events running at `now`, and `upcoming` holds
+        every event in each location that starts at the next start time in
+        that location, between 30 minutes and 4 hours after `now`. Both are
+        ordered by location.
+
+        All locations are fetched with a single query over the
+        (location, start_time) index, and the next start time for each
+        location is picked out of an in-memory index of start times.
+        """
+        events_by_location = defaultdict(list)
+        for event in self.query(Event).filter(
+                Event.location.in_(c.ORDERED_EVENT_LOCS),
+                Event.start_time >= now - timedelta(hours=6),
+                Event.start_time <= now + timedelta(hours=4)).order_by(Event.location, Event.start_time):
+            events_by_location[event.location].append(event)
+
+        current, upcoming = [], []
+        for location in c.ORDERED_EVENT_LOCS:
+            events = events_by_location[location]
+            start_times = [event.start_time for event in events]
+
+            current.extend(
+                event for event in events[:bisect_right(start_times, now)] if now in event.half_hours)
+
+            i = bisect_left(start_times, now + timedelta(minutes=30))
+            if i < len(events):
+                next_start_time = start_times[i]
+                upcoming.extend(events[i:bisect_right(start_times, next_start_time)])
+
+        return current, upcoming
+
 
 class SocialMediaMixin(JSONColumnMixin('social_media', c.SOCIAL_MEDIA)):
     _social_media_urls = config.get('social_media_urls', {})
@@ -73,6 +127,10 @@ class Event(MagModel):
     applications = relationship('PanelApplication', backref='event')
     panel_feedback = relationship('EventFeedback', backref='event')
 
+    __table_args__ = (
+        Index('ix_event_location_start_time', 'location', 'start_time'),
+    )
+
     @property
     def half_hours(self):
         half_hours = set()
@@ -1,17 +1,22 @@
 import math
+import phonenumbers
 import pytz
 import re
 import string
 
 from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from uuid import uuid4
 
+from phonenumbers import PhoneNumberFormat
 from sideboard.lib import listify
 from sideboard.lib.sa import JSON, CoerceUTF8 as UnicodeText, UTCDateTime, UUID
-from sqlalchemy import and_, exists, func, or_, select, text, union, not_, cast, alias
+from sqlalchemy import and_, case, exists, func, or_, select, text, union, not_, cast, \
+    alias, event as sa_event, inspect
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, object_session, Session as SQLAlchemySession
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.orm.query import Query
 from sqlalchemy.schema import ForeignKey, ForeignKeyConstraint, Index, \
     UniqueConstraint
@@ -31,8 +36,11 @@ from uber.utils import noon_datetime, evening_datetime
 
 __all__ = [
     'Attraction', 'AttractionFeature', 'AttractionEvent', 'AttractionSignup',
-    'AttractionNotification', 'AttractionNotificationReply', 'filename_safe',
-    'groupify', 'sluggify']
+    'AttractionNotification', 'AttractionNotificationReply',
+    'AttractionNotificationOutbox', 'AttractionCheckinOperation',
+    'AttractionEventSoldOut',
+    'e164_phone_number', 'filename_safe', 'groupify', 'sluggify',
+    'time_span_label']
 
 
 def groupify(items, keys, val_key=None):
@@ -263,6 +271,74 @@ def filename_safe(s):
     return filename.replace(' ', '_')
 
 
+def e164_phone_number(phone_number):
+    """
+    Returns the given phone number in E.164 format, assuming it's a US
+    number if it doesn't include a country code. Returns an empty string if
+    it isn't a phone number.
+    """
+    if not phone_number:
+        return ''
+    try:
+        return phonenumbers.format_number(
+            phonenumbers.parse(phone_number, 'US'), PhoneNumberFormat.E164)
+    except phonenumbers.NumberParseException:
+        return ''
+
+
+def time_span_label(start_time, duration):
+    """
+    Returns a label like "1:00 PM – 1:15 PM Friday" for an event starting at
+    `start_time` that lasts `duration` seconds, in the event's timezone.
+    """
+    if not start_time:
+        return 'unknown time span'
+    end_time = (start_time + timedelta(seconds=duration)) \
+        .astimezone(c.EVENT_TIMEZONE)
+    start_time = start_time.astimezone(c.EVENT_TIMEZONE)
+    if start_time.date() == end_time.date():
+        return '{} – {}'.format(
+            start_time.strftime('%-I:%M %p'),
+            end_time.strftime('%-I:%M %p %A'))
+    return '{} – {}'.format(
+        start_time.strftime('%-I:%M %p %A'),
+        end_time.strftime('%-I:%M %p %A'))
+
+
+def summarize_available_slots(slots_by_start_time):
+    """
+    Totals the remaining slots of a feature's available events by day and
+    time of day.
+
+    Arguments:
+        slots_by_start_time (iterable): `(start_time, remaining_slots)`
+            tuples, ordered by start time.
+
+    Returns:
+        OrderedDict: Remaining slots keyed by day name (e.g. "Friday"), then
+            by "Morning", "Afternoon", or "Evening", in the order they first
+            appear.
+    """
+    summary = OrderedDict()
+    for start_time, remaining_slots in slots_by_start_time:
+        start_time = start_time.astimezone(c.EVENT_TIMEZONE)
+        day = start_time.strftime('%A')
+        if day not in summary:
+            summary[day] = OrderedDict()
+
+        time_of_day = 'Evening'
+        if start_time < noon_datetime(start_time):
+            time_of_day = 'Morning'
+        elif start_time < evening_datetime(start_time):
+            time_of_day = 'Afternoon'
+        if time_of_day not in summary[day]:
+            summary[day][time_of_day] = 0
+
+        summary[day][time_of_day] += remaining_slots
+
+    return summary
+
+
 @Session.model_mixin
 class Attendee:
     NOTIFICATION_EMAIL = 0
@@ -278,6 +354,10 @@ class Attendee:
 
     attractions_opt_out = Column(Boolean, default=False)
 
+    # The cellphone in E.164 format, so replies to text notifications can be
+    # matched to their attendee with an indexed lookup
+    cellphone_e164 = Column(UnicodeText, index=True)
+
     attraction_signups = relationship(
         'AttractionSignup',
         backref='attendee',
@@ -290,6 +370,10 @@ class Attendee:
         backref='attendee',
         order_by='AttractionNotification.sent_time')
 
+    @presave_adjustment
+    def normalize_cellphone_e164(self):
+        self.cellphone_e164 = e164_phone_number(self.cellphone)
+
     @property
     def attraction_features(self):
         return list({e.feature for e in self.attraction_events})
@@ -484,56 +568,47 @@ class Attraction(MagModel):
     def locations_by_feature_id(self):
         return groupify(self.features, 'id', lambda f: f.locations)
 
-    def signups_requiring_notification(
-            self, session, from_time, to_time, options=None):
+    def available_events_summaries(self, now=None):
         """
-        Returns a dict of AttractionSignups that require notification.
+        Returns the `available_events_summary` of each of this attraction's
+        features, keyed by feature id, from a single aggregate query.
 
-        The keys of the returned dict are the amount of advanced notice, given
-        in seconds. A key of -1 indicates confirmation notices after a signup.
-
-        The query generated by this method looks horrific, but is surprisingly
-        efficient.
+        Neither events nor attendees are loaded: remaining slots are summed
+        in the database, grouped by feature and start time, and only those
+        totals are bucketed by day and time of day.
         """
-        advance_checkin = max(0, self.advance_checkin)
-        subqueries = []
-        for advance_notice in sorted(set([-1] + self.advance_notices)):
-            event_filters = [AttractionEvent.attraction_id == self.id]
-            if advance_notice == -1:
-                notice_ident = cast(
-                    AttractionSignup.attraction_event_id, UnicodeText)
-                notice_param = bindparam(
-                    'confirm_notice', advance_notice).label('advance_notice')
-            else:
-                advance_notice = max(0, advance_notice) + advance_checkin
-                notice_delta = timedelta(seconds=advance_notice)
-                event_filters += [
-                    AttractionEvent.start_time >= from_time + notice_delta,
-                    AttractionEvent.start_time < to_time + notice_delta]
-                notice_ident = func.concat(
-                    AttractionSignup.attraction_event_id,
-                    '_{}'.format(advance_notice))
-                notice_param = bindparam(
-                    'advance_notice_{}'.format(advance_notice),
-                    advance_notice).label('advance_notice')
-
-            subquery = session.query(AttractionSignup, notice_param).filter(
-                AttractionSignup.is_unchecked_in,
-                AttractionSignup.attraction_event_id.in_(
-                    session.query(AttractionEvent.id).filter(*event_filters)),
-                not_(exists().where(and_(
-                    AttractionNotification.ident == notice_ident,
-                    AttractionNotification.attraction_event_id
-                        == AttractionSignup.attraction_event_id,
-                    AttractionNotification.attendee_id
-                        == AttractionSignup.attendee_id)))).with_labels()
-            subqueries.append(subquery)
-
-        query = subqueries[0].union(*subqueries[1:])
-        if options:
-            query = query.options(*listify(options))
-        query.order_by(AttractionSignup.id)
-        return groupify(query, lambda x: x[0], lambda x: x[1])
+        now = now or datetime.now(pytz.UTC)
+        remaining_slots = func.sum(case(
+            [(AttractionEvent.slots > AttractionEvent.signup_count,
+              AttractionEvent.slots - AttractionEvent.signup_count)],
+            else_=0))
+        query = self.session.query(
+            AttractionEvent.attraction_feature_id,
+            AttractionEvent.start_time,
+            AttractionEvent.duration,
+            remaining_slots
+        ).filter(AttractionEvent.attraction_id == self.id)
+
+        # Events can be checked into until they start, unless checkin is
+        # allowed anytime during the event, in which case they're available
+        # until they end. Event durations vary, so that's checked below.
+        if self.advance_checkin >= 0:
+            query = query.filter(AttractionEvent.start_time >= now)
+
+        rows = query.group_by(
+            AttractionEvent.attraction_feature_id,
+            AttractionEvent.start_time,
+            AttractionEvent.duration
+        ).order_by(AttractionEvent.start_time)
+
+        slots_by_feature = defaultdict(list)
+        for feature_id, start_time, duration, slots in rows:
+            if start_time + timedelta(seconds=duration) >= now:
+                slots_by_feature[feature_id].append((start_time, slots))
+
+        return {
+            feature_id: summarize_available_slots(slots)
+            for feature_id, slots in slots_by_feature.items()}
 
 
 class AttractionFeature(MagModel):
@@ -588,24 +663,8 @@ class AttractionFeature(MagModel):
 
     @property
     def available_events_summary(self):
-        summary = OrderedDict()
-        for event in self.available_events:
-            start_time = event.start_time_local
-            day = start_time.strftime('%A')
-            if day not in summary:
-                summary[day] = OrderedDict()
-
-            time_of_day = 'Evening'
-            if start_time < noon_datetime(start_time):
-                time_of_day = 'Morning'
-            elif start_time < evening_datetime(start_time):
-                time_of_day = 'Afternoon'
-            if time_of_day not in summary[day]:
-                summary[day][time_of_day] = 0
-
-            summary[day][time_of_day] += event.remaining_slots
-
-        return summary
+        return summarize_available_slots(
+            (e.start_time, e.remaining_slots) for e in self.available_events)
 
     @property
     def available_events_by_day(self):
@@ -629,6 +688,10 @@ class AttractionEvent(MagModel):
     duration = Column(Integer, default=900)  # In seconds
     slots = Column(Integer, default=1)
 
+    # Maintained by the AttractionSignup mapper events at the bottom of this
+    # module, so availability can be read without loading any attendees
+    signup_count = Column(Integer, default=0, server_default='0')
+
     signups = relationship(
         'AttractionSignup',
         backref='event',
@@ -729,7 +792,8 @@ class AttractionEvent(MagModel):
 
     @property
     def is_sold_out(self):
-        return self.slots <= len(self.attendees)
+        # signup_count is None until a new event is flushed
+        return self.slots <= (self.signup_count or 0)
 
     @property
     def is_started(self):
@@ -737,21 +801,11 @@ class AttractionEvent(MagModel):
 
     @property
     def remaining_slots(self):
-        return max(self.slots - len(self.attendees), 0)
+        return max(self.slots - (self.signup_count or 0), 0)
 
     @property
     def time_span_label(self):
-        if self.start_time:
-            end_time = self.end_time.astimezone(c.EVENT_TIMEZONE)
-            start_time = self.start_time.astimezone(c.EVENT_TIMEZONE)
-            if start_time.date() == end_time.date():
-                return '{} – {}'.format(
-                    start_time.strftime('%-I:%M %p'),
-                    end_time.strftime('%-I:%M %p %A'))
-            return '{} – {}'.format(
-                start_time.strftime('%-I:%M %p %A'),
-                end_time.strftime('%-I:%M %p %A'))
-        return 'unknown time span'
+        return time_span_label(self.start_time, self.duration)
 
     @property
     def duration_label(self):
@@ -794,9 +848,16 @@ class AttractionEvent(MagModel):
 
 class AttractionSignup(MagModel):
     attraction_event_id = Column(UUID, ForeignKey('attraction_event.id'))
+    attraction_feature_id = Column(
+        UUID, ForeignKey('attraction_feature.id'), nullable=True)
     attraction_id = Column(UUID, ForeignKey('attraction.id'))
     attendee_id = Column(UUID, ForeignKey('attendee.id'))
 
+    # The attraction's restriction at the time of signup, which decides
+    # which of the partial unique indexes below apply to this signup
+    restriction = Column(
+        Choice(Attraction.RESTRICTION_OPTS), default=Attraction.NONE)
+
     signup_time = Column(UTCDateTime, default=lambda: datetime.now(pytz.UTC))
     checkin_time = Column(
         UTCDateTime, default=lambda: utcmin.datetime, index=True)
@@ -818,7 +879,23 @@ class AttractionSignup(MagModel):
         viewonly=True)
 
     __mapper_args__ = {'confirm_deleted_rows': False}
-    __table_args__ = (UniqueConstraint('attraction_event_id', 'attendee_id'),)
+    __table_args__ = (
+        UniqueConstraint('attraction_event_id', 'attendee_id'),
+        Index(
+            'uq_attraction_signup_once_per_feature',
+            'attraction_feature_id',
+            'attendee_id',
+            unique=True,
+            postgresql_where=restriction == Attraction.PER_FEATURE,
+            sqlite_where=restriction == Attraction.PER_FEATURE),
+        Index(
+            'uq_attraction_signup_once_per_attraction',
+            'attraction_id',
+            'attendee_id',
+            unique=True,
+            postgresql_where=restriction == Attraction.PER_ATTRACTION,
+            sqlite_where=restriction == Attraction.PER_ATTRACTION),
+    )
 
     def __init__(self, attendee=None, event=None, **kwargs):
         super(AttractionSignup, self).__init__(**kwargs)
@@ -826,13 +903,17 @@ class AttractionSignup(MagModel):
             self.attendee = attendee
         if event:
             self.event = event
-        if not self.attraction_id and self.event:
-            self.attraction_id = self.event.attraction_id
+        self._fix_attraction_id()
 
     @presave_adjustment
     def _fix_attraction_id(self):
-        if not self.attraction_id and self.event:
-            self.attraction_id = self.event.attraction_id
+        if self.event:
+            if not self.attraction_id:
+                self.attraction_id = self.event.attraction_id
+            if not self.attraction_feature_id:
+                self.attraction_feature_id = self.event.attraction_feature_id
+            if self.is_new and self.event.attraction:
+                self.restriction = self.event.attraction.restriction
 
     @property
     def checkin_time_local(self):
@@ -887,6 +968,12 @@ class AttractionNotification(MagModel):
     subject = Column(UnicodeText)
     body = Column(UnicodeText)
 
+    # Notifications are recorded before they're sent, so this is what stops
+    # two runs from ever sending the same notification twice
+    __table_args__ = (
+        UniqueConstraint('attendee_id', 'ident'),
+    )
+
     @presave_adjustment
     def _fix_attraction_id(self):
         if not self.attraction_id and self.event:
@@ -911,3 +998,273 @@ class AttractionNotificationReply(MagModel):
     def _fix_attraction_id(self):
         if not self.attraction_id and self.event:
             self.attraction_id = self.event.attraction_id
+
+
+class AttractionNotificationOutbox(MagModel):
+    """
+    A notification that an AttractionSignup is still due to receive.
+
+    Rows are kept up to date by the mapper events at the bottom of this
+    module whenever a signup is created, moved, or checked in, or whenever
+    the advance notices of its attraction or the start time of its event
+    change. That way the notification sender only has to look at the rows
+    whose `due_at` has come up, rather than working out which signups need
+    a notification on every run.
+    """
+    attraction_signup_id = Column(UUID, ForeignKey('attraction_signup.id'))
+
+    # In seconds before checkin, or -1 for the signup confirmation. Like the
+    # notification idents, this includes the attraction's advance checkin.
+    advance_notice = Column(Integer)
+    due_at = Column(UTCDateTime, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('attraction_signup_id', 'advance_notice'),
+    )
+
+    @classmethod
+    def due_signups(cls, session, from_time, to_time, options=None):
+        """
+        Returns the AttractionSignups that have notifications coming due.
+
+        Advance notices that came due before `from_time` are discarded
+        without being sent, because a checkin reminder that arrives late is
+        worse than no reminder at all. Signup confirmations never expire.
+
+        Arguments:
+            session (Session): The session used to query the outbox.
+            from_time (datetime): Advance notices due before this time have
+                been missed.
+            to_time (datetime): Notifications due before this time are
+                returned.
+            options (list): Query options for loading the AttractionSignups.
+
+        Returns:
+            OrderedDict: Maps each AttractionSignup to a list of its due
+                `(outbox_id, advance_notice, due_at)` tuples.
+        """
+        session.query(cls).filter(
+            cls.advance_notice != -1,
+            cls.due_at < from_time).delete(synchronize_session=False)
+
+        query = (
+            session.query(
+                AttractionSignup, cls.id, cls.advance_notice, cls.due_at)
+            .join(cls, cls.attraction_signup_id == AttractionSignup.id)
+            .filter(cls.due_at < to_time)
+            .order_by(cls.due_at, AttractionSignup.id))
+        if options:
+            query = query.options(*listify(options))
+        return groupify(query, lambda x: x[0], lambda x: tuple(x[1:]))
+
+
+class AttractionCheckinOperation(MagModel):
+    """
+    A check in (or undone check in) synced from the attractions check-in
+    page, recorded under the idempotency key the page generated for it.
+
+    The page queues scans while it's offline and resends any batch whose
+    response it never saw, so a resent operation is answered from here
+    rather than being applied a second time, which could otherwise undo a
+    later change to the same signup.
+    """
+    idempotency_key = Column(UnicodeText, unique=True)
+
+    # Not a foreign key, since a signup can be cancelled after it's synced
+    attraction_signup_id = Column(UUID, nullable=True)
+
+    # The signup's check in time after the operation was applied, or None if
+    # it was left unchecked in, which is what a resent operation is told
+    checkin_time = Column(UTCDateTime, nullable=True)
+    synced_time = Column(UTCDateTime, default=lambda: datetime.now(pytz.UTC))
+    error = Column(UnicodeText)
+
+
+class AttractionEventSoldOut(Exception):
+    """
+    Raised when a flush would add a signup to an AttractionEvent that has no
+    remaining slots. The session must be rolled back afterwards.
+    """
+
+
+def _adjust_signup_count(connection, attraction_event_id, delta):
+    if attraction_event_id:
+        table = AttractionEvent.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.id == attraction_event_id)
+            .values(signup_count=table.c.signup_count + delta))
+
+
+def _claim_signup_slot(connection, attraction_event_id):
+    """
+    Claims one of the event's remaining slots with a conditional UPDATE.
+
+    Concurrent signups for the same event queue up behind the row lock taken
+    by the UPDATE, and each one re-checks the slot count once it gets the
+    lock, so an event can never be oversold no matter how many requests
+    pass the `is_sold_out` check at the same time.
+    """
+    if attraction_event_id:
+        table = AttractionEvent.__table__
+        result = connection.execute(
+            table.update()
+            .where(and_(
+                table.c.id == attraction_event_id,
+                table.c.signup_count < table.c.slots))
+            .values(signup_count=table.c.signup_count + 1))
+        if not result.rowcount:
+            raise AttractionEventSoldOut(attraction_event_id)
+
+
+def _expire_signup_count(target, *attraction_event_ids):
+    """
+    Marks the in-memory signup_count of the given events as stale, so it's
+    reloaded from the database once the flush is done.
+    """
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_signup_counts', set()).update(
+            filter(None, attraction_event_ids))
+
+
+@sa_event.listens_for(AttractionSignup, 'after_insert')
+def _increment_signup_count(mapper, connection, target):
+    _claim_signup_slot(connection, target.attraction_event_id)
+    _expire_signup_count(target, target.attraction_event_id)
+
+
+@sa_event.listens_for(AttractionSignup, 'after_delete')
+def _decrement_signup_count(mapper, connection, target):
+    _adjust_signup_count(connection, target.attraction_event_id, -1)
+    _expire_signup_count(target, target.attraction_event_id)
+
+
+@sa_event.listens_for(AttractionSignup, 'after_update')
+def _move_signup_count(mapper, connection, target):
+    history = inspect(target).attrs.attraction_event_id.history
+    if history.has_changes():
+        for attraction_event_id in history.deleted:
+            _adjust_signup_count(connection, attraction_event_id, -1)
+        _claim_signup_slot(connection, target.attraction_event_id)
+        _expire_signup_count(
+            target, target.attraction_event_id, *history.deleted)
+
+
+@sa_event.listens_for(SQLAlchemySession, 'after_flush_postexec')
+def _reload_signup_counts(session, flush_context):
+    for attraction_event_id in session.info.pop('stale_signup_counts', []):
+        event = session.identity_map.get(
+            identity_key(AttractionEvent, attraction_event_id))
+        if event is not None:
+            session.expire(event, ['signup_count'])
+
+
+def _schedule_notifications(connection, *criteria):
+    """
+    Rebuilds the AttractionNotificationOutbox rows of every AttractionSignup
+    matching `criteria`.
+
+    Signups that are checked in don't get any rows, and neither do
+    notifications that were already sent, so rebuilding is safe whenever
+    anything that affects the due times changes.
+    """
+    signup = AttractionSignup.__table__
+    event = AttractionEvent.__table__
+    attraction = Attraction.__table__
+    notification = AttractionNotification.__table__
+    outbox = AttractionNotificationOutbox.__table__
+
+    connection.execute(outbox.delete().where(
+        outbox.c.attraction_signup_id.in_(
+            select([signup.c.id]).where(and_(*criteria)))))
+
+    sent_idents = set(
+        tuple(row) for row in connection.execute(
+            select([
+                notification.c.attendee_id,
+                notification.c.attraction_event_id,
+                notification.c.ident])
+            .where(notification.c.attraction_event_id.in_(
+                select([signup.c.attraction_event_id])
+                .where(and_(*criteria))))))
+
+    signups = connection.execute(
+        select([
+            signup.c.id,
+            signup.c.attendee_id,
+            signup.c.attraction_event_id,
+            signup.c.signup_time,
+            event.c.start_time,
+            attraction.c.advance_checkin,
+            attraction.c.advance_notices])
+        .select_from(
+            signup
+            .join(event, signup.c.attraction_event_id == event.c.id)
+            .join(attraction, event.c.attraction_id == attraction.c.id))
+        .where(and_(signup.c.checkin_time <= utcmin.datetime, *criteria)))
+
+    rows = []
+    for (id, attendee_id, attraction_event_id, signup_time, start_time,
+            advance_checkin, advance_notices) in signups:
+        advance_checkin = max(0, advance_checkin)
+        for advance_notice in sorted(set([-1] + (advance_notices or []))):
+            if advance_notice == -1:
+                due_at = signup_time
+            else:
+                advance_notice = max(0, advance_notice) + advance_checkin
+                due_at = start_time - timedelta(seconds=advance_notice)
+
+            ident = AttractionEvent.get_ident(
+                attraction_event_id, advance_notice)
+            if (attendee_id, attraction_event_id, ident) not in sent_idents:
+                rows.append({
+                    'id': str(uuid4()),
+                    'attraction_signup_id': id,
+                    'advance_notice': advance_notice,
+                    'due_at': due_at})
+
+    if rows:
+        connection.execute(outbox.insert(), rows)
+
+
+def _has_changes(target, *attrs):
+    state = inspect(target)
+    return any(getattr(state.attrs, attr).history.has_changes()
+               for attr in attrs)
+
+
+@sa_event.listens_for(AttractionSignup, 'after_insert')
+def _schedule_signup_notifications(mapper, connection, target):
+    _schedule_notifications(
+        connection, AttractionSignup.__table__.c.id == target.id)
+
+
+@sa_event.listens_for(AttractionSignup, 'after_update')
+def _reschedule_signup_notifications(mapper, connection, target):
+    if _has_changes(target, 'attraction_event_id', 'checkin_time'):
+        _schedule_notifications(
+            connection, AttractionSignup.__table__.c.id == target.id)
+
+
+@sa_event.listens_for(AttractionSignup, 'before_delete')
+def _unschedule_signup_notifications(mapper, connection, target):
+    outbox = AttractionNotificationOutbox.__table__
+    connection.execute(outbox.delete().where(
+        outbox.c.attraction_signup_id == target.id))
+
+
+@sa_event.listens_for(AttractionEvent, 'after_update')
+def _reschedule_event_notifications(mapper, connection, target):
+    if _has_changes(target, 'start_time'):
+        _schedule_notifications(
+            connection,
+            AttractionSignup.__table__.c.attraction_event_id == target.id)
+
+
+@sa_event.listens_for(Attraction, 'after_update')
+def _reschedule_attraction_notifications(mapper, connection, target):
+    if _has_changes(target, 'advance_notices', 'advance_checkin'):
+        _schedule_notifications(
+            connection,
+            AttractionSignup.__table__.c.attraction_id == target.id)
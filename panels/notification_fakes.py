@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from itertools import count
+from threading import Lock
+from time import sleep
+
+import pytz
+from twilio.base.exceptions import TwilioRestException
+
+
+__all__ = ['EmailSink', 'FakeMessage', 'FakeTwilioClient', 'SimulatedClock']
+
+
+class SimulatedClock:
+    """
+    A clock that runs at normal speed but can be fast-forwarded, for driving
+    the notification tasks through a weekend in a few seconds.
+    """
+
+    def __init__(self, now=None):
+        self.offset = (now - datetime.now(pytz.UTC)) if now else timedelta()
+
+    def __call__(self):
+        return datetime.now(pytz.UTC) + self.offset
+
+    def advance(self, seconds):
+        self.offset += timedelta(seconds=seconds)
+
+
+class FakeMessage:
+    def __init__(self, sid, to, from_, body, date_sent, error_code=None, error_text=None):
+        self.sid = sid
+        self.to = to
+        self.from_ = from_
+        self.body = body
+        self.date_sent = date_sent
+        self.error_code = error_code
+        self.error_text = error_text
+
+
+class _FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, to, from_, body):
+        return self.client._create(to, from_, body)
+
+    def list(self, to=None, date_sent_after=None, **kwargs):
+        return self.client._list(to, date_sent_after)
+
+
+class FakeTwilioClient:
+    """
+    A local stand-in for `twilio.rest.Client` that sends nothing.
+
+    Sent messages are kept in `sent`, and messages passed to `receive()`
+    are returned by `messages.list()` just like replies sent to our number.
+
+    Arguments:
+        latency (float): How many seconds each API call takes.
+        error_codes (dict): Maps phone numbers to the Twilio error code
+            raised when sending to them, e.g. `{'+15005550001': 21211}`.
+        clock (callable): Returns the current time, used for `date_sent`.
+    """
+
+    def __init__(self, latency=0, error_codes=None, clock=None):
+        self.latency = latency
+        self.error_codes = error_codes or {}
+        self.clock = clock or (lambda: datetime.now(pytz.UTC))
+        self.messages = _FakeMessages(self)
+        self.sent = []
+        self.received = []
+        self._sids = count(1)
+        self._lock = Lock()
+
+    def _sid(self):
+        with self._lock:
+            return 'SMfake{:026d}'.format(next(self._sids))
+
+    def _create(self, to, from_, body):
+        if self.latency:
+            sleep(self.latency)
+        code = self.error_codes.get(to)
+        if code:
+            raise TwilioRestException(
+                400, '/Messages.json', 'Fake Twilio error {}'.format(code), code=code, method='POST')
+        message = FakeMessage(self._sid(), to, from_, body, self.clock())
+        with self._lock:
+            self.sent.append(message)
+        return message
+
+    def _list(self, to, date_sent_after):
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            return [m for m in self.received
+                    if (not to or m.to == to) and (not date_sent_after or m.date_sent >= date_sent_after)]
+
+    def receive(self, from_, to, body):
+        """Queues up an incoming text message, returning it."""
+        message = FakeMessage(self._sid(), to, from_, body, self.clock())
+        with self._lock:
+            self.received.append(message)
+        return message
+
+
+class EmailSink:
+    """
+    A stand-in for `send_email` which keeps every email in `sent` rather
+    than sending it, optionally taking `latency` seconds per email.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.sent = []
+        self._lock = Lock()
+
+    def __call__(self, source, dest, subject='', body='', **kwargs):
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            self.sent.append(dict(kwargs, source=source, dest=dest, subject=subject, body=body))
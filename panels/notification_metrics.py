@@ -0,0 +1,128 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from time import perf_counter
+
+import pytz
+from sideboard.lib import log
+
+
+__all__ = ['LagHistogram', 'NotificationMetrics', 'RunMetrics']
+
+
+class LagHistogram:
+    """
+    Counts how many seconds after their due time notifications were sent.
+    Negative lags are notifications that went out early.
+    """
+
+    # Upper bound of each bucket in seconds, the last bucket catches the rest
+    BUCKETS = [-300, -60, 0, 30, 60, 120, 300, 600, 1800]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def to_dict(self):
+        labels = ['<= {}s'.format(bound) for bound in self.BUCKETS] + ['> {}s'.format(self.BUCKETS[-1])]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': dict(zip(labels, self.counts))}
+
+
+class RunMetrics:
+    """
+    What happened during a single run of one of the notification tasks.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.started = datetime.now(pytz.UTC)
+        self.duration = None
+        self.scanned = defaultdict(int)  # By attraction id, or 'twilio' for replies
+        self.sent = defaultdict(int)  # By notification type
+        self.failures = 0
+        self.lag = LagHistogram()
+
+    def record_sent(self, type_str, due_at, sent_time):
+        self.sent[type_str] += 1
+        if due_at:
+            self.lag.add((sent_time - due_at).total_seconds())
+
+    def to_dict(self):
+        return {
+            'task': self.task,
+            'started': self.started.isoformat(),
+            'duration': self.duration,
+            'scanned': dict(self.scanned),
+            'sent': dict(self.sent),
+            'failures': self.failures,
+            'lag': self.lag.to_dict()}
+
+    def log_line(self):
+        return '{}: {:.2f}s, scanned {} rows, sent {}, {} failures, lag {}'.format(
+            self.task,
+            self.duration or 0,
+            sum(self.scanned.values()),
+            ', '.join('{} {}'.format(count, type_str) for type_str, count in sorted(self.sent.items())) or 'nothing',
+            self.failures,
+            'max {:.0f}s'.format(self.lag.max) if self.lag.count else 'n/a')
+
+
+class NotificationMetrics:
+    """
+    Keeps the metrics of the last `history` runs of each notification task,
+    and logs a line at the end of every run, warning when a run took longer
+    than the `interval` it's scheduled at.
+    """
+
+    def __init__(self, interval, history=100):
+        self.interval = interval
+        self.history = history
+        self.runs = defaultdict(lambda: deque(maxlen=self.history))
+        self.overruns = defaultdict(int)
+        self.lock = Lock()
+
+    @contextmanager
+    def run(self, task):
+        metrics = RunMetrics(task)
+        started = perf_counter()
+        try:
+            yield metrics
+        except Exception:
+            metrics.failures += 1
+            raise
+        finally:
+            metrics.duration = perf_counter() - started
+            with self.lock:
+                self.runs[task].append(metrics)
+                if metrics.duration > self.interval:
+                    self.overruns[task] += 1
+
+            log.info(metrics.log_line())
+            if metrics.duration > self.interval:
+                log.warning('{} took {:.1f}s, overrunning its {}s interval', task, metrics.duration, self.interval)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                task: {
+                    'interval': self.interval,
+                    'overruns': self.overruns[task],
+                    'runs': [metrics.to_dict() for metrics in reversed(runs)]}
+                for task, runs in self.runs.items()}
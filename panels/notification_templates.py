@@ -0,0 +1,94 @@
+from markupsafe import escape
+
+from uber.config import c
+from uber.jinja import JinjaEnv
+
+
+__all__ = ['TEXT_TPL', 'NotificationRenderer', 'UnsharedAttributeError']
+
+
+TEXT_TPL = (
+    'Checkin for {signup.event.name} {checkin}, '
+    '{signup.event.location_room_name}. '
+    'Reply N to drop out')
+
+# Stand-ins for the only per-attendee values the email templates use, which
+# are swapped for the real values after the shared part is rendered
+FIRST_NAME = '\x00first_name\x00'
+ATTENDEE_ID = '\x00attendee_id\x00'
+
+
+class UnsharedAttributeError(Exception):
+    """
+    Raised when an attraction email template uses an attribute that differs
+    between the attendees NotificationRenderer renders it once for.
+    """
+
+
+class _Shared:
+    def __getattr__(self, name):
+        # Jinja renders a missing attribute as an empty string when getting
+        # it raises AttributeError, so anything else has to raise something
+        # louder, apart from the special methods Python itself checks for
+        if name.startswith('__'):
+            raise AttributeError(name)
+        raise UnsharedAttributeError('Attraction email templates can use {}, but not {}.{}'.format(
+            ' and '.join('{}.{}'.format(self._path, attr) for attr in self._attrs), self._path, name))
+
+
+class _SharedAttendee(_Shared):
+    _path, _attrs = 'signup.attendee', ['first_name', 'id']
+    first_name = FIRST_NAME
+    id = ATTENDEE_ID
+
+
+class _SharedSignup(_Shared):
+    _path, _attrs = 'signup', ['event', 'attendee']
+    attendee = _SharedAttendee()
+
+    def __init__(self, event):
+        self.event = event
+
+
+class NotificationRenderer:
+    """
+    Renders the attraction notifications for a single run.
+
+    Every attendee signed up for the same event gets the same notification,
+    apart from their name and the id in their links. So each template is
+    rendered once per event and checkin label, with placeholders for those
+    two values, and each attendee's copy is made by filling them in. The
+    texts don't mention the attendee at all, so they're rendered once per
+    event and checkin label.
+
+    This means the attraction email templates can only use `checkin`, `c`,
+    `signup.event`, `signup.attendee.first_name`, and `signup.attendee.id`;
+    using any other attribute of `signup` or `signup.attendee` raises
+    UnsharedAttributeError.
+    """
+
+    def __init__(self):
+        self._emails = {}
+        self._texts = {}
+
+    def email(self, template_name, signup, checkin):
+        key = (template_name, signup.attraction_event_id, checkin)
+        shared = self._emails.get(key)
+        if shared is None:
+            template = JinjaEnv.env().get_template(template_name)
+            shared = self._emails[key] = template.render({
+                'signup': _SharedSignup(signup.event),
+                'checkin': checkin,
+                'c': c})
+
+        attendee = signup.attendee
+        return shared \
+            .replace(FIRST_NAME, str(escape(attendee.first_name))) \
+            .replace(ATTENDEE_ID, str(escape(attendee.id)))
+
+    def text(self, signup, checkin):
+        key = (signup.attraction_event_id, checkin)
+        text = self._texts.get(key)
+        if text is None:
+            text = self._texts[key] = TEXT_TPL.format(signup=signup, checkin=checkin)
+        return text
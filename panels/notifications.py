@@ -1,35 +1,71 @@
 import uuid
+from concurrent.futures import as_completed
 
 import phonenumbers
 from phonenumbers import PhoneNumberFormat
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+from twilio.request_validator import RequestValidator
 from twilio.rest import Client as TwilioRestClient
 
 from uber.models.types import utcmin
 from uber.custom_tags import humanize_timedelta
 from panels.config import panels_config
+from panels.dispatch import Dispatcher, TokenBucket
+from panels.notification_fakes import FakeTwilioClient
+from panels.notification_metrics import NotificationMetrics, RunMetrics
+from panels.notification_templates import NotificationRenderer
 from panels.models import *
 
 
 TASK_INTERVAL = 180  # Check every three minutes
 
-TEXT_TPL = (
-    'Checkin for {signup.event.name} {checkin}, '
-    '{signup.event.location_room_name}. '
-    'Reply N to drop out')
+# How far before the latest recorded reply the fallback poller starts looking
+REPLY_CURSOR_OVERLAP = timedelta(minutes=15)
 
 
 twilio_client = None
+twilio_validator = None
 try:
     twilio_sid = panels_config['secret']['panels_twilio_sid']
     twilio_token = panels_config['secret']['panels_twilio_token']
 
     if twilio_sid and twilio_token:
         twilio_client = TwilioRestClient(twilio_sid, twilio_token)
+        twilio_validator = RequestValidator(twilio_token)
     else:
         log.debug('Twilio SID and/or TOKEN is not in INI, not going to try to start Twilio for SMS messaging')
 except:
     log.error('Twilio: unable to initialize twilio REST client', exc_info=True)
     twilio_client = None
+    twilio_validator = None
+
+if c.DEV_BOX and c.FAKE_TWILIO:
+    log.info('Sending attractions text messages to a fake Twilio client')
+    twilio_client = FakeTwilioClient()
+
+# Notification emails are sent with this, so it can be swapped for an
+# EmailSink when benchmarking
+email_sender = send_email
+
+
+# Shared by every run, so the rate limits hold across back to back runs
+notification_dispatcher = Dispatcher(c.NOTIFICATION_WORKERS, {
+    'sms': TokenBucket(c.NOTIFICATION_SMS_RATE, c.NOTIFICATION_SMS_BURST),
+    'email': TokenBucket(
+        c.NOTIFICATION_EMAIL_RATE, c.NOTIFICATION_EMAIL_BURST)})
+
+# The recent runs of both notification tasks, served by
+# attractions_admin/notification_metrics
+notification_metrics = NotificationMetrics(TASK_INTERVAL)
+
+
+def is_valid_twilio_request(url, params, signature):
+    """
+    Returns True if a webhook request was signed with our Twilio token.
+    """
+    return bool(twilio_validator and signature
+                and twilio_validator.validate(url, params, signature))
 
 
 def normalize(phone_number):
@@ -43,11 +79,11 @@ def send_sms(to, body, from_=c.PANELS_TWILIO_NUMBER):
         to = normalize(to)
         if not twilio_client:
             log.error('no twilio client configured')
-        elif c.DEV_BOX and to not in c.TESTING_PHONE_NUMBERS:
+        elif c.DEV_BOX and to not in c.TESTING_PHONE_NUMBERS \
+                and not isinstance(twilio_client, FakeTwilioClient):
             log.info('We are in dev box mode, so we are not sending {!r} to {!r}', body, to)
         else:
             message = twilio_client.messages.create(to=to, from_=normalize(from_), body=body)
-            sleep(0.1)  # Avoid hitting rate limit, the send_email() implementation already does this
         if message:
             sid = message.sid if not message.error_code else message.error_text
     except TwilioRestException as e:
@@ -62,198 +98,375 @@ def send_sms(to, body, from_=c.PANELS_TWILIO_NUMBER):
     return sid
 
 
-def send_attraction_notifications(session):
-    for attraction in session.query(Attraction):
-        now = datetime.now(pytz.UTC)
-        from_time = now - timedelta(seconds=300)
-        to_time = now + timedelta(seconds=300)
-        signups = attraction.signups_requiring_notification(
-            session, from_time, to_time, [
-                subqueryload(AttractionSignup.attendee)
-                    .subqueryload(Attendee.attraction_notifications),
-                subqueryload(AttractionSignup.event)
-                    .subqueryload(AttractionEvent.feature)])
-
-        for signup, advance_notices in signups.items():
-            attendee = signup.attendee
-            if not attendee.first_name or not attendee.email:
-                try:
-                    log.error(
-                        'ERROR: Unassigned attendee signed up for an '
-                        'attraction, deleting signup:\n'
-                        '\tAttendee.id: {}\n'
-                        '\tAttraction.id: {}\n'
-                        '\tAttractionEvent.id: {}\n'
-                        '\tAttractionSignup.id: {}'.format(
-                            attendee.id,
-                            signup.attraction_id,
-                            signup.attraction_event_id,
-                            signup.id))
-                    session.delete(signup)
-                    session.commit()
-                except:
-                    log.error('ERROR: Failed to delete signup with '
-                              'unassigned attendee', exc_info=True)
-                continue
-
-            # The first time someone signs up for an attractions, they always
-            # receive the welcome email (even if they've chosen SMS or None
-            # for their notification prefs). If they've chosen to receive SMS
-            # notifications, they'll also get a text message.
-            is_first_signup = not(attendee.attraction_notifications)
-
-            if not is_first_signup and \
-                    attendee.notification_pref == Attendee.NOTIFICATION_NONE:
-                continue
-
-            use_text = twilio_client \
-                and attendee.cellphone \
-                and attendee.notification_pref == Attendee.NOTIFICATION_TEXT
-
-            event = signup.event
-
-            # If we overlap multiple notices, we only want to send a single
-            # notification. So if we have both "5 minutes before checkin" and
-            # "when checkin starts", we only want to send the notification
-            # for "when checkin starts".
-            advance_notice = min(advance_notices)
-            if advance_notice == -1 or advance_notice > 1800:
-                checkin = 'is at {}'.format(event.checkin_start_time_label)
-            else:
-                checkin = humanize_timedelta(
-                    event.time_remaining_to_checkin,
-                    granularity='minutes',
-                    separator=' ',
-                    prefix='is in ',
-                    now='is right now',
-                    past_prefix='was ',
-                    past_suffix=' ago')
-
-            ident = AttractionEvent.get_ident(event.id, advance_notice)
+def _covered_outbox_ids(outbox, advance_notice):
+    """
+    Returns the ids of the due outbox rows covered by sending the given
+    notice. A signup confirmation only covers itself, so a checkin reminder
+    that came due at the same time still goes out on the next run.
+    """
+    if advance_notice == -1:
+        return [id for id, notice, due_at in outbox if notice == -1]
+    return [id for id, notice, due_at in outbox]
+
+
+def _discard_outbox(session, ids):
+    session.query(AttractionNotificationOutbox) \
+        .filter(AttractionNotificationOutbox.id.in_(ids)) \
+        .delete(synchronize_session=False)
+
+
+def _deliver(dispatcher, sms=None, email=None):
+    """
+    Sends the text message and/or email of a notification from one of the
+    dispatcher's worker threads, returning the sid of the text message.
+    """
+    sid = None
+    if sms:
+        dispatcher.throttle('sms')
+        sid = send_sms(*sms)
+    if email:
+        args, kwargs = email
+        dispatcher.throttle('email')
+        email_sender(*args, **kwargs)
+    return sid
+
+
+def _insert_ignoring_conflicts(session, table, rows):
+    if session.bind.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    else:
+        statement = table.insert().prefix_with('OR IGNORE')
+    session.execute(statement, rows)
+
+
+def _claim_notifications(session, notifications):
+    """
+    Records a batch of notifications before any of them are sent, returning
+    the ids of the ones that were claimed by this run.
+
+    A notification that was already recorded by an earlier run (or a run
+    that crashed before it could clear the outbox) conflicts with the
+    unique ident and isn't claimed, so it's never sent twice. The flip side
+    is that a crash between claiming and sending drops the notification,
+    which is the better way to fail for checkin reminders.
+    """
+    sent_time = datetime.now(pytz.UTC)
+    _insert_ignoring_conflicts(session, AttractionNotification.__table__, [
+        dict(fields, sid='', sent_time=sent_time) for fields in notifications])
+    ids = [fields['id'] for fields in notifications]
+    claimed = set(id for [id] in session.query(AttractionNotification.id)
+                  .filter(AttractionNotification.id.in_(ids)))
+    session.commit()
+    return claimed
+
+
+def _record_notifications(session, sent, failed, outbox_ids):
+    """
+    Fills in the sids and sent times of a batch of sent notifications and
+    releases the claims on the failed ones, so they're retried on the next
+    run.
+    """
+    if sent:
+        session.bulk_update_mappings(AttractionNotification, sent)
+    if failed:
+        session.query(AttractionNotification) \
+            .filter(AttractionNotification.id.in_(failed)) \
+            .delete(synchronize_session=False)
+    if outbox_ids:
+        _discard_outbox(session, outbox_ids)
+    session.commit()
+
+
+def send_attraction_notifications(
+        session, dispatcher=None, clock=None, metrics=None):
+    """
+    Sends every attraction notification that's coming due, recording what
+    happened in `metrics`. The `dispatcher` and `clock` can be replaced for
+    benchmarking.
+    """
+    dispatcher = dispatcher or notification_dispatcher
+    metrics = metrics or RunMetrics('send_attraction_notifications')
+    clock = clock or (lambda: datetime.now(pytz.UTC))
+    now = clock()
+    from_time = now - timedelta(seconds=300)
+    to_time = now + timedelta(seconds=300)
+    signups = AttractionNotificationOutbox.due_signups(
+        session, from_time, to_time, [
+            subqueryload(AttractionSignup.attendee)
+                .subqueryload(Attendee.attraction_notifications),
+            subqueryload(AttractionSignup.event)
+                .subqueryload(AttractionEvent.feature)])
+
+    renderer = NotificationRenderer()
+    notifications = []
+    welcomed_attendee_ids = set()
+    for signup, outbox in signups.items():
+        metrics.scanned[signup.attraction_id] += len(outbox)
+        attendee = signup.attendee
+        if not attendee.first_name or not attendee.email:
             try:
-                if use_text:
-                    type_ = Attendee.NOTIFICATION_TEXT
-                    type_str = 'TEXT'
-                    from_ = c.PANELS_TWILIO_NUMBER
-                    to_ = attendee.cellphone
-                    body = TEXT_TPL.format(signup=signup, checkin=checkin)
-                    subject = ''
-                    sid = send_sms(to_, body, from_)
-
-                if not use_text or is_first_signup:
-                    type_ = Attendee.NOTIFICATION_EMAIL
-                    type_str = 'EMAIL'
-                    from_ = c.ATTRACTIONS_EMAIL
-                    to_ = attendee.email
-                    if is_first_signup:
-                        template = 'emails/attractions_welcome.html'
-                        subject = 'Welcome to {} Attractions'.format(
-                            c.EVENT_NAME)
-                    else:
-                        template = 'emails/attractions_notification.html'
-                        subject = 'Checkin for {} is at {}'.format(
-                            event.name, event.checkin_start_time_label)
-
-                    body = render(template, {
-                        'signup': signup,
-                        'checkin': checkin,
-                        'c': c}).decode('utf-8')
-                    sid = ident
-                    send_email(
-                        from_,
-                        to_,
-                        subject=subject,
-                        body=body,
-                        format='html',
-                        model=attendee,
-                        ident=ident)
-            except:
                 log.error(
-                    'Error sending notification\n'
-                    '\tfrom: {}\n'
-                    '\tto: {}\n'
-                    '\tsubject: {}\n'
-                    '\tbody: {}\n'
-                    '\ttype: {}\n'
-                    '\tattendee: {}\n'
-                    '\tident: {}\n'.format(
-                        from_,
-                        to_,
-                        subject,
-                        body,
-                        type_str,
+                    'ERROR: Unassigned attendee signed up for an '
+                    'attraction, deleting signup:\n'
+                    '\tAttendee.id: {}\n'
+                    '\tAttraction.id: {}\n'
+                    '\tAttractionEvent.id: {}\n'
+                    '\tAttractionSignup.id: {}'.format(
                         attendee.id,
-                        ident), exc_info=True)
-            else:
-                session.add(AttractionNotification(
-                    attraction_event_id=event.id,
-                    attraction_id=event.attraction_id,
-                    attendee_id=attendee.id,
-                    notification_type=type_,
-                    ident=ident,
-                    sid=sid,
-                    sent_time=datetime.now(pytz.UTC),
-                    subject=subject,
-                    body=body))
+                        signup.attraction_id,
+                        signup.attraction_event_id,
+                        signup.id))
+                session.delete(signup)
                 session.commit()
-
-
-def check_attraction_notification_replies(session):
+            except:
+                log.error('ERROR: Failed to delete signup with '
+                          'unassigned attendee', exc_info=True)
+            continue
+
+        # The first time someone signs up for an attractions, they always
+        # receive the welcome email (even if they've chosen SMS or None
+        # for their notification prefs). If they've chosen to receive SMS
+        # notifications, they'll also get a text message.
+        # Nothing is recorded until every due signup has been prepared, so
+        # an attendee with several signups due in this run is only welcomed
+        # by the first of them.
+        is_first_signup = not(attendee.attraction_notifications) \
+            and attendee.id not in welcomed_attendee_ids
+        if is_first_signup:
+            welcomed_attendee_ids.add(attendee.id)
+
+        if not is_first_signup and \
+                attendee.notification_pref == Attendee.NOTIFICATION_NONE:
+            _discard_outbox(session, [id for id, notice, due_at in outbox])
+            continue
+
+        use_text = twilio_client \
+            and attendee.cellphone \
+            and attendee.notification_pref == Attendee.NOTIFICATION_TEXT
+
+        event = signup.event
+
+        # If we overlap multiple notices, we only want to send a single
+        # notification. So if we have both "5 minutes before checkin" and
+        # "when checkin starts", we only want to send the notification
+        # for "when checkin starts".
+        advance_notice, due_at = min(
+            (notice, due_at) for id, notice, due_at in outbox)
+        if advance_notice == -1 or advance_notice > 1800:
+            checkin = 'is at {}'.format(event.checkin_start_time_label)
+        else:
+            checkin = humanize_timedelta(
+                event.time_remaining_to_checkin,
+                granularity='minutes',
+                separator=' ',
+                prefix='is in ',
+                now='is right now',
+                past_prefix='was ',
+                past_suffix=' ago')
+
+        ident = AttractionEvent.get_ident(event.id, advance_notice)
+        sms = email = None
+        if use_text:
+            type_ = Attendee.NOTIFICATION_TEXT
+            type_str = 'TEXT'
+            from_ = c.PANELS_TWILIO_NUMBER
+            to_ = attendee.cellphone
+            body = renderer.text(signup, checkin)
+            subject = ''
+            sms = (to_, body, from_)
+
+        if not use_text or is_first_signup:
+            type_ = Attendee.NOTIFICATION_EMAIL
+            type_str = 'EMAIL'
+            from_ = c.ATTRACTIONS_EMAIL
+            to_ = attendee.email
+            if is_first_signup:
+                template = 'emails/attractions_welcome.html'
+                subject = 'Welcome to {} Attractions'.format(
+                    c.EVENT_NAME)
+            else:
+                template = 'emails/attractions_notification.html'
+                subject = 'Checkin for {} is at {}'.format(
+                    event.name, event.checkin_start_time_label)
+
+            body = renderer.email(template, signup, checkin)
+            email = ((from_, to_), {
+                'subject': subject,
+                'body': body,
+                'format': 'html',
+                'model': attendee,
+                'ident': ident})
+
+        notifications.append((sms, email, _covered_outbox_ids(
+            outbox, advance_notice), due_at, from_, to_, type_str, {
+                'id': str(uuid.uuid4()),
+                'attraction_event_id': event.id,
+                'attraction_id': event.attraction_id,
+                'attendee_id': attendee.id,
+                'notification_type': type_,
+                'ident': ident,
+                'subject': subject,
+                'body': body}))
+
+    # Everything the workers need has been loaded by now. Detaching it all
+    # means committing below can't expire an attendee out from under a
+    # worker that is still sending them an email.
+    session.expunge_all()
+
+    batch_size = max(1, c.NOTIFICATION_BATCH_SIZE)
+    futures = {}
+    unclaimed_outbox_ids = []
+    for i in range(0, len(notifications), batch_size):
+        batch = notifications[i:i + batch_size]
+        claimed = _claim_notifications(
+            session, [fields for *notification, fields in batch])
+        for sms, email, outbox_ids, *notification in batch:
+            if notification[-1]['id'] in claimed:
+                future = dispatcher.submit(_deliver, dispatcher, sms, email)
+                futures[future] = [outbox_ids] + notification
+            else:
+                unclaimed_outbox_ids.extend(outbox_ids)
+
+    sent, failed, sent_outbox_ids = [], [], unclaimed_outbox_ids
+    for future in as_completed(futures):
+        outbox_ids, due_at, from_, to_, type_str, fields = futures[future]
+        try:
+            sid = future.result()
+        except:
+            log.error(
+                'Error sending notification\n'
+                '\tfrom: {}\n'
+                '\tto: {}\n'
+                '\tsubject: {}\n'
+                '\tbody: {}\n'
+                '\ttype: {}\n'
+                '\tattendee: {}\n'
+                '\tident: {}\n'.format(
+                    from_,
+                    to_,
+                    fields['subject'],
+                    fields['body'],
+                    type_str,
+                    fields['attendee_id'],
+                    fields['ident']), exc_info=True)
+            failed.append(fields['id'])
+            metrics.failures += 1
+        else:
+            if fields['notification_type'] == Attendee.NOTIFICATION_EMAIL:
+                sid = fields['ident']
+            sent_time = clock()
+            sent.append({
+                'id': fields['id'],
+                'sid': sid,
+                'sent_time': sent_time})
+            sent_outbox_ids.extend(outbox_ids)
+            metrics.record_sent(type_str, due_at, sent_time)
+
+        if len(sent) + len(failed) >= batch_size:
+            _record_notifications(session, sent, failed, sent_outbox_ids)
+            sent, failed, sent_outbox_ids = [], [], []
+
+    _record_notifications(session, sent, failed, sent_outbox_ids)
+
+
+def _attendees_for_phone(session, phone_number):
+    phone_number = e164_phone_number(phone_number)
+    if not phone_number:
+        return []
+    return session.query(Attendee).filter(
+        Attendee.cellphone_e164 == phone_number,
+        Attendee.attraction_notifications.any()).all()
+
+
+def record_attraction_notification_reply(
+        session, sid, from_, to, body, sent_time):
+    """
+    Records an incoming text message as a reply to the last text
+    notification that was sent to the number it came from. If the reply is
+    an "N", the attendee is dropped from that notification's event.
+    """
+    attraction_event_id = None
+    attraction_id = None
+    attendee_id = None
+    for attendee in _attendees_for_phone(session, from_):
+        notifications = sorted(filter(
+            lambda s: s.notification_type == Attendee.NOTIFICATION_TEXT,
+            attendee.attraction_notifications),
+            key=lambda s: s.sent_time)
+        if notifications:
+            notification = notifications[-1]
+            attraction_event_id = notification.attraction_event_id
+            attraction_id = notification.attraction_id
+            attendee_id = notification.attendee_id
+            if 'N' in body.upper() and notification.signup:
+                session.delete(notification.signup)
+            break
+
+    session.add(AttractionNotificationReply(
+        attraction_event_id=attraction_event_id,
+        attraction_id=attraction_id,
+        attendee_id=attendee_id,
+        notification_type=Attendee.NOTIFICATION_TEXT,
+        from_phonenumber=from_,
+        to_phonenumber=to,
+        sid=sid,
+        received_time=datetime.now(pytz.UTC),
+        sent_time=sent_time,
+        body=body))
+    session.commit()
+
+
+def check_attraction_notification_replies(session, metrics=None):
+    """
+    Picks up any replies that the attractions_sms/inbound webhook missed.
+
+    Rather than listing every message ever sent to PANELS_TWILIO_NUMBER,
+    this only asks Twilio for the messages sent since the latest reply we've
+    recorded. The cursor is wound back by REPLY_CURSOR_OVERLAP, because the
+    webhook records replies as they arrive and may have recorded a later
+    reply before the one it missed.
+    """
+    metrics = metrics or RunMetrics('check_attraction_notification_replies')
     if not twilio_client:
         return
 
-    messages = twilio_client.messages.list(to=c.PANELS_TWILIO_NUMBER)
+    cursor = session.query(
+        func.max(AttractionNotificationReply.sent_time)).scalar()
+    if cursor:
+        messages = twilio_client.messages.list(
+            to=c.PANELS_TWILIO_NUMBER,
+            date_sent_after=cursor - REPLY_CURSOR_OVERLAP)
+    else:
+        messages = twilio_client.messages.list(to=c.PANELS_TWILIO_NUMBER)
+
+    metrics.scanned['twilio'] += len(messages)
     sids = set(m.sid for m in messages)
     existing_sids = set(
         sid for [sid] in session.query(AttractionNotificationReply.sid)
             .filter(AttractionNotificationReply.sid.in_(sids)))
 
-    attendees = session.query(Attendee).filter(
-        Attendee.cellphone != '',
-        Attendee.attraction_notifications.any())
-    attendees_by_phone = groupify(attendees, lambda a: normalize(a.cellphone))
-
     for message in filter(lambda m: m.sid not in existing_sids, messages):
-        attraction_event_id = None
-        attraction_id = None
-        attendee_id = None
-        attendees = attendees_by_phone.get(normalize(message.from_), [])
-        for attendee in attendees:
-            notifications = sorted(filter(
-                lambda s: s.notification_type == Attendee.NOTIFICATION_TEXT,
-                attendee.attraction_notifications),
-                key=lambda s: s.sent_time)
-            if notifications:
-                notification = notifications[-1]
-                attraction_event_id = notification.attraction_event_id
-                attraction_id = notification.attraction_id
-                attendee_id = notification.attendee_id
-                if 'N' in message.body.upper() and notification.signup:
-                    session.delete(notification.signup)
-                break
-
-        session.add(AttractionNotificationReply(
-            attraction_event_id=attraction_event_id,
-            attraction_id=attraction_id,
-            attendee_id=attendee_id,
-            notification_type=Attendee.NOTIFICATION_TEXT,
-            from_phonenumber=message.from_,
-            to_phonenumber=message.to,
+        record_attraction_notification_reply(
+            session,
             sid=message.sid,
-            received_time=datetime.now(pytz.UTC),
-            sent_time=message.date_sent.replace(tzinfo=pytz.UTC),
-            body=message.body))
-        session.commit()
+            from_=message.from_,
+            to=message.to,
+            body=message.body,
+            sent_time=message.date_sent.replace(tzinfo=pytz.UTC))
+        metrics.sent['REPLY'] += 1
 
 
 def send_notifications():
-    with Session() as session:
-        send_attraction_notifications(session)
+    with notification_metrics.run('panels_send_notifications') as metrics, \
+            Session() as session:
+        send_attraction_notifications(session, metrics=metrics)
 
 
 def check_notification_replies():
-    with Session() as session:
-        check_attraction_notification_replies(session)
+    with notification_metrics.run(
+            'panels_check_notification_replies') as metrics, \
+            Session() as session:
+        check_attraction_notification_replies(session, metrics=metrics)
 
 
 if c.SEND_SMS:
@@ -0,0 +1,380 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import chain
+from threading import RLock
+from time import monotonic
+from uuid import uuid4
+
+import pytz
+
+from sqlalchemy import event as sa_event, inspect
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from uber.config import c
+from panels.models import AssignedPanelist, Attendee, Event
+
+
+__all__ = [
+    'ScheduleGrid', 'ScheduleVersion', 'ScheduledEvent', 'build_schedule_grid',
+    'layout_location', 'schedule_grid', 'schedule_version', 'slot_for_time']
+
+
+HALF_HOUR = timedelta(minutes=30)
+
+
+def slot_for_time(when, epoch=None):
+    """
+    Returns the index of the half hour slot containing `when`, counted from
+    `epoch` (defaults to `c.EPOCH`). Times before the epoch yield negative
+    slots.
+    """
+    epoch = c.EPOCH if epoch is None else epoch
+    return int((when - epoch).total_seconds() // 1800)
+
+
+def layout_location(entries, slot_count):
+    """
+    Lays out the events scheduled in a single location.
+
+    `entries` is a list of `(start_slot, duration, event)` tuples, where
+    `duration` is given in half hours. Each event gets a `colspan` attribute
+    assigned: 1 if it shares any half hour with another event in this
+    location, otherwise the full width of the location column.
+
+    Rather than bucketing every event into every half hour it covers, this
+    sorts the events once and sweeps over their start/end boundaries, so the
+    cost is O(n log n) in the number of events rather than proportional to
+    the length of the con.
+
+    Returns:
+        tuple: `(max_simul, cells)` where `max_simul` is the widest the
+            location gets during the con (never less than 1) and `cells` is
+            a dict mapping each occupied slot to the list of cell entries for
+            that slot: events starting in the slot followed by the integer
+            colspans of events that started earlier and are still running.
+    """
+    # Stable sort, so events starting together keep their original order
+    entries = sorted(entries, key=lambda entry: entry[0])
+
+    boundaries = []
+    for start, duration, event in entries:
+        clipped_start, clipped_end = max(start, 0), min(start + max(duration, 1), slot_count)
+        if clipped_start < clipped_end:
+            boundaries.append((clipped_start, 1))
+            boundaries.append((clipped_end, -1))
+
+    # Ends sort before starts in the same slot, so back-to-back events don't
+    # count as simultaneous
+    max_simul = running = 0
+    for _, delta in sorted(boundaries):
+        running += delta
+        max_simul = max(max_simul, running)
+    max_simul = max(max_simul, 1)
+
+    latest_end = None
+    for i, (start, duration, event) in enumerate(entries):
+        end = start + max(duration, 1)
+        overlaps_previous = latest_end is not None and latest_end > start
+        overlaps_next = i + 1 < len(entries) and entries[i + 1][0] < end
+        event.colspan = 1 if overlaps_previous or overlaps_next else max_simul
+        latest_end = end if latest_end is None else max(latest_end, end)
+
+    cells = defaultdict(list)
+    for start, duration, event in entries:
+        cells[start].append(event)
+    for start, duration, event in entries:
+        for slot in range(start + 1, start + duration):
+            cells[slot].append(event.colspan)
+
+    return max_simul, cells
+
+
+def fill_location(max_simul, cells):
+    """
+    Pads the cells returned by `layout_location` with `c.EVENT_OPEN` until
+    each one adds up to `max_simul`.
+
+    Returns:
+        tuple: `(filled, empty)` where `filled` maps each occupied slot to its
+            padded cells and `empty` is the padding used for every other slot.
+    """
+    filled = {}
+    for slot, cell in cells.items():
+        span_sum = sum(getattr(e, 'colspan', e) for e in cell)
+        filled[slot] = cell + [c.EVENT_OPEN] * (max_simul - span_sum)
+    return filled, [c.EVENT_OPEN] * max_simul
+
+
+def _assemble_rows(columns, epoch, slot_count):
+    slots = set(range(slot_count))
+    for location, name, max_simul, filled, empty in columns:
+        slots.update(filled)
+
+    schedule = []
+    for slot in sorted(slots):
+        row = [(location, filled.get(slot, empty)) for location, name, max_simul, filled, empty in columns]
+        schedule.append((epoch + HALF_HOUR * slot, row))
+
+    max_simul = [(location, name, max_simul) for location, name, max_simul, filled, empty in columns]
+    return schedule, max_simul
+
+
+def _layout_column(location, name, events, epoch, slot_count):
+    entries = [(slot_for_time(e.start_time, epoch), e.duration or 0, e) for e in events]
+    max_simul, cells = layout_location(entries, slot_count)
+    filled, empty = fill_location(max_simul, cells)
+    return location, name, max_simul, filled, empty
+
+
+def build_schedule_grid(events, locations=None, epoch=None, slot_count=None):
+    """
+    Builds the `schedule` and `max_simul` structures rendered by
+    schedule/internal.html.
+
+    Every half hour of the con gets a row, as does any half hour outside the
+    con that has an event running. Each row lists every location in order,
+    and each location's cells are padded with `c.EVENT_OPEN` until they add
+    up to the width of that location's column.
+
+    Args:
+        events (iterable): Objects with `location`, `start_time`, and
+            `duration` (in half hours) attributes. Each one gets a `colspan`
+            attribute assigned.
+        locations (list): `(id, name)` tuples giving the column order.
+            Defaults to `c.EVENT_LOCATION_OPTS`.
+        epoch (datetime): Start of the first row. Defaults to `c.EPOCH`.
+        slot_count (int): Number of half hours in the con. Defaults to
+            `2 * c.CON_LENGTH`.
+
+    Returns:
+        tuple: `(schedule, max_simul)` where `schedule` is a sorted list of
+            `(half_hour, [(location, cells), ...])` and `max_simul` is a list
+            of `(location, name, colspan)`.
+    """
+    locations = c.EVENT_LOCATION_OPTS if locations is None else locations
+    epoch = c.EPOCH if epoch is None else epoch
+    slot_count = 2 * c.CON_LENGTH if slot_count is None else slot_count
+
+    events_by_location = defaultdict(list)
+    for event in events:
+        events_by_location[event.location].append(event)
+
+    columns = [
+        _layout_column(location, name, events_by_location[location], epoch, slot_count)
+        for location, name in locations]
+    return _assemble_rows(columns, epoch, slot_count)
+
+
+class ScheduledEvent:
+    """
+    A detached copy of the Event columns rendered by schedule/internal.html,
+    so the materialized grid never holds on to ORM instances.
+    """
+    __slots__ = ['id', 'name', 'description', 'location', 'start_time', 'duration', 'colspan']
+
+    columns = [Event.id, Event.name, Event.description, Event.location, Event.start_time, Event.duration]
+
+    def __init__(self, id, name, description, location, start_time, duration):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.location = location
+        self.start_time = start_time
+        self.duration = duration
+        self.colspan = 1
+
+
+class ScheduleGrid:
+    """
+    The schedule/internal grid, materialized in process memory.
+
+    Each location column is laid out independently, so when an Event is
+    inserted, updated, or deleted only the locations it was in (before and
+    after the change) are marked stale. The next call to `get` re-queries and
+    re-lays out just those columns, then reassembles the rows from the
+    cached columns.
+
+    Those invalidations only happen in this process, and only for changes
+    made through a session, so the whole grid is also rebuilt every `ttl`
+    seconds to pick up changes from other processes and bulk queries.
+    """
+
+    def __init__(self, ttl=15 * 60, clock=monotonic):
+        self._lock = RLock()
+        self._columns = {}
+        self._stale = set()
+        self._schedule = None
+        self._config = None
+        self._ttl = ttl
+        self._clock = clock
+        self._expires = None
+
+    def invalidate(self, locations=None):
+        """
+        Marks the given locations as stale, or the whole grid if no
+        locations are given.
+        """
+        with self._lock:
+            if locations is None:
+                self._columns.clear()
+            else:
+                self._stale.update(locations)
+
+    def get(self, session):
+        """
+        Returns the `(schedule, max_simul)` tuple for schedule/internal.html,
+        re-laying out any stale location columns first.
+        """
+        locations, epoch, slot_count = config = (c.EVENT_LOCATION_OPTS, c.EPOCH, 2 * c.CON_LENGTH)
+        with self._lock:
+            now = self._clock()
+            if config != self._config or self._expires is None or now >= self._expires:
+                self._columns.clear()
+                self._config = config
+                self._expires = now + self._ttl
+
+            stale = {loc for loc, name in locations if loc not in self._columns or loc in self._stale}
+            if stale or self._schedule is None:
+                self._stale.difference_update(stale)
+
+                query = session.query(*ScheduledEvent.columns)
+                if len(stale) < len(locations):
+                    query = query.filter(Event.location.in_(stale))
+                events_by_location = defaultdict(list)
+                for row in query:
+                    events_by_location[row.location].append(ScheduledEvent(*row))
+
+                for location, name in locations:
+                    if location in stale:
+                        self._columns[location] = _layout_column(
+                            location, name, events_by_location[location], epoch, slot_count)
+
+                columns = [self._columns[location] for location, name in locations]
+                self._schedule = _assemble_rows(columns, epoch, slot_count)
+            return self._schedule
+
+
+schedule_grid = ScheduleGrid()
+
+
+class ScheduleVersion:
+    """
+    A monotonically increasing version number for the public schedule,
+    bumped whenever a committed transaction changes an Event, an
+    AssignedPanelist, or an Attendee's name.
+
+    Public feeds use it as their ETag, so pollers can be answered with a 304
+    without touching the database, and cache their serialized bodies per
+    version.
+
+    Only changes made through a session in this process bump the version, so
+    it's also bumped every `ttl` seconds to pick up changes made by other
+    processes and bulk queries.
+    """
+
+    def __init__(self, ttl=15 * 60, clock=monotonic):
+        self._lock = RLock()
+        self._bodies = {}
+        # Distinguishes the version numbers handed out by different processes,
+        # and by the same process before and after a restart
+        self._nonce = uuid4().hex[:12]
+        self._ttl = ttl
+        self._clock = clock
+        self._expires = clock() + ttl
+        self.number = 0
+        self.last_modified = datetime.now(pytz.UTC)
+
+    @property
+    def etag(self):
+        return '"{}-{}"'.format(self._nonce, self.number)
+
+    def current(self):
+        """
+        Returns a consistent `(number, etag, last_modified)` tuple.
+        """
+        with self._lock:
+            if self._clock() >= self._expires:
+                self.bump()
+            return self.number, self.etag, self.last_modified
+
+    def bump(self):
+        with self._lock:
+            self.number += 1
+            self.last_modified = datetime.now(pytz.UTC)
+            self._expires = self._clock() + self._ttl
+            self._bodies.clear()
+
+    def cached_body(self, key, number):
+        """
+        Returns the body cached for `key` at version `number`, or None.
+        """
+        with self._lock:
+            return self._bodies.get((key, number))
+
+    def caching(self, key, number, chunks):
+        """
+        Passes along the given chunks, caching the whole body for `key` once
+        they've all been sent, unless the version has moved on since.
+        """
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+
+        with self._lock:
+            if number == self.number:
+                self._bodies[key, number] = b''.join(body)
+
+
+schedule_version = ScheduleVersion()
+
+
+_SCHEDULE_ATTRS = ['name', 'description', 'location', 'start_time', 'duration']
+_PANELIST_NAME_ATTRS = ['first_name', 'last_name']
+
+
+def _has_changes(instance, attrs):
+    state = inspect(instance)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def _track_schedule_changes(session, flush_context):
+    locations = session.info.setdefault('schedule_grid_locations', set())
+    for instance in chain(session.new, session.deleted):
+        if isinstance(instance, Event):
+            locations.add(instance.location)
+            locations.update(inspect(instance).attrs.location.history.deleted)
+        if isinstance(instance, (Event, AssignedPanelist)):
+            session.info['schedule_changed'] = True
+
+    for instance in session.dirty:
+        if isinstance(instance, Event):
+            if _has_changes(instance, _SCHEDULE_ATTRS):
+                locations.add(instance.location)
+                locations.update(inspect(instance).attrs.location.history.deleted)
+            if session.is_modified(instance):
+                session.info['schedule_changed'] = True
+        elif isinstance(instance, AssignedPanelist):
+            if session.is_modified(instance):
+                session.info['schedule_changed'] = True
+        elif isinstance(instance, Attendee):
+            if _has_changes(instance, _PANELIST_NAME_ATTRS):
+                session.info['schedule_changed'] = True
+
+
+def _apply_schedule_changes(session):
+    locations = session.info.pop('schedule_grid_locations', None)
+    if locations:
+        schedule_grid.invalidate(locations)
+    if session.info.pop('schedule_changed', False):
+        schedule_version.bump()
+
+
+def _discard_schedule_changes(session, *args):
+    session.info.pop('schedule_grid_locations', None)
+    session.info.pop('schedule_changed', None)
+
+
+sa_event.listen(SQLAlchemySession, 'after_flush', _track_schedule_changes)
+sa_event.listen(SQLAlchemySession, 'after_commit', _apply_schedule_changes)
+sa_event.listen(SQLAlchemySession, 'after_rollback', _discard_schedule_changes)
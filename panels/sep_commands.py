@@ -70,6 +70,8 @@ if c.DEV_BOX:
         with Session() as session:
             for model in [
                     AttractionNotification,
+                    AttractionNotificationOutbox,
+                    AttractionCheckinOperation,
                     AttractionSignup,
                     AttractionEvent,
                     AttractionFeature,
@@ -167,6 +169,514 @@ if c.DEV_BOX:
         with Session() as session:
             send_attraction_notifications(session)
 
+
+def _legacy_schedule_grid(events, locations, epoch, slot_count):
+    """
+    The half-hour bucketing layout that schedule/internal used before
+    panels.schedule_grid existed. Only kept around for benchmarking.
+    """
+    ordered_locs = [loc for loc, desc in locations]
+    schedule = defaultdict(lambda: defaultdict(list))
+    for event in events:
+        schedule[event.start_time_local][event.location].append(event)
+        for i in range(1, event.duration):
+            half_hour = event.start_time_local + timedelta(minutes=30 * i)
+            schedule[half_hour][event.location].append(c.EVENT_BOOKED)
+
+    max_simul = {}
+    for id, name in locations:
+        max_events = 1
+        for i in range(slot_count):
+            half_hour = epoch + timedelta(minutes=30 * i)
+            max_events = max(max_events, len(schedule[half_hour][id]))
+        max_simul[id] = max_events
+
+    for half_hour in schedule:
+        for location in schedule[half_hour]:
+            for event in schedule[half_hour][location]:
+                if isinstance(event, Event):
+                    simul = max(len(schedule[half_hour][event.location]) for half_hour in event.half_hours)
+                    event.colspan = 1 if simul > 1 else max_simul[event.location]
+                    for i in range(1, event.duration):
+                        schedule[half_hour + timedelta(minutes=30*i)][event.location].remove(c.EVENT_BOOKED)
+                        schedule[half_hour + timedelta(minutes=30*i)][event.location].append(event.colspan)
+
+    for half_hour in schedule:
+        for id, name in locations:
+            span_sum = sum(getattr(e, 'colspan', e) for e in schedule[half_hour][id])
+            for i in range(max_simul[id] - span_sum):
+                schedule[half_hour][id].append(c.EVENT_OPEN)
+
+        schedule[half_hour] = sorted(schedule[half_hour].items(), key=lambda tup: ordered_locs.index(tup[0]))
+
+    max_simul = [(id, dict(locations)[id], colspan) for id, colspan in max_simul.items()]
+    return sorted(schedule.items()), sorted(max_simul, key=lambda tup: ordered_locs.index(tup[0]))
+
+
+def _visible_schedule_grid(schedule):
+    """Reduces a schedule grid to the cells schedule/internal.html renders."""
+    return [
+        (half_hour, [
+            (location, [(getattr(e, 'id', None), getattr(e, 'colspan', e)) for e in cells if not isinstance(e, int)])
+            for location, cells in row])
+        for half_hour, row in schedule]
+
+
+def _synthetic_schedule(days, rooms=None, locations=None, seed=0):
+    """
+    Generates unsaved Events filling `rooms` made up rooms (or the given
+    `locations`) for `days` days, with roughly one event in ten overlapping
+    the one before it.
+    """
+    import random
+    rng = random.Random(seed)
+    locations = locations or [(1000 + i, 'Room {}'.format(i)) for i in range(rooms)]
+    slot_count = days * 48
+    events = []
+    for location, name in locations:
+        slot = 0
+        while slot < slot_count:
+            duration = rng.randint(1, 4)
+            events.append(Event(
+                id=str(uuid.uuid4()),
+                name='{} event {}'.format(name, slot),
+                location=location,
+                start_time=(c.EPOCH + timedelta(minutes=30 * slot)).astimezone(pytz.UTC),
+                duration=duration))
+            slot += duration - (1 if rng.random() < 0.1 else 0) + rng.randint(0, 2)
+    return events, locations, slot_count
+
+
+if c.DEV_BOX:
+    @entry_point
+    def benchmark_schedule_grid():
+        """
+        Times schedule/internal's grid layout against the legacy implementation
+        on a synthetic 4 day, 40 room schedule.
+        """
+        from time import perf_counter
+        from panels.schedule_grid import build_schedule_grid
+
+        events, locations, slot_count = _synthetic_schedule(days=4, rooms=40)
+        print('Laying out {} events in {} rooms over {} half hours'.format(len(events), len(locations), slot_count))
+
+        started = perf_counter()
+        legacy_schedule, legacy_max_simul = _legacy_schedule_grid(events, locations, c.EPOCH, slot_count)
+        legacy_time = perf_counter() - started
+        legacy_visible = _visible_schedule_grid(legacy_schedule)
+
+        started = perf_counter()
+        schedule, max_simul = build_schedule_grid(events, locations, c.EPOCH, slot_count)
+        sweep_time = perf_counter() - started
+
+        assert max_simul == legacy_max_simul, 'max_simul differs from the legacy implementation'
+        assert _visible_schedule_grid(schedule) == legacy_visible, 'schedule differs from the legacy implementation'
+        print('legacy: {:.3f}s  sweep: {:.3f}s  speedup: {:.1f}x'.format(
+            legacy_time, sweep_time, legacy_time / max(sweep_time, 1e-9)))
+
+
+def _legacy_current_and_upcoming_events(session, now):
+    """
+    The two queries per location lookup that schedule/now used before
+    Session.current_and_upcoming_events existed. Only kept around for
+    benchmarking.
+    """
+    current, upcoming = [], []
+    for loc, desc in c.EVENT_LOCATION_OPTS:
+        approx = session.query(Event).filter(Event.location == loc,
+                                             Event.start_time >= now - timedelta(hours=6),
+                                             Event.start_time <= now).all()
+        for event in approx:
+            if now in event.half_hours:
+                current.append(event)
+
+        next = session.query(Event) \
+                      .filter(Event.location == loc,
+                              Event.start_time >= now + timedelta(minutes=30),
+                              Event.start_time <= now + timedelta(hours=4)) \
+                            .order_by('start_time').all()
+        if next:
+            upcoming.extend(event for event in next if event.start_time == next[0].start_time)
+    return current, upcoming
+
+
+if c.DEV_BOX:
+    @entry_point
+    def benchmark_schedule_now():
+        """
+        Times schedule/now's event lookup against the legacy per-location
+        queries, for every hour of a synthetic 4 day schedule filling every
+        configured location. The synthetic events are rolled back afterwards.
+        """
+        from time import perf_counter
+        from sqlalchemy import event as sa_event
+
+        Session.initialize_db(initialize=True)
+        with Session() as session:
+            events, locations, slot_count = _synthetic_schedule(days=4, locations=c.EVENT_LOCATION_OPTS)
+            session.add_all(events)
+            session.flush()
+            hours = [c.EPOCH + timedelta(hours=i) for i in range(slot_count // 2)]
+            print('Looking up {} hours of {} events in {} locations'.format(len(hours), len(events), len(locations)))
+
+            queries = []
+
+            def count_query(*args):
+                queries.append(args[2])
+
+            sa_event.listen(Session.engine, 'before_cursor_execute', count_query)
+            try:
+                results = {}
+                lookups = [
+                    ('legacy', _legacy_current_and_upcoming_events),
+                    ('single query', lambda session, now: session.current_and_upcoming_events(now))]
+                for name, lookup in lookups:
+                    del queries[:]
+                    session.expunge_all()
+                    started = perf_counter()
+                    results[name] = [
+                        [sorted(e.id for e in found) for found in lookup(session, now)] for now in hours]
+                    elapsed = perf_counter() - started
+                    print('{}: {:.3f}s, {} queries ({:.1f}ms per page)'.format(
+                        name, elapsed, len(queries), 1000 * elapsed / len(hours)))
+                assert results['legacy'] == results['single query'], 'results differ from the legacy implementation'
+            finally:
+                sa_event.remove(Session.engine, 'before_cursor_execute', count_query)
+                session.rollback()
+
+
+def _legacy_timetable(events):
+    """
+    The half hour expansion that schedule/panelist_schedule and
+    panel_app_management/panel_poc_schedule used before panels.timetables
+    existed. Only kept around for benchmarking.
+    """
+    event_times = defaultdict(lambda: defaultdict(lambda: (1, '')))
+    for event in events:
+        for timeslot in event.half_hours:
+            rowspan = event.duration if timeslot == event.start_time else 0
+            event_times[timeslot][c.EVENT_LOCATIONS[event.location]] = (rowspan, event.name)
+
+    schedule = []
+    locations = sorted(set(sum([list(locations) for locations in event_times.values()], [])))
+    if event_times:
+        when = min(event_times)
+        while when <= max(event_times):
+            schedule.append([when, [event_times[when][where] for where in locations]])
+            when += timedelta(minutes=30)
+    return schedule, locations
+
+
+if c.DEV_BOX:
+    @entry_point
+    def benchmark_panelist_timetables():
+        """
+        Times building every panelist's timetable with panels.timetables against
+        the legacy per-attendee implementation, for 1,500 synthetic panelists
+        each assigned to a handful of non-overlapping events from a synthetic
+        4 day schedule filling every configured location.
+        """
+        import random
+        from time import perf_counter
+        from panels.timetables import build_timetables
+
+        rng = random.Random(0)
+        events, locations, slot_count = _synthetic_schedule(days=4, locations=c.EVENT_LOCATION_OPTS)
+        assignments = defaultdict(list)
+        for i in range(1500):
+            taken = set()
+            for event in rng.sample(events, rng.randint(1, 6)):
+                if not taken & event.half_hours:
+                    taken |= event.half_hours
+                    assignments['panelist {}'.format(i)].append(event)
+
+        rows = [(attendee_id, event.location, event.name, event.start_time, event.duration)
+                for attendee_id, assigned in assignments.items() for event in assigned]
+        print('Building timetables for {} panelists assigned to {} events'.format(len(assignments), len(rows)))
+
+        started = perf_counter()
+        legacy = {attendee_id: _legacy_timetable(assigned) for attendee_id, assigned in assignments.items()}
+        legacy_time = perf_counter() - started
+
+        started = perf_counter()
+        timetables = build_timetables(rows)
+        bulk_time = perf_counter() - started
+
+        assert timetables == legacy, 'timetables differ from the legacy implementation'
+        print('legacy: {:.3f}s  bulk: {:.3f}s  speedup: {:.1f}x'.format(
+            legacy_time, bulk_time, legacy_time / max(bulk_time, 1e-9)))
+
+
+if c.DEV_BOX:
+    @entry_point
+    def benchmark_notification_rendering():
+        """
+        Times rendering attraction notifications for 2,000 unsaved signups spread
+        over 10 events, rendering every message from scratch the way
+        send_attraction_notifications used to, against NotificationRenderer.
+        """
+        from time import perf_counter
+        from panels.notification_templates import TEXT_TPL, NotificationRenderer
+
+        attraction = Attraction(id=str(uuid.uuid4()), name='Rendering Benchmark', advance_checkin=900)
+        feature = AttractionFeature(id=str(uuid.uuid4()), name='Rendering Benchmark')
+        feature.attraction = attraction
+        signups = []
+        for e_i in range(10):
+            event = AttractionEvent(
+                id=str(uuid.uuid4()),
+                location=c.EVENT_LOCATION_OPTS[e_i % len(c.EVENT_LOCATION_OPTS)][0],
+                start_time=datetime.now(pytz.UTC) + timedelta(hours=e_i))
+            event.feature = feature
+            event.attraction = attraction
+            for i in range(200):
+                attendee = Attendee(id=str(uuid.uuid4()), first_name='Attendee {}'.format(i))
+                signup = AttractionSignup(id=str(uuid.uuid4()), attraction_event_id=event.id)
+                signup.attendee, signup.event = attendee, event
+                signups.append(signup)
+
+        templates = ['emails/attractions_notification.html', 'emails/attractions_welcome.html']
+        messages = [(template, signup, 'is at {}'.format(signup.event.checkin_start_time_label))
+                    for signup in signups for template in templates]
+        print('Rendering {} emails and {} texts'.format(len(messages), len(signups)))
+
+        started = perf_counter()
+        legacy = [render(template, {'signup': signup, 'checkin': checkin, 'c': c}).decode('utf-8')
+                  for template, signup, checkin in messages]
+        legacy += [TEXT_TPL.format(signup=signup, checkin=checkin) for template, signup, checkin in messages[::2]]
+        legacy_time = perf_counter() - started
+
+        started = perf_counter()
+        renderer = NotificationRenderer()
+        rendered = [renderer.email(template, signup, checkin) for template, signup, checkin in messages]
+        rendered += [renderer.text(signup, checkin) for template, signup, checkin in messages[::2]]
+        shared_time = perf_counter() - started
+
+        assert rendered == legacy, 'rendered notifications differ from rendering each one from scratch'
+        print('legacy: {:.1f}us/message  shared: {:.1f}us/message  speedup: {:.1f}x'.format(
+            legacy_time * 1e6 / len(legacy), shared_time * 1e6 / len(rendered), legacy_time / max(shared_time, 1e-9)))
+
+
+if c.DEV_BOX:
+    @entry_point
+    def load_test_attraction_signups():
+        """
+        Hammers a single AttractionEvent with concurrent signups from a pool
+        of threads, each using its own session, then checks that the event
+        wasn't oversold and reports the throughput. Everything it creates is
+        deleted afterwards.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from time import perf_counter
+
+        SLOTS, ATTENDEES, THREADS = 50, 500, 32
+
+        Session.initialize_db(initialize=True)
+        with Session() as session:
+            owner = session.query(AdminAccount).first()
+            attraction = Attraction(name='Signup Load Test {}'.format(uuid.uuid4().hex), owner_id=owner.id)
+            feature = AttractionFeature(name='Signup Load Test')
+            attraction.features.append(feature)
+            event = AttractionEvent(
+                attraction_id=attraction.id,
+                location=c.EVENT_LOCATION_OPTS[0][0],
+                start_time=datetime.now(pytz.UTC) + timedelta(days=1),
+                slots=SLOTS)
+            feature.events.append(event)
+            attendees = [
+                Attendee(first_name='Signup Load', last_name='Test {}'.format(i),
+                         email='signup_load_test_{}@example.com'.format(i))
+                for i in range(ATTENDEES)]
+            session.add(attraction)
+            session.add_all(attendees)
+            session.commit()
+            attraction_id, event_id = attraction.id, event.id
+            attendee_ids = [attendee.id for attendee in attendees]
+
+        def signup(attendee_id):
+            with Session() as session:
+                event = session.query(AttractionEvent).get(event_id)
+                if event.is_sold_out:
+                    return 'sold out'
+                try:
+                    event.attendee_signups.append(session.query(Attendee).get(attendee_id))
+                    session.commit()
+                    return 'signed up'
+                except AttractionEventSoldOut:
+                    session.rollback()
+                    return 'sold out after check'
+                except Exception as ex:
+                    session.rollback()
+                    return type(ex).__name__
+
+        try:
+            started = perf_counter()
+            with ThreadPoolExecutor(THREADS) as pool:
+                results = list(pool.map(signup, attendee_ids))
+            elapsed = perf_counter() - started
+
+            with Session() as session:
+                signups = session.query(AttractionSignup).filter_by(attraction_event_id=event_id).count()
+                signup_count = session.query(AttractionEvent.signup_count).filter_by(id=event_id).scalar()
+
+            print('{} signup attempts for {} slots from {} threads in {:.3f}s ({:.0f} attempts/s)'.format(
+                len(results), SLOTS, THREADS, elapsed, len(results) / max(elapsed, 1e-9)))
+            for outcome in sorted(set(results)):
+                print('  {}: {}'.format(outcome, results.count(outcome)))
+            print('signup rows: {}  signup_count: {}'.format(signups, signup_count))
+            assert signups == signup_count == results.count('signed up') <= SLOTS, 'the event was oversold'
+        finally:
+            with Session() as session:
+                signup_ids = session.query(AttractionSignup.id).filter_by(attraction_event_id=event_id)
+                session.query(AttractionNotificationOutbox).filter(
+                    AttractionNotificationOutbox.attraction_signup_id.in_(signup_ids.subquery())) \
+                    .delete(synchronize_session=False)
+                session.query(AttractionSignup).filter_by(attraction_event_id=event_id).delete()
+                session.query(AttractionEvent).filter_by(id=event_id).delete()
+                session.query(AttractionFeature).filter_by(attraction_id=attraction_id).delete()
+                session.query(Attraction).filter_by(id=attraction_id).delete()
+                session.query(Attendee).filter(Attendee.id.in_(attendee_ids)).delete(synchronize_session=False)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0
+
+
+if c.DEV_BOX:
+    @entry_point
+    def benchmark_attraction_notifications():
+        """
+        Runs the attraction notification tasks end to end against a fake
+        Twilio client and email sink, each with a little latency.
+
+        Seeds attractions full of events and signups, then fast-forwards a
+        simulated clock one TASK_INTERVAL at a time until every checkin
+        reminder has come due, running send_attraction_notifications at each
+        step. Reports notifications sent per second and how far the sent
+        time of each checkin reminder was from its due time (negative means
+        it went out early), then times picking up a batch of replies.
+        Everything it creates is deleted afterwards.
+        """
+        assert c.PANELS_TWILIO_NUMBER, 'panels_twilio_number must be set to benchmark attraction notifications'
+        from time import perf_counter
+        import panels.notifications as notifications
+        from panels.dispatch import Dispatcher, TokenBucket
+        from panels.notification_fakes import EmailSink, FakeTwilioClient, SimulatedClock
+
+        ATTRACTIONS, EVENTS, SIGNUPS, ATTENDEES = 10, 8, 25, 250
+        SMS_LATENCY, EMAIL_LATENCY = 0.05, 0.02
+
+        clock = SimulatedClock()
+        invalid_numbers = {'+1202555{:04d}'.format(i): 21211 for i in range(0, ATTENDEES, 50)}
+        fake_twilio = FakeTwilioClient(latency=SMS_LATENCY, error_codes=invalid_numbers, clock=clock)
+        email_sink = EmailSink(latency=EMAIL_LATENCY)
+        dispatcher = Dispatcher(c.NOTIFICATION_WORKERS, {
+            'sms': TokenBucket(c.NOTIFICATION_SMS_RATE, c.NOTIFICATION_SMS_BURST),
+            'email': TokenBucket(c.NOTIFICATION_EMAIL_RATE, c.NOTIFICATION_EMAIL_BURST)})
+        real_twilio_client, real_email_sender = notifications.twilio_client, notifications.email_sender
+        notifications.twilio_client, notifications.email_sender = fake_twilio, email_sink
+
+        Session.initialize_db(initialize=True)
+        with Session() as session:
+            owner = session.query(AdminAccount).first()
+            attendees = [
+                Attendee(first_name='Notification Benchmark', last_name=str(i),
+                         email='notification_benchmark_{}@example.com'.format(i),
+                         cellphone='(202) 555-{:04d}'.format(i),
+                         notification_pref=Attendee.NOTIFICATION_TEXT if i % 2 else Attendee.NOTIFICATION_EMAIL)
+                for i in range(ATTENDEES)]
+            session.add_all(attendees)
+
+            first_start = clock() + timedelta(hours=2)
+            attractions = []
+            for a_i in range(ATTRACTIONS):
+                attraction = Attraction(
+                    name='Notification Benchmark {}'.format(uuid.uuid4().hex),
+                    owner_id=owner.id,
+                    advance_checkin=900,
+                    advance_notices=[0, 300, 900])
+                feature = AttractionFeature(name='Notification Benchmark')
+                attraction.features.append(feature)
+                for e_i in range(EVENTS):
+                    event = AttractionEvent(
+                        attraction_id=attraction.id,
+                        location=c.EVENT_LOCATION_OPTS[a_i % len(c.EVENT_LOCATION_OPTS)][0],
+                        start_time=first_start + timedelta(minutes=30 * e_i),
+                        slots=SIGNUPS)
+                    feature.events.append(event)
+                    for i in range(SIGNUPS):
+                        event.attendee_signups.append(attendees[(a_i * SIGNUPS + e_i + i * 7) % ATTENDEES])
+                attractions.append(attraction)
+            session.add_all(attractions)
+            session.commit()
+
+            attraction_ids = [attraction.id for attraction in attractions]
+            attendee_ids = [attendee.id for attendee in attendees]
+            due_times = {
+                (attendee_id, AttractionEvent.get_ident(attraction_event_id, advance_notice)): due_at
+                for attendee_id, attraction_event_id, advance_notice, due_at in session.query(
+                    AttractionSignup.attendee_id,
+                    AttractionSignup.attraction_event_id,
+                    AttractionNotificationOutbox.advance_notice,
+                    AttractionNotificationOutbox.due_at)
+                .join(AttractionNotificationOutbox,
+                      AttractionNotificationOutbox.attraction_signup_id == AttractionSignup.id)
+                .filter(AttractionSignup.attraction_id.in_(attraction_ids))}
+            last_due = max(due_times.values())
+
+        try:
+            print('Seeded {} signups due {} notifications, last one due {}'.format(
+                ATTRACTIONS * EVENTS * SIGNUPS, len(due_times), last_due))
+
+            runs, busy = 0, 0.0
+            while clock() <= last_due + timedelta(seconds=notifications.TASK_INTERVAL):
+                started = perf_counter()
+                with Session() as session:
+                    notifications.send_attraction_notifications(session, dispatcher, clock)
+                elapsed = perf_counter() - started
+                runs, busy = runs + 1, busy + elapsed
+                clock.advance(max(0, notifications.TASK_INTERVAL - elapsed))
+
+            with Session() as session:
+                sent = session.query(
+                    AttractionNotification.attendee_id,
+                    AttractionNotification.ident,
+                    AttractionNotification.sent_time) \
+                    .filter(AttractionNotification.attraction_id.in_(attraction_ids)).all()
+            lags = [(sent_time - due_times[attendee_id, ident]).total_seconds()
+                    for attendee_id, ident, sent_time in sent
+                    if '_' in ident and (attendee_id, ident) in due_times]
+
+            print('{} runs took {:.3f}s: {} notifications recorded, {} texts and {} emails sent ({:.0f} notifications/s)'.format(
+                runs, busy, len(sent), len(fake_twilio.sent), len(email_sink.sent), len(sent) / max(busy, 1e-9)))
+            print('checkin reminder lag: min {:.0f}s  p50 {:.0f}s  p95 {:.0f}s  max {:.0f}s'.format(
+                min(lags or [0]), _percentile(lags, 50), _percentile(lags, 95), max(lags or [0])))
+
+            for message in fake_twilio.sent[::10]:
+                fake_twilio.receive(message.to, c.PANELS_TWILIO_NUMBER, 'N')
+            started = perf_counter()
+            with Session() as session:
+                notifications.check_attraction_notification_replies(session)
+            elapsed = perf_counter() - started
+            with Session() as session:
+                replies = session.query(AttractionNotificationReply) \
+                    .filter(AttractionNotificationReply.attraction_id.in_(attraction_ids)).count()
+            print('{} of {} replies matched in {:.3f}s'.format(replies, len(fake_twilio.received), elapsed))
+        finally:
+            notifications.twilio_client, notifications.email_sender = real_twilio_client, real_email_sender
+            dispatcher.shutdown()
+            with Session() as session:
+                signup_ids = session.query(AttractionSignup.id).filter(AttractionSignup.attraction_id.in_(attraction_ids))
+                session.query(AttractionNotificationOutbox).filter(
+                    AttractionNotificationOutbox.attraction_signup_id.in_(signup_ids.subquery())) \
+                    .delete(synchronize_session=False)
+                for model in [AttractionNotificationReply, AttractionNotification, AttractionSignup, AttractionEvent,
+                              AttractionFeature, Attraction]:
+                    column = model.id if model is Attraction else model.attraction_id
+                    session.query(model).filter(column.in_(attraction_ids)).delete(synchronize_session=False)
+                session.query(Attendee).filter(Attendee.id.in_(attendee_ids)).delete(synchronize_session=False)
+
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 # DEV TOOLS - DUMPSTER FIRE - DEV TOOLS - DUMPSTER FIRE - DEV TOOLS - DUMPSTER
 # =============================================================================
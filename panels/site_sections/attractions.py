@@ -1,3 +1,6 @@
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
 from uber.common import *
 from uber.site_sections.preregistration import check_post_con
 
@@ -44,6 +47,31 @@ def _model_for_id(session, model, id, options=None, filters=[]):
     return query.first()
 
 
+def _conflicting_signup_event_id(session, event, attendee):
+    """
+    Returns the id of the event that stands in the way of signing the
+    attendee up for `event`, or None if nothing does.
+
+    That's `event` itself if they're already signed up for it, otherwise any
+    event they're signed up for that the attraction's restriction rules out.
+    This is a single probe of the attraction_signup unique indexes, which
+    also enforce the restriction against concurrent signups.
+    """
+    attraction = event.attraction
+    conflicts = [AttractionSignup.attraction_event_id == event.id]
+    if attraction.restriction == Attraction.PER_ATTRACTION:
+        conflicts.append(AttractionSignup.attraction_id == attraction.id)
+    elif attraction.restriction == Attraction.PER_FEATURE:
+        conflicts.append(
+            AttractionSignup.attraction_feature_id
+            == event.attraction_feature_id)
+
+    return session.query(AttractionSignup.attraction_event_id) \
+        .filter(AttractionSignup.attendee_id == attendee.id, or_(*conflicts)) \
+        .order_by((AttractionSignup.attraction_event_id == event.id).desc()) \
+        .limit(1).scalar()
+
+
 @all_renderable()
 @check_post_con
 class Root:
@@ -68,9 +96,7 @@ class Root:
 
     def features(self, session, id=None, slug=None, **params):
         filters = [Attraction.is_public == True]
-        options = subqueryload(Attraction.public_features) \
-            .subqueryload(AttractionFeature.events) \
-                .subqueryload(AttractionEvent.attendees)
+        options = subqueryload(Attraction.public_features)
 
         if slug:
             attraction = session.query(Attraction) \
@@ -84,12 +110,12 @@ class Root:
             raise HTTPRedirect('index')
         return {
             'attraction': attraction,
+            'summaries': attraction.available_events_summaries(),
             'show_all': params.get('show_all')}
 
     def events(self, session, id=None, slug=None, feature=None, **params):
         filters = [AttractionFeature.is_public == True]
-        options = subqueryload(AttractionFeature.events) \
-            .subqueryload(AttractionEvent.attendees)
+        options = subqueryload(AttractionFeature.events)
 
         if slug and feature:
             attraction = session.query(Attraction).filter(
@@ -177,22 +203,35 @@ class Root:
 
         old_remaining_slots = event.remaining_slots
 
-        if event not in attendee.attraction_events:
-            attraction = event.feature.attraction
-            if attraction.restriction == Attraction.PER_ATTRACTION:
-                if attraction in attendee.attractions:
-                    return {'error': '{} is already signed up for {}'.format(
-                            attendee.first_name, attraction.name)}
-            elif attraction.restriction == Attraction.PER_FEATURE:
-                if event.feature in attendee.attraction_features:
-                    return {'error': '{} is already signed up for {}'.format(
-                            attendee.first_name, event.feature.name)}
-
+        conflict_id = _conflicting_signup_event_id(session, event, attendee)
+        if conflict_id is None:
             if event.is_sold_out:
                 return {'error': '{} is already sold out'.format(event.label)}
 
-            event.attendee_signups.append(attendee)
-            session.commit()
+            try:
+                event.attendee_signups.append(attendee)
+                session.commit()
+            except AttractionEventSoldOut:
+                # Someone else claimed the last slot after our check above
+                session.rollback()
+                return {'error': '{} is already sold out'.format(event.label)}
+            except IntegrityError:
+                # A concurrent request signed this attendee up for this
+                # event, or for one the attraction's restriction rules out
+                session.rollback()
+                conflict_id = _conflicting_signup_event_id(
+                    session, event, attendee)
+                if conflict_id is None:
+                    # Not a signup conflict, so the attendee wasn't signed up
+                    raise
+
+        if conflict_id is not None and conflict_id != event.id:
+            if event.attraction.restriction == Attraction.PER_ATTRACTION:
+                name = event.attraction.name
+            else:
+                name = event.feature.name
+            return {'error': '{} is already signed up for {}'.format(
+                    attendee.first_name, name)}
 
         return {
             'first_name': attendee.first_name,
@@ -1,6 +1,161 @@
+from sqlalchemy.exc import IntegrityError
+
 from uber.common import *
+from uber.decorators import _set_response_filename
 from panels.models.attraction import *
+from panels.checkin_lookup import lookup_checkin_signups
+from panels.notifications import notification_metrics
 from panels.site_sections.attractions import _attendee_for_badge_num
+from panels.streaming import csv_chunks, streamable
+
+
+# How many signups the streaming exports fetch from the database at a time
+YIELD_PER = 500
+
+
+# The format of the scan times queued by checkin.html, which come from
+# JavaScript's Date.toISOString()
+CHECKIN_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def _is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except Exception:
+        return False
+    return True
+
+
+def _is_checkin_operation(operation):
+    """
+    Whether `operation` has the shape `_apply_checkin_batch` takes: string
+    `key` and `signup_id` values, and a `checkin_time`, which may be null.
+    """
+    return isinstance(operation, dict) \
+        and isinstance(operation.get('key'), str) and operation['key'] \
+        and isinstance(operation.get('signup_id'), str) \
+        and 'checkin_time' in operation
+
+
+def _checkin_result(operation):
+    return {
+        'signup_id': operation.attraction_signup_id,
+        'is_checked_in': operation.checkin_time is not None,
+        'error': operation.error or None}
+
+
+def _apply_checkin_batch(session, operations):
+    """
+    Applies a batch of check ins synced from the check-in page, without
+    committing them.
+
+    Each operation is a dict `{'key', 'signup_id', 'checkin_time'}`, applied
+    in order, and must pass `_is_checkin_operation`. `key` is the idempotency
+    key the page generated for the scan, and `checkin_time` is when it was
+    scanned, or null to undo a check in.
+    An operation whose key has already been synced isn't applied again, and
+    gets the result it got the first time. Checking in a signup that's
+    already checked in keeps the earlier check in time, and scan times in
+    the future are treated as right now.
+
+    Returns:
+        dict: Maps each operation's key to `{'signup_id', 'is_checked_in',
+            'error'}`, where `is_checked_in` is the signup's state after
+            the operation.
+    """
+    now = datetime.now(pytz.UTC)
+    keys = [operation['key'] for operation in operations]
+    synced = {
+        operation.idempotency_key: operation
+        for operation in session.query(AttractionCheckinOperation)
+            .filter(AttractionCheckinOperation.idempotency_key.in_(keys))}
+
+    signup_ids = {
+        operation['signup_id'] for operation in operations
+        if operation['key'] not in synced}
+    signup_ids = [id for id in signup_ids if _is_uuid(id)]
+    signups = {
+        signup.id: signup for signup in session.query(AttractionSignup)
+            .filter(AttractionSignup.id.in_(signup_ids))} if signup_ids else {}
+
+    results = {}
+    for operation in operations:
+        key = operation['key']
+        if key not in synced:
+            signup = signups.get(operation['signup_id'])
+            error = ''
+            try:
+                checkin_time = operation['checkin_time']
+                if checkin_time is not None:
+                    checkin_time = min(now, datetime.strptime(
+                        checkin_time, CHECKIN_TIME_FORMAT).replace(tzinfo=pytz.UTC))
+            except (TypeError, ValueError):
+                error = 'Invalid check in time: {}'.format(operation['checkin_time'])
+
+            if not signup:
+                error = 'No such signup'
+            elif not error:
+                if checkin_time is None:
+                    signup.checkin_time = utcmin.datetime
+                elif not signup.is_checked_in:
+                    signup.checkin_time = checkin_time
+
+            synced[key] = AttractionCheckinOperation(
+                idempotency_key=key,
+                attraction_signup_id=signup.id if signup else None,
+                checkin_time=signup.checkin_time if signup and signup.is_checked_in else None,
+                synced_time=now,
+                error=error)
+            session.add(synced[key])
+        results[key] = _checkin_result(synced[key])
+    return results
+
+
+def _time_label(when):
+    return when.astimezone(c.EVENT_TIMEZONE).strftime('%-I:%M %p %A')
+
+
+def _stream_signup_rows(*filters):
+    """
+    Yields the rows of a signup export, one per signup of the events matching
+    `filters`, from a single column-only query that's fetched YIELD_PER rows
+    at a time.
+    """
+    yield ['Feature', 'Event Start', 'Event End', 'Location', 'Name',
+           'Badge Number', 'Signup Time', 'Checked In', 'Checkin Time']
+
+    with Session() as session:
+        query = session.query(
+            AttractionFeature.name,
+            AttractionEvent.start_time,
+            AttractionEvent.duration,
+            AttractionEvent.location,
+            Attendee.first_name,
+            Attendee.last_name,
+            Attendee.badge_num,
+            AttractionSignup.signup_time,
+            AttractionSignup.checkin_time) \
+            .join(AttractionEvent, AttractionSignup.attraction_event_id == AttractionEvent.id) \
+            .join(AttractionFeature, AttractionEvent.attraction_feature_id == AttractionFeature.id) \
+            .join(Attendee, AttractionSignup.attendee_id == Attendee.id) \
+            .filter(*filters) \
+            .order_by(AttractionFeature.name, AttractionEvent.start_time,
+                      AttractionEvent.location, AttractionSignup.signup_time) \
+            .yield_per(YIELD_PER)
+
+        for (feature_name, start_time, duration, location, first_name,
+                last_name, badge_num, signup_time, checkin_time) in query:
+            is_checked_in = checkin_time > utcmin.datetime
+            yield [
+                feature_name,
+                _time_label(start_time),
+                _time_label(start_time + timedelta(seconds=duration)),
+                c.EVENT_LOCATIONS.get(location, ''),
+                '{} {}'.format(first_name, last_name),
+                badge_num or '',
+                _time_label(signup_time),
+                'Yes' if is_checked_in else 'No',
+                _time_label(checkin_time) if is_checked_in else '']
 
 
 @all_renderable(c.STUFF)
@@ -56,8 +211,7 @@ class Root:
                 .options(
                     subqueryload(Attraction.department),
                     subqueryload(Attraction.features)
-                        .subqueryload(AttractionFeature.events)
-                            .subqueryload(AttractionEvent.attendees)) \
+                        .subqueryload(AttractionFeature.events)) \
                 .order_by(Attraction.id).one()
 
         return {
@@ -172,19 +326,21 @@ class Root:
         else:
             raise HTTPRedirect('form?id={}&message={}', attraction_id, message)
 
-    @csv_file
-    def export_feature(self, out, session, id):
-        from uber.decorators import _set_response_filename
+    @streamable
+    def export_feature(self, session, id):
         feature = session.query(AttractionFeature).get(id)
+        cherrypy.response.headers['Content-Type'] = 'application/csv'
         _set_response_filename('{}.csv'.format(filename_safe(feature.name)))
-        out.writerow(['Name', 'Signup Time', 'Checkin Time'])
-        for event in feature.events:
-            for signup in event.signups:
-                out.writerow([
-                    signup.attendee.full_name,
-                    signup.signup_time_label,
-                    signup.checkin_time_label
-                ])
+        return csv_chunks(_stream_signup_rows(
+            AttractionEvent.attraction_feature_id == feature.id))
+
+    @streamable
+    def export_attraction(self, session, id):
+        attraction = session.query(Attraction).get(id)
+        cherrypy.response.headers['Content-Type'] = 'application/csv'
+        _set_response_filename('{}.csv'.format(filename_safe(attraction.name)))
+        return csv_chunks(_stream_signup_rows(
+            AttractionEvent.attraction_id == attraction.id))
 
     def event(
             self,
@@ -407,6 +563,24 @@ class Root:
                 }
             }
 
+    @renderable_override(c.STUFF, c.PEOPLE, c.REG_AT_CON)
+    @ajax
+    def lookup_signups(self, session, badge_num, attraction_id=None):
+        """
+        The lightweight version of get_signups used by the check-in page,
+        which only returns the fields the page shows.
+        """
+        if cherrypy.request.method == 'POST':
+            try:
+                result = lookup_checkin_signups(
+                    session, int(badge_num), attraction_id or None)
+            except ValueError:
+                result = None
+
+            if not result:
+                return {'error': 'Unrecognized badge number: {}'.format(badge_num)}
+            return {'result': result}
+
     @renderable_override(c.STUFF, c.PEOPLE, c.REG_AT_CON)
     @ajax
     def checkin_signup(self, session, id):
@@ -422,6 +596,31 @@ class Root:
         if message:
             return {'error': message}
 
+    @renderable_override(c.STUFF, c.PEOPLE, c.REG_AT_CON)
+    @ajax
+    def sync_checkins(self, session, operations):
+        """
+        Takes a JSON list of the check ins queued by the check-in page (see
+        `_apply_checkin_batch`) and applies them in a single transaction,
+        returning the result of each one by its idempotency key.
+        """
+        if cherrypy.request.method == 'POST':
+            try:
+                operations = json.loads(operations)
+            except ValueError:
+                operations = None
+            if not isinstance(operations, list) or not all(_is_checkin_operation(op) for op in operations):
+                return {'error': 'Invalid list of check ins'}
+
+            try:
+                results = _apply_checkin_batch(session, operations)
+                session.commit()
+            except IntegrityError:
+                # Another request synced some of these at the same time
+                session.rollback()
+                return {'error': 'These check ins are already being synced, please try again'}
+            return {'results': results}
+
     @renderable_override(c.STUFF, c.PEOPLE, c.REG_AT_CON)
     @ajax
     def undo_checkin_signup(self, session, id):
@@ -429,3 +628,20 @@ class Root:
             signup = session.query(AttractionSignup).get(id)
             signup.checkin_time = utcmin.datetime
             session.commit()
+
+    def notification_metrics(self, session):
+        """
+        The recent runs of the attraction notification tasks, for keeping an
+        eye on how far behind the reminders are running.
+        """
+        tasks = notification_metrics.to_dict()
+        attraction_ids = set(
+            id for task in tasks.values() for run in task['runs']
+            for id in run['scanned'] if id != 'twilio')
+        attractions = session.query(Attraction.id, Attraction.name) \
+            .filter(Attraction.id.in_(attraction_ids)) if attraction_ids else []
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return json.dumps({
+            'tasks': tasks,
+            'attractions': dict(attractions)})
@@ -0,0 +1,41 @@
+from uber.common import *
+
+from panels.models import *
+from panels.notifications import is_valid_twilio_request, \
+    record_attraction_notification_reply
+
+
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response></Response>'
+
+
+@all_renderable()
+class Root:
+
+    def inbound(self, session, **params):
+        """
+        Twilio's incoming message webhook for PANELS_TWILIO_NUMBER, which
+        should be configured to POST to c.URL_BASE/attractions_sms/inbound.
+
+        Replies are recorded as soon as they arrive, so "N" drop-outs free up
+        their slots immediately. Requests that aren't signed by Twilio are
+        rejected, since a reply can cancel someone's signup.
+        """
+        url = '{}/attractions_sms/inbound'.format(c.URL_BASE)
+        signature = cherrypy.request.headers.get('X-Twilio-Signature', '')
+        if cherrypy.request.method != 'POST' \
+                or not is_valid_twilio_request(url, params, signature):
+            raise cherrypy.HTTPError(403, 'Invalid Twilio signature')
+
+        existing = session.query(AttractionNotificationReply.id) \
+            .filter_by(sid=params.get('MessageSid', '')).first()
+        if not existing:
+            record_attraction_notification_reply(
+                session,
+                sid=params.get('MessageSid', ''),
+                from_=params.get('From', ''),
+                to=params.get('To', ''),
+                body=params.get('Body', ''),
+                sent_time=datetime.now(pytz.UTC))
+
+        cherrypy.response.headers['Content-Type'] = 'text/xml'
+        return EMPTY_TWIML
@@ -1,5 +1,374 @@
+from email.utils import formatdate, parsedate_to_datetime
+from itertools import groupby
+
+from sqlalchemy import case
+
 from uber.custom_tags import normalize_newlines
+from uber.decorators import _set_response_filename
 from panels import *
+from panels.schedule_grid import schedule_grid, schedule_version, slot_for_time
+from panels.streaming import chunked, csv_chunks, streamable, template_chunks
+from panels.timetables import panelist_timetables
+
+
+# How many rows the streaming exports fetch from the database at a time
+YIELD_PER = 500
+
+
+def _location_order(locations):
+    """
+    Returns a SQL expression which sorts Event.location in the same order as
+    the given list of location ids.
+    """
+    return case({loc: i for i, loc in enumerate(locations)}, value=Event.location, else_=len(locations))
+
+
+def _locations_by_label():
+    return [loc for loc, label in sorted(c.EVENT_LOCATION_OPTS, key=lambda opt: opt[1])]
+
+
+def _panel_locations():
+    return [loc for loc, label in c.EVENT_LOCATION_OPTS if 'Panel' in label or 'Autograph' in label]
+
+
+def _group_by_location_label(rows, transform):
+    """
+    Groups rows that are already ordered by location into
+    `(location_label, [transform(row), ...])` tuples, only holding on to one
+    location's rows at a time.
+    """
+    for location, group in groupby(rows, key=lambda row: row.location):
+        yield c.EVENT_LOCATIONS[location], [transform(row) for row in group]
+
+
+def _not_modified(etag, last_modified):
+    if_none_match = cherrypy.request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    if_modified_since = cherrypy.request.headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(last_modified.timestamp()) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def _versioned_feed(key, make_chunks):
+    """
+    Tags one of the public schedule feeds with the current schedule_version.
+
+    Conditional requests for the current version are answered with a 304
+    before anything touches the database. Otherwise the body is streamed
+    from `make_chunks()` the first time it's requested for each version,
+    and served from memory after that.
+    """
+    number, etag, last_modified = schedule_version.current()
+    cherrypy.response.headers['ETag'] = etag
+    cherrypy.response.headers['Last-Modified'] = formatdate(last_modified.timestamp(), usegmt=True)
+
+    if _not_modified(etag, last_modified):
+        cherrypy.response.status = 304
+        return []
+
+    body = schedule_version.cached_body(key, number)
+    if body is not None:
+        return [body]
+    return schedule_version.caching(key, number, make_chunks())
+
+
+def _stream_time_ordered_rows():
+    with Session() as session:
+        query = session.query(Event).order_by(Event.start_time, Event.duration, Event.location).yield_per(YIELD_PER)
+        for event in query:
+            yield [event.timespan(30), event.name, event.location_label]
+
+
+def _stream_xml_schedule():
+    with Session() as session:
+        query = session.query(Event.name, Event.location, Event.start_time, Event.duration, Event.description) \
+            .order_by(_location_order(c.ORDERED_EVENT_LOCS), Event.start_time).yield_per(YIELD_PER)
+
+        yield from _group_by_location_label(query, lambda event: {
+            'name': event.name,
+            'start_time': event.start_time,
+            'minutes': (event.duration or 0) * 30,
+            'description': event.description
+        })
+
+
+def _stream_tsv_schedule():
+    with Session() as session:
+        query = session.query(Event.name, Event.location, Event.start_time, Event.duration, Event.description) \
+            .order_by(_location_order(c.ORDERED_EVENT_LOCS), Event.start_time).yield_per(YIELD_PER)
+
+        def tsv_event(event):
+            start_time = event.start_time.astimezone(c.EVENT_TIMEZONE)
+            return {
+                'name': event.name,
+                'date': start_time.strftime('%m/%d/%Y'),
+                'start_time': start_time.strftime('%I:%M:%S %p'),
+                'end_time': (start_time + timedelta(minutes=30 * (event.duration or 0))).strftime('%I:%M:%S %p'),
+                'description': normalize_newlines(event.description).replace('\n', ' ')
+            }
+
+        yield from _group_by_location_label(query, tsv_event)
+
+
+def _stream_csv_rows():
+    yield ['Session Title', 'Date', 'Time Start', 'Time End', 'Room/Location',
+           'Schedule Track (Optional)', 'Description (Optional)', 'Allow Checkin (Optional)',
+           'Checkin Begin (Optional)', 'Limit Spaces? (Optional)', 'Allow Waitlist (Optional)']
+
+    with Session() as session:
+        query = session.query(Event.name, Event.location, Event.start_time, Event.duration, Event.description) \
+            .order_by(_location_order(_locations_by_label()), Event.start_time).yield_per(YIELD_PER)
+
+        for event in query:
+            start_time = event.start_time.astimezone(c.EVENT_TIMEZONE)
+            yield [
+                event.name,
+                start_time.strftime('%m/%d/%Y'),
+                start_time.strftime('%I:%M:%S %p'),
+                (start_time + timedelta(minutes=30 * (event.duration or 0))).strftime('%I:%M:%S %p'),
+                c.EVENT_LOCATIONS[event.location],
+                '',
+                normalize_newlines(event.description).replace('\n', ' '),
+                '', '', '', ''
+            ]
+
+
+def _panel_rows(session):
+    """
+    Column-only query for the panels exports, ordered by start time and then
+    location label. Rows have `id`, `name`, `location`, `start_time`,
+    `duration`, and `description` attributes.
+    """
+    return session.query(Event.id, Event.name, Event.location, Event.start_time, Event.duration, Event.description) \
+        .order_by(Event.start_time, _location_order(_locations_by_label())).yield_per(YIELD_PER)
+
+
+def _local_hour(when):
+    return when.astimezone(c.EVENT_TIMEZONE).strftime('%I%p %a').lstrip('0')
+
+
+def _stream_panels_rows():
+    yield ['Panel', 'Time', 'Duration', 'Room', 'Description', 'Panelists']
+
+    with Session() as session:
+        panelist_names = session.panelist_names_by_event()
+        for event in _panel_rows(session).filter(Event.location.in_(_panel_locations())):
+            yield [event.name,
+                   _local_hour(event.start_time),
+                   '{} minutes'.format((event.duration or 0) * 30),
+                   c.EVENT_LOCATIONS[event.location],
+                   event.description,
+                   ' / '.join(panelist_names[event.id])]
+
+
+def _stream_panels_json():
+    with Session() as session:
+        panelist_names = session.panelist_names_by_event()
+
+        yield '['
+        for i, event in enumerate(_panel_rows(session)):
+            minutes = (event.duration or 0) * 30
+            end_time = event.start_time + timedelta(minutes=minutes)
+            yield (', ' if i else '') + json.dumps({
+                'name': event.name,
+                'location': c.EVENT_LOCATIONS[event.location],
+                'start': _local_hour(event.start_time),
+                'end': _local_hour(end_time),
+                'start_unix': int(mktime(event.start_time.utctimetuple())),
+                'end_unix': int(mktime(end_time.utctimetuple())),
+                'duration': minutes,
+                'description': event.description,
+                'panelists': panelist_names[event.id]
+            })
+        yield ']'
+
+
+def _overlap_error(snapshot, by_location, event_id, ignore_id=None):
+    """
+    Checks one event from a batch snapshot against every other event in its
+    location, returning the same message as `overlapping_events`.
+    """
+    event = snapshot[event_id]
+    if not event['duration']:
+        return None
+
+    end_time = event['start_time'] + timedelta(minutes=30 * event['duration'])
+    for other_id in by_location[event['location']]:
+        other = snapshot[other_id]
+        if other_id not in (event_id, ignore_id) and other['duration'] and other['start_time'] < end_time \
+                and other['start_time'] + timedelta(minutes=30 * other['duration']) > event['start_time']:
+            return '"{}" overlaps with the time/duration you specified for "{}"'.format(other['name'], event['name'])
+
+
+# The keys each batch action needs, and which of them are event ids
+_SCHEDULE_BATCH_KEYS = {
+    'move': ['id', 'location', 'start_slot'],
+    'swap': ['id1', 'id2']
+}
+_SCHEDULE_BATCH_IDS = ['id', 'id1', 'id2']
+
+
+def _schedule_operation_error(operation):
+    """
+    Returns what is wrong with the shape of one batch operation, or None if
+    it has every key its action needs, with values of the right types.
+    """
+    action = operation.get('action')
+    if not isinstance(action, str) or action not in _SCHEDULE_BATCH_KEYS:
+        return 'Unknown action {!r}'.format(action)
+
+    missing = [key for key in _SCHEDULE_BATCH_KEYS[action] if key not in operation]
+    if missing:
+        return 'Missing {} for {}'.format(', '.join(missing), action)
+
+    if not all(isinstance(operation[key], str) for key in _SCHEDULE_BATCH_KEYS[action] if key in _SCHEDULE_BATCH_IDS):
+        return 'Invalid event id'
+
+    if action == 'move':
+        try:
+            location, start_slot = int(operation['location']), int(operation['start_slot'])
+        except (TypeError, ValueError):
+            return 'Invalid location or start slot'
+        if location not in c.EVENT_LOCATIONS:
+            return 'Invalid location'
+
+
+def _plan_schedule_operation(snapshot, operation):
+    """
+    Applies one batch operation, which `_schedule_operation_error` has
+    passed, to the snapshot, returning the list of `(event_id, ignore_id)`
+    overlap checks it needs once every operation has been applied. Raises
+    KeyError if an event isn't in the snapshot.
+    """
+    if operation['action'] == 'move':
+        event = snapshot[operation['id']]
+        event['location'] = int(operation['location'])
+        event['start_time'] = c.EPOCH + timedelta(minutes=30 * int(operation['start_slot']))
+        return [(operation['id'], None)]
+
+    e1, e2 = snapshot[operation['id1']], snapshot[operation['id2']]
+    (e1['location'], e1['start_time']), (e2['location'], e2['start_time']) = \
+        (e2['location'], e2['start_time']), (e1['location'], e1['start_time'])
+    return [(operation['id1'], operation['id2']), (operation['id2'], operation['id1'])]
+
+
+def _apply_schedule_batch(session, operations):
+    """
+    Applies a list of moves and swaps from the drag-and-drop editor as a
+    single transaction.
+
+    Each operation is a dict, either `{'action': 'move', 'id', 'location',
+    'start_slot'}` or `{'action': 'swap', 'id1', 'id2'}`, applied in order;
+    malformed operations are reported rather than looked up.
+    The resulting schedule is validated in memory against one snapshot of
+    every location the batch touches, so reshuffling a room costs two
+    queries no matter how many events move, and an event may move into a
+    slot that a later operation frees up.
+
+    Returns:
+        list: One error message (or None) per operation. Nothing is changed
+            unless every entry is None.
+    """
+    errors = [_schedule_operation_error(operation) for operation in operations]
+    event_ids = {operation[key] for operation, error in zip(operations, errors) if not error
+                 for key in _SCHEDULE_BATCH_KEYS[operation['action']] if key in _SCHEDULE_BATCH_IDS}
+    events = {event.id: event for event in session.query(Event).filter(Event.id.in_(event_ids))}
+    snapshot = {event.id: {
+        'name': event.name,
+        'location': event.location,
+        'start_time': event.start_time,
+        'duration': event.duration
+    } for event in events.values()}
+
+    checks = []
+    for i, operation in enumerate(operations):
+        if errors[i]:
+            checks.append([])
+            continue
+        try:
+            checks.append(_plan_schedule_operation(snapshot, operation))
+        except KeyError:
+            checks.append([])
+            errors[i] = 'No such event'
+
+    locations = {event.location for event in events.values()} | {event['location'] for event in snapshot.values()}
+    for row in session.query(Event.id, Event.name, Event.location, Event.start_time, Event.duration) \
+            .filter(Event.location.in_(locations), ~Event.id.in_(list(events))):
+        snapshot[row.id] = {
+            'name': row.name,
+            'location': row.location,
+            'start_time': row.start_time,
+            'duration': row.duration
+        }
+
+    by_location = defaultdict(list)
+    for event_id, event in snapshot.items():
+        by_location[event['location']].append(event_id)
+
+    for i, operation_checks in enumerate(checks):
+        for event_id, ignore_id in operation_checks:
+            errors[i] = errors[i] or _overlap_error(snapshot, by_location, event_id, ignore_id)
+
+    if not any(errors):
+        for event_id, event in events.items():
+            event.location = snapshot[event_id]['location']
+            event.start_time = snapshot[event_id]['start_time']
+        session.commit()
+    return errors
+
+
+def _edit_payload(session, start_slot=None, end_slot=None, locations=None):
+    """
+    Returns the events shown by schedule/edit in a compact, columnar form:
+    parallel `ids`, `names`, `durations`, `slots`, and `locations` arrays,
+    plus `panelists`, which holds a list of indexes into the
+    `panelist_ids`/`panelist_names` table for each event.
+
+    Events can be limited to the ones starting in `[start_slot, end_slot)`
+    and/or in the given locations, so the editor can fetch the schedule a
+    day at a time.
+    """
+    query = session.query(Event.id, Event.name, Event.duration, Event.start_time, Event.location)
+    if start_slot is not None:
+        query = query.filter(Event.start_time >= c.EPOCH + timedelta(minutes=30 * start_slot))
+    if end_slot is not None:
+        query = query.filter(Event.start_time < c.EPOCH + timedelta(minutes=30 * end_slot))
+    if locations:
+        query = query.filter(Event.location.in_(locations))
+    events = query.order_by(Event.start_time).all()
+
+    payload = {
+        'ids': [event.id for event in events],
+        'names': [event.name for event in events],
+        'durations': [event.duration for event in events],
+        'slots': [slot_for_time(event.start_time) for event in events],
+        'locations': [event.location for event in events],
+        'panelists': [[] for event in events],
+        'panelist_ids': [],
+        'panelist_names': []
+    }
+    if not events:
+        return payload
+
+    event_index = {event_id: i for i, event_id in enumerate(payload['ids'])}
+    panelist_index = {}
+    for event_id, attendee_id, first_name, last_name in session.query(
+            AssignedPanelist.event_id, Attendee.id, Attendee.first_name, Attendee.last_name) \
+            .join(Attendee, AssignedPanelist.attendee_id == Attendee.id) \
+            .filter(AssignedPanelist.event_id.in_(payload['ids'])):
+        if attendee_id not in panelist_index:
+            panelist_index[attendee_id] = len(payload['panelist_ids'])
+            payload['panelist_ids'].append(attendee_id)
+            payload['panelist_names'].append('{} {}'.format(first_name, last_name))
+        payload['panelists'][event_index[event_id]].append(panelist_index[attendee_id])
+    return payload
 
 
 @all_renderable(c.STUFF)
@@ -11,133 +380,56 @@ class Root:
         else:
             raise HTTPRedirect("internal")
 
-    @cached
     def internal(self, session, message=''):
         if c.HIDE_SCHEDULE and not AdminAccount.access_set() and not cherrypy.session.get('staffer_id'):
             return "The " + c.EVENT_NAME + " schedule is being developed and will be made public when it's closer to being finalized."
 
-        schedule = defaultdict(lambda: defaultdict(list))
-        for event in session.query(Event).all():
-            schedule[event.start_time_local][event.location].append(event)
-            for i in range(1, event.duration):
-                half_hour = event.start_time_local + timedelta(minutes=30 * i)
-                schedule[half_hour][event.location].append(c.EVENT_BOOKED)
-
-        max_simul = {}
-        for id, name in c.EVENT_LOCATION_OPTS:
-            max_events = 1
-            for i in range(2 * c.CON_LENGTH):
-                half_hour = c.EPOCH + timedelta(minutes=30 * i)
-                max_events = max(max_events, len(schedule[half_hour][id]))
-            max_simul[id] = max_events
-
-        for half_hour in schedule:
-            for location in schedule[half_hour]:
-                for event in schedule[half_hour][location]:
-                    if isinstance(event, Event):
-                        simul = max(len(schedule[half_hour][event.location]) for half_hour in event.half_hours)
-                        event.colspan = 1 if simul > 1 else max_simul[event.location]
-                        for i in range(1, event.duration):
-                            schedule[half_hour + timedelta(minutes=30*i)][event.location].remove(c.EVENT_BOOKED)
-                            schedule[half_hour + timedelta(minutes=30*i)][event.location].append(event.colspan)
-
-        for half_hour in schedule:
-            for id, name in c.EVENT_LOCATION_OPTS:
-                span_sum = sum(getattr(e, 'colspan', e) for e in schedule[half_hour][id])
-                for i in range(max_simul[id] - span_sum):
-                    schedule[half_hour][id].append(c.EVENT_OPEN)
-
-            schedule[half_hour] = sorted(schedule[half_hour].items(), key=lambda tup: c.ORDERED_EVENT_LOCS.index(tup[0]))
-
-        max_simul = [(id, c.EVENT_LOCATIONS[id], colspan) for id, colspan in max_simul.items()]
+        schedule, max_simul = schedule_grid.get(session)
         return {
             'message':   message,
-            'schedule':  sorted(schedule.items()),
-            'max_simul': sorted(max_simul, key=lambda tup: c.ORDERED_EVENT_LOCS.index(tup[0]))
+            'schedule':  schedule,
+            'max_simul': max_simul
         }
 
     @unrestricted
-    @csv_file
-    def time_ordered(self, out, session):
-        for event in session.query(Event).order_by('start_time', 'duration', 'location').all():
-            out.writerow([event.timespan(30), event.name, event.location_label])
+    @streamable
+    def time_ordered(self):
+        cherrypy.response.headers['Content-Type'] = 'application/csv'
+        _set_response_filename('time_ordered.csv')
+        return _versioned_feed('time_ordered', lambda: csv_chunks(_stream_time_ordered_rows()))
 
     @unrestricted
-    def xml(self, session):
+    @streamable
+    def xml(self):
         cherrypy.response.headers['Content-type'] = 'text/xml'
-        schedule = defaultdict(list)
-        for event in session.query(Event).order_by('start_time').all():
-            schedule[event.location_label].append(event)
-        return render('schedule/schedule.xml', {
-            'schedule': sorted(schedule.items(), key=lambda tup: c.ORDERED_EVENT_LOCS.index(tup[1][0].location))
-        })
+        return _versioned_feed('xml', lambda: template_chunks(
+            'schedule/schedule.xml', {'schedule': _stream_xml_schedule()}))
 
     @unrestricted
-    def schedule_tsv(self, session):
+    @streamable
+    def schedule_tsv(self):
         cherrypy.response.headers['Content-Type'] = 'text/tsv'
         cherrypy.response.headers['Content-Disposition'] = 'attachment;filename=Schedule-{}.tsv'.format(int(localized_now().timestamp()))
-        schedule = defaultdict(list)
-        for event in session.query(Event).order_by('start_time').all():
-            schedule[event.location_label].append(dict(event.to_dict(), **{
-                'date': event.start_time_local.strftime('%m/%d/%Y'),
-                'start_time': event.start_time_local.strftime('%I:%M:%S %p'),
-                'end_time': (event.start_time_local + timedelta(minutes=event.minutes)).strftime('%I:%M:%S %p'),
-                'description': normalize_newlines(event.description).replace('\n', ' ')
-            }))
+        return _versioned_feed('schedule_tsv', lambda: template_chunks(
+            'schedule/schedule.tsv', {'schedule': _stream_tsv_schedule()}))
 
-        return render('schedule/schedule.tsv', {
-            'schedule': sorted(schedule.items(), key=lambda tup: c.ORDERED_EVENT_LOCS.index(tup[1][0]['location']))
-        })
+    @streamable
+    def csv(self):
+        cherrypy.response.headers['Content-Type'] = 'application/csv'
+        _set_response_filename('csv.csv')
+        return csv_chunks(_stream_csv_rows())
 
-    @csv_file
-    def csv(self, out, session):
-        out.writerow(['Session Title', 'Date', 'Time Start', 'Time End', 'Room/Location',
-                      'Schedule Track (Optional)', 'Description (Optional)', 'Allow Checkin (Optional)',
-                      'Checkin Begin (Optional)', 'Limit Spaces? (Optional)', 'Allow Waitlist (Optional)'])
-        rows = []
-        for event in session.query(Event).order_by('start_time').all():
-            rows.append([
-                event.name,
-                event.start_time_local.strftime('%m/%d/%Y'),
-                event.start_time_local.strftime('%I:%M:%S %p'),
-                (event.start_time_local + timedelta(minutes=event.minutes)).strftime('%I:%M:%S %p'),
-                event.location_label,
-                '',
-                normalize_newlines(event.description).replace('\n', ' '),
-                '', '', '', ''
-            ])
-        for r in sorted(rows, key=lambda tup: tup[4]):
-            out.writerow(r)
-
-    @csv_file
-    def panels(self, out, session):
-        out.writerow(['Panel', 'Time', 'Duration', 'Room', 'Description', 'Panelists'])
-        for event in sorted(session.query(Event).all(), key=lambda e: [e.start_time, e.location_label]):
-            if 'Panel' in event.location_label or 'Autograph' in event.location_label:
-                out.writerow([event.name,
-                              event.start_time_local.strftime('%I%p %a').lstrip('0'),
-                              '{} minutes'.format(event.minutes),
-                              event.location_label,
-                              event.description,
-                              ' / '.join(ap.attendee.full_name for ap in sorted(event.assigned_panelists, key=lambda ap: ap.attendee.full_name))])
+    @streamable
+    def panels(self):
+        cherrypy.response.headers['Content-Type'] = 'application/csv'
+        _set_response_filename('panels.csv')
+        return csv_chunks(_stream_panels_rows())
 
     @unrestricted
-    def panels_json(self, session):
+    @streamable
+    def panels_json(self):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        return json.dumps([
-            {
-                'name': event.name,
-                'location': event.location_label,
-                'start': event.start_time_local.strftime('%I%p %a').lstrip('0'),
-                'end': event.end_time_local.strftime('%I%p %a').lstrip('0'),
-                'start_unix': int(mktime(event.start_time.utctimetuple())),
-                'end_unix': int(mktime(event.end_time.utctimetuple())),
-                'duration': event.minutes,
-                'description': event.description,
-                'panelists': [panelist.attendee.full_name for panelist in event.assigned_panelists]
-            }
-            for event in sorted(session.query(Event).all(), key=lambda e: [e.start_time, e.location_label])
-        ], indent=4).encode('utf-8')
+        return _versioned_feed('panels_json', lambda: chunked(_stream_panels_json()))
 
     @unrestricted
     def now(self, session, when=None):
@@ -146,23 +438,7 @@ class Root:
         else:
             now = c.EVENT_TIMEZONE.localize(datetime.combine(localized_now().date(), time(localized_now().hour)))
 
-        current, upcoming = [], []
-        for loc, desc in c.EVENT_LOCATION_OPTS:
-            approx = session.query(Event).filter(Event.location == loc,
-                                                 Event.start_time >= now - timedelta(hours=6),
-                                                 Event.start_time <= now).all()
-            for event in approx:
-                if now in event.half_hours:
-                    current.append(event)
-
-            next = session.query(Event) \
-                          .filter(Event.location == loc,
-                                  Event.start_time >= now + timedelta(minutes=30),
-                                  Event.start_time <= now + timedelta(hours=4)) \
-                                .order_by('start_time').all()
-            if next:
-                upcoming.extend(event for event in next if event.start_time == next[0].start_time)
-
+        current, upcoming = session.current_and_upcoming_events(now)
         return {
             'now':      now if when else localized_now(),
             'current':  current,
@@ -238,22 +514,38 @@ class Root:
             session.commit()
         return resp
 
-    def edit(self, session, message=''):
-        panelists = defaultdict(dict)
-        for ap in session.query(AssignedPanelist) \
-                         .options(joinedload(AssignedPanelist.event), joinedload(AssignedPanelist.attendee)).all():
-            panelists[ap.event.id][ap.attendee.id] = ap.attendee.full_name
+    @ajax
+    def batch(self, session, operations):
+        """
+        Takes a JSON list of moves and swaps (see `_apply_schedule_batch`)
+        and either applies all of them or none, returning an error (or
+        null) for each one.
+        """
+        try:
+            operations = json.loads(operations)
+        except ValueError:
+            operations = None
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            return {'error': 'Invalid list of changes', 'errors': []}
+
+        errors = _apply_schedule_batch(session, operations)
+        return {'error': next((error for error in errors if error), None), 'errors': errors}
 
-        events = []
-        for e in session.query(Event).order_by('start_time').all():
-            d = {attr: getattr(e, attr) for attr in ['id', 'name', 'duration', 'start_slot', 'location', 'description']}
-            d['panelists'] = panelists[e.id]
-            events.append(d)
+    def edit(self, session, message=''):
+        return {'message': message}
 
-        return {
-            'events':  events,
-            'message': message
-        }
+    @ajax
+    def edit_events(self, session, start_slot='', end_slot='', locations=''):
+        """
+        Returns a slice of the schedule/edit payload (see `_edit_payload`),
+        optionally limited to a range of half hour slots and/or a comma
+        separated list of locations.
+        """
+        return _edit_payload(
+            session,
+            start_slot=int(start_slot) if start_slot else None,
+            end_slot=int(end_slot) if end_slot else None,
+            locations=[int(loc) for loc in locations.split(',') if loc])
 
     def panelists_owed_refunds(self, session):
         return {
@@ -267,25 +559,21 @@ class Root:
     @unrestricted
     def panelist_schedule(self, session, id):
         attendee = session.attendee(id)
-        events = defaultdict(lambda: defaultdict(lambda: (1, '')))
-        for ap in attendee.assigned_panelists:
-            for timeslot in ap.event.half_hours:
-                rowspan = ap.event.duration if timeslot == ap.event.start_time else 0
-                events[timeslot][ap.event.location_label] = (rowspan, ap.event.name)
-
-        schedule = []
-        when = min(events)
-        locations = sorted(set(sum([list(locations) for locations in events.values()], [])))
-        while when <= max(events):
-            schedule.append([when, [events[when][where] for where in locations]])
-            when += timedelta(minutes=30)
-
+        schedule, locations = panelist_timetables(session, [attendee.id]).get(attendee.id, ([], []))
         return {
             'attendee': attendee,
             'schedule': schedule,
             'locations': locations
         }
 
+    def all_panelist_schedules(self, session):
+        timetables = panelist_timetables(session)
+        attendees = session.query(Attendee).filter(Attendee.id.in_(list(timetables))) \
+            .order_by(Attendee.last_name, Attendee.first_name)
+        return {
+            'panelists': [(attendee,) + timetables[attendee.id] for attendee in attendees]
+        }
+
     @unrestricted
     @csv_file
     def panel_tech_needs(self, out, session):
@@ -0,0 +1,68 @@
+import csv
+from io import StringIO
+
+from uber.jinja import JinjaEnv
+
+
+__all__ = ['CHUNK_SIZE', 'chunked', 'csv_chunks', 'streamable', 'template_chunks']
+
+
+# Roughly how many characters to buffer before handing a chunk to CherryPy
+CHUNK_SIZE = 64 * 1024
+
+
+def streamable(func):
+    """
+    Tells CherryPy to stream the response body of the decorated page handler
+    rather than buffering it. The handler must set all of its headers before
+    returning, and should return an iterable of bytes, such as the ones
+    returned by `chunked`, `csv_chunks`, or `template_chunks`.
+
+    Note that the session passed to page handlers is closed as soon as the
+    handler returns, so streamed bodies need to open their own session.
+    """
+    func._cp_config = dict(getattr(func, '_cp_config', {}), **{'response.stream': True})
+    return func
+
+
+def chunked(pieces, size=CHUNK_SIZE, encoding='utf-8'):
+    """
+    Joins an iterable of strings into encoded chunks of at least `size`
+    characters (except for the last one).
+    """
+    buffer, buffered = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield ''.join(buffer).encode(encoding)
+            buffer, buffered = [], 0
+    if buffer:
+        yield ''.join(buffer).encode(encoding)
+
+
+def csv_chunks(rows, size=CHUNK_SIZE, encoding='utf-8', **fmtparams):
+    """
+    Writes each row from an iterable of rows as CSV, yielding encoded chunks.
+    Any `fmtparams` are passed along to `csv.writer`.
+    """
+    out = StringIO()
+    writer = csv.writer(out, **fmtparams)
+
+    def lines():
+        for row in rows:
+            writer.writerow(row)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+    return chunked(lines(), size, encoding)
+
+
+def template_chunks(template_name, data, size=CHUNK_SIZE, encoding='utf-8'):
+    """
+    Renders a template incrementally, yielding encoded chunks. Any iterables
+    in `data` are only consumed as the template reaches them.
+    """
+    template = JinjaEnv.env().get_template(template_name)
+    return chunked(template.generate(data), size, encoding)
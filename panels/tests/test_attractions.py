@@ -0,0 +1,408 @@
+import pytest
+import pytz
+from sqlalchemy.exc import IntegrityError
+from uuid import uuid4
+
+from panels import *
+from panels.checkin_lookup import lookup_checkin_signups
+from panels import notifications
+from panels.dispatch import Dispatcher, TokenBucket
+from panels.notification_fakes import EmailSink
+from panels.notifications import _claim_notifications, _record_notifications, record_attraction_notification_reply
+from panels.site_sections.attractions import _conflicting_signup_event_id
+from panels.site_sections.attractions_admin import _apply_checkin_batch, _is_checkin_operation, _stream_signup_rows
+
+from uber.tests.conftest import *
+
+
+@pytest.fixture()
+def attraction_event():
+    with Session() as session:
+        session.insert_test_admin_account()
+
+    with Session() as session:
+        admin = session.query(Attendee).filter(Attendee.email == 'magfest@example.com').one()
+        attraction = Attraction(name='Test Attraction', owner_id=admin.admin_account.id)
+        feature = AttractionFeature(name='Test Feature')
+        attraction.features.append(feature)
+        event = AttractionEvent(
+            attraction_id=attraction.id,
+            location=c.EVENT_LOCATION_OPTS[0][0],
+            start_time=datetime.now(pytz.UTC) + timedelta(days=1),
+            duration=900,
+            slots=2)
+        feature.events.append(event)
+        session.add(attraction)
+        session.commit()
+
+        yield event
+
+        session.query(AttractionNotificationReply).filter_by(attraction_id=attraction.id).delete(synchronize_session=False)
+        session.query(AttractionNotification).filter_by(attraction_id=attraction.id).delete(synchronize_session=False)
+        signup_ids = session.query(AttractionSignup.id).filter_by(attraction_id=attraction.id)
+        session.query(AttractionNotificationOutbox).filter(
+            AttractionNotificationOutbox.attraction_signup_id.in_(signup_ids.subquery())).delete(synchronize_session=False)
+        session.query(AttractionCheckinOperation).filter(
+            AttractionCheckinOperation.idempotency_key.startswith(attraction.id)).delete(synchronize_session=False)
+        session.query(AttractionSignup).filter_by(attraction_id=attraction.id).delete(synchronize_session=False)
+        session.query(Attendee).filter_by(first_name='Signup').delete(synchronize_session=False)
+        session.query(AttractionEvent).filter_by(attraction_id=attraction.id).delete(synchronize_session=False)
+        session.delete(feature)
+        session.delete(attraction)
+        session.delete(admin)
+
+
+def _attendees(session, count):
+    attendees = [
+        Attendee(first_name='Signup', last_name=str(i), email='signup{}@example.com'.format(i))
+        for i in range(count)]
+    session.add_all(attendees)
+    session.commit()
+    return attendees
+
+
+def test_signup_count_tracks_signups(attraction_event):
+    session = attraction_event.session
+    first, second = _attendees(session, 2)
+    assert attraction_event.signup_count == 0
+    assert attraction_event.remaining_slots == 2
+
+    attraction_event.attendee_signups.append(first)
+    session.commit()
+    assert attraction_event.signup_count == 1
+    assert not attraction_event.is_sold_out
+
+    attraction_event.attendee_signups.append(second)
+    session.commit()
+    assert attraction_event.signup_count == 2
+    assert attraction_event.remaining_slots == 0
+    assert attraction_event.is_sold_out
+
+    session.delete(session.query(AttractionSignup).filter_by(attendee_id=first.id).one())
+    session.commit()
+    assert attraction_event.signup_count == 1
+    assert attraction_event.remaining_slots == 1
+
+
+def test_unsaved_event_has_every_slot_remaining():
+    event = AttractionEvent(slots=2)
+    assert event.remaining_slots == 2
+    assert not event.is_sold_out
+
+
+def test_signups_cannot_oversell(attraction_event):
+    session = attraction_event.session
+    attendees = _attendees(session, 3)
+    for attendee in attendees[:2]:
+        attraction_event.attendee_signups.append(attendee)
+        session.commit()
+
+    attraction_event.attendee_signups.append(attendees[2])
+    with pytest.raises(AttractionEventSoldOut):
+        session.commit()
+    session.rollback()
+
+    assert attraction_event.signup_count == 2
+    assert session.query(AttractionSignup).filter_by(attraction_event_id=attraction_event.id).count() == 2
+
+
+@pytest.mark.parametrize('restriction', [Attraction.PER_FEATURE, Attraction.PER_ATTRACTION])
+def test_restrictions_are_enforced_by_unique_indexes(attraction_event, restriction):
+    session = attraction_event.session
+    attraction_event.attraction.restriction = restriction
+    other_event = AttractionEvent(
+        attraction_id=attraction_event.attraction_id,
+        location=attraction_event.location,
+        start_time=attraction_event.start_time + timedelta(hours=1),
+        slots=2)
+    attraction_event.feature.events.append(other_event)
+    attendee, = _attendees(session, 1)
+
+    assert _conflicting_signup_event_id(session, other_event, attendee) is None
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+    assert attendee.attraction_signups[0].restriction == restriction
+    assert _conflicting_signup_event_id(session, attraction_event, attendee) == attraction_event.id
+    assert _conflicting_signup_event_id(session, other_event, attendee) == attraction_event.id
+
+    # Bypass the probe, as a concurrent request would
+    other_event.attendee_signups.append(attendee)
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.rollback()
+    assert other_event.signup_count == 0
+
+
+def test_unrestricted_signups_are_not_limited(attraction_event):
+    session = attraction_event.session
+    other_event = AttractionEvent(
+        attraction_id=attraction_event.attraction_id,
+        location=attraction_event.location,
+        start_time=attraction_event.start_time + timedelta(hours=1),
+        slots=2)
+    attraction_event.feature.events.append(other_event)
+    attendee, = _attendees(session, 1)
+
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+    assert _conflicting_signup_event_id(session, other_event, attendee) is None
+    other_event.attendee_signups.append(attendee)
+    session.commit()
+    assert other_event.signup_count == 1
+
+
+def test_available_events_summaries(attraction_event):
+    session = attraction_event.session
+    feature = attraction_event.feature
+    attraction = attraction_event.attraction
+    feature.events.append(AttractionEvent(
+        attraction_id=attraction.id,
+        location=attraction_event.location,
+        start_time=attraction_event.start_time + timedelta(hours=6),
+        slots=3))
+    feature.events.append(AttractionEvent(
+        attraction_id=attraction.id,
+        location=attraction_event.location,
+        start_time=datetime.now(pytz.UTC) - timedelta(minutes=10),
+        duration=3600,
+        slots=3))
+    attendee, = _attendees(session, 1)
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+
+    summaries = attraction.available_events_summaries()
+    assert summaries == {feature.id: feature.available_events_summary}
+    assert sum(sum(times.values()) for times in summaries[feature.id].values()) == 1 + 3
+
+    # Events stay available until they end when checkin is allowed anytime
+    attraction.advance_checkin = -1
+    session.commit()
+    summaries = attraction.available_events_summaries()
+    assert summaries == {feature.id: feature.available_events_summary}
+    assert sum(sum(times.values()) for times in summaries[feature.id].values()) == 1 + 3 + 3
+
+
+def _outbox(session, signup):
+    return sorted(session.query(AttractionNotificationOutbox.advance_notice, AttractionNotificationOutbox.due_at)
+                  .filter_by(attraction_signup_id=signup.id))
+
+
+def test_notification_outbox_tracks_due_times(attraction_event):
+    session = attraction_event.session
+    attraction = attraction_event.attraction
+    attraction.advance_notices = [0, 300]
+    attendee, = _attendees(session, 1)
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+
+    signup = attendee.attraction_signups[0]
+    start_time = attraction_event.start_time
+    assert _outbox(session, signup) == [
+        (-1, signup.signup_time), (0, start_time), (300, start_time - timedelta(seconds=300))]
+
+    attraction.advance_checkin = 600
+    session.commit()
+    assert _outbox(session, signup) == [
+        (-1, signup.signup_time),
+        (600, start_time - timedelta(seconds=600)),
+        (900, start_time - timedelta(seconds=900))]
+
+    attraction_event.start_time = start_time = start_time + timedelta(hours=1)
+    session.commit()
+    assert _outbox(session, signup)[1:] == [
+        (600, start_time - timedelta(seconds=600)), (900, start_time - timedelta(seconds=900))]
+
+    signup.checkin_time = datetime.now(pytz.UTC)
+    session.commit()
+    assert _outbox(session, signup) == []
+
+
+def test_notification_outbox_skips_sent_notifications(attraction_event):
+    session = attraction_event.session
+    attendee, = _attendees(session, 1)
+    session.add(AttractionNotification(
+        attraction_event_id=attraction_event.id,
+        attraction_id=attraction_event.attraction_id,
+        attendee_id=attendee.id,
+        notification_type=Attendee.NOTIFICATION_EMAIL,
+        ident=AttractionEvent.get_ident(attraction_event.id, -1)))
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+    assert _outbox(session, attendee.attraction_signups[0]) == []
+
+    session.query(AttractionNotification).filter_by(attendee_id=attendee.id).delete()
+
+
+def test_due_signups_discards_missed_notices(attraction_event):
+    session = attraction_event.session
+    now = datetime.now(pytz.UTC)
+    attraction_event.attraction.advance_notices = [0]
+    attraction_event.start_time = now + timedelta(minutes=2)
+    attendee, = _attendees(session, 1)
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+
+    window = (now - timedelta(minutes=5), now + timedelta(minutes=5))
+    signup = attendee.attraction_signups[0]
+    due = AttractionNotificationOutbox.due_signups(session, *window)
+    assert [notice for id, notice, due_at in due[signup]] == [-1, 0]
+
+    attraction_event.start_time = now - timedelta(minutes=10)
+    session.commit()
+    due = AttractionNotificationOutbox.due_signups(session, *window)
+    assert [notice for id, notice, due_at in due[signup]] == [-1]
+    assert [notice for notice, due_at in _outbox(session, signup)] == [-1]
+
+
+def _notification_fields(attraction_event, attendee):
+    return {
+        'id': str(uuid4()),
+        'attraction_event_id': attraction_event.id,
+        'attraction_id': attraction_event.attraction_id,
+        'attendee_id': attendee.id,
+        'notification_type': Attendee.NOTIFICATION_EMAIL,
+        'ident': AttractionEvent.get_ident(attraction_event.id, 0),
+        'subject': 'Checkin',
+        'body': 'Checkin is right now'}
+
+
+def test_notifications_are_only_claimed_once(attraction_event):
+    session = attraction_event.session
+    first, second = _attendees(session, 2)
+    claims = [_notification_fields(attraction_event, attendee) for attendee in [first, second, first]]
+
+    assert _claim_notifications(session, claims[:2]) == {claims[0]['id'], claims[1]['id']}
+    assert _claim_notifications(session, claims[2:]) == set()
+
+    _record_notifications(session, [{'id': claims[0]['id'], 'sid': 'SM123'}], [claims[1]['id']], [])
+    assert session.query(AttractionNotification.attendee_id, AttractionNotification.sid) \
+        .filter_by(attraction_event_id=attraction_event.id).all() == [(first.id, 'SM123')]
+
+    # Releasing a failed claim lets the notification be retried
+    assert _claim_notifications(session, [_notification_fields(attraction_event, second)])
+
+
+def test_replying_n_drops_out(attraction_event):
+    session = attraction_event.session
+    attendee, = _attendees(session, 1)
+    attendee.cellphone = '(202) 555-0143'
+    attraction_event.attendee_signups.append(attendee)
+    session.add(AttractionNotification(**dict(
+        _notification_fields(attraction_event, attendee), notification_type=Attendee.NOTIFICATION_TEXT, sid='SM1')))
+    session.commit()
+    assert attendee.cellphone_e164 == '+12025550143'
+
+    record_attraction_notification_reply(
+        session, 'SM2', '+12025550143', c.PANELS_TWILIO_NUMBER, 'n', datetime.now(pytz.UTC))
+
+    reply = session.query(AttractionNotificationReply).filter_by(sid='SM2').one()
+    assert (reply.attendee_id, reply.attraction_event_id) == (attendee.id, attraction_event.id)
+    assert attraction_event.signup_count == 0
+    assert not session.query(AttractionSignup).filter_by(attendee_id=attendee.id).count()
+
+
+def test_checkin_lookup_is_invalidated_by_checkins(attraction_event):
+    session = attraction_event.session
+    attendee, = _attendees(session, 1)
+    attendee.badge_num = 99990
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+
+    result = lookup_checkin_signups(session, 99990, attraction_event.attraction_id)
+    assert result['attendee']['id'] == attendee.id
+    assert result['signups'][0]['event']['feature']['name'] == 'Test Feature'
+    assert result['signups'][0]['event']['time_span_label'] == attraction_event.time_span_label
+    assert not result['signups'][0]['is_checked_in']
+    assert lookup_checkin_signups(session, 99990, attraction_event.attraction_id) is result
+
+    signup = session.query(AttractionSignup).filter_by(attendee_id=attendee.id).one()
+    signup.checkin_time = datetime.now(pytz.UTC)
+    session.commit()
+    result = lookup_checkin_signups(session, 99990, attraction_event.attraction_id)
+    assert result['signups'][0]['is_checked_in']
+
+
+def test_checkin_batch_applies_each_key_once(attraction_event):
+    session = attraction_event.session
+    attendee, = _attendees(session, 1)
+    attraction_event.attendee_signups.append(attendee)
+    session.commit()
+    signup = session.query(AttractionSignup).filter_by(attendee_id=attendee.id).one()
+
+    def operation(name, signup_id, checkin_time):
+        key = '{}-{}'.format(attraction_event.attraction_id, name)
+        return {'key': key, 'signup_id': signup_id, 'checkin_time': checkin_time}
+
+    checkin = operation('checkin', signup.id, '2017-01-01T12:00:00.000Z')
+    undo = operation('undo', signup.id, None)
+    missing = operation('missing', str(uuid4()), None)
+
+    results = _apply_checkin_batch(session, [checkin])
+    session.commit()
+    assert results[checkin['key']] == {'signup_id': signup.id, 'is_checked_in': True, 'error': None}
+    assert signup.checkin_time == datetime(2017, 1, 1, 12, tzinfo=pytz.UTC)
+
+    results = _apply_checkin_batch(session, [undo, missing])
+    session.commit()
+    assert not results[undo['key']]['is_checked_in']
+    assert results[missing['key']]['error'] == 'No such signup'
+    assert not signup.is_checked_in
+
+    # Resending the check in returns its original result without redoing it
+    results = _apply_checkin_batch(session, [checkin])
+    session.commit()
+    assert results[checkin['key']]['is_checked_in']
+    assert not signup.is_checked_in
+
+
+def test_checkin_operation_shape():
+    signup_id = str(uuid4())
+    assert _is_checkin_operation({'key': 'a', 'signup_id': signup_id, 'checkin_time': None})
+    assert _is_checkin_operation({'key': 'a', 'signup_id': signup_id, 'checkin_time': '2017-01-01T12:00:00.000Z'})
+    assert not _is_checkin_operation({'key': 'a', 'signup_id': signup_id})
+    assert not _is_checkin_operation({'key': '', 'signup_id': signup_id, 'checkin_time': None})
+    assert not _is_checkin_operation({'key': 'a', 'signup_id': [signup_id], 'checkin_time': None})
+    assert not _is_checkin_operation({'key': 'a', 'signup_id': {}, 'checkin_time': None})
+    assert not _is_checkin_operation(['a', signup_id, None])
+
+
+def test_signup_export_streams_attraction_signups(attraction_event):
+    session = attraction_event.session
+    first, second = _attendees(session, 2)
+    attraction_event.attendee_signups.extend([first, second])
+    session.commit()
+    signup = session.query(AttractionSignup).filter_by(attendee_id=second.id).one()
+    signup.checkin_time = datetime.now(pytz.UTC)
+    session.commit()
+
+    header, *rows = _stream_signup_rows(AttractionEvent.attraction_id == attraction_event.attraction_id)
+    assert header[:5] == ['Feature', 'Event Start', 'Event End', 'Location', 'Name']
+    assert sorted((row[0], row[3], row[4], row[7]) for row in rows) == [
+        ('Test Feature', attraction_event.location_label, 'Signup 0', 'No'),
+        ('Test Feature', attraction_event.location_label, 'Signup 1', 'Yes')]
+
+
+def test_new_attendee_is_welcomed_once(attraction_event, monkeypatch):
+    session = attraction_event.session
+    attendee, = _attendees(session, 1)
+    later_event = AttractionEvent(
+        attraction_id=attraction_event.attraction_id,
+        location=c.EVENT_LOCATION_OPTS[0][0],
+        start_time=attraction_event.start_time + timedelta(hours=1),
+        duration=900,
+        slots=2)
+    attraction_event.feature.events.append(later_event)
+    session.commit()
+    attraction_event.attendee_signups.append(attendee)
+    later_event.attendee_signups.append(attendee)
+    session.commit()
+
+    sink = EmailSink()
+    monkeypatch.setattr(notifications, 'email_sender', sink)
+    dispatcher = Dispatcher(2, {'sms': TokenBucket(1000, 1000), 'email': TokenBucket(1000, 1000)})
+    with dispatcher, Session() as other_session:
+        notifications.send_attraction_notifications(other_session, dispatcher)
+
+    subjects = [email['subject'] for email in sink.sent if email['dest'] == attendee.email]
+    assert len(subjects) == 2
+    assert sum(subject.startswith('Welcome') for subject in subjects) == 1
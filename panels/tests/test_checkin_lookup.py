@@ -0,0 +1,48 @@
+from panels.checkin_lookup import CheckinLookupCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_checkin_lookup_cache_evicts_least_recently_used():
+    cache = CheckinLookupCache(maxsize=2)
+    cache.put((1, None), 'a', {'badge': 1})
+    cache.put((2, None), 'b', {'badge': 2})
+    assert cache.get((1, None)) == {'badge': 1}
+
+    cache.put((3, None), 'c', {'badge': 3})
+    assert cache.get((2, None)) is None
+    assert cache.get((1, None)) == {'badge': 1}
+    assert cache.get((3, None)) == {'badge': 3}
+
+
+def test_checkin_lookup_cache_expires_entries():
+    clock = FakeClock()
+    cache = CheckinLookupCache(ttl=30, clock=clock)
+    cache.put((1, None), 'a', {'badge': 1})
+    clock.now = 29
+    assert cache.get((1, None)) == {'badge': 1}
+    clock.now = 30
+    assert cache.get((1, None)) is None
+
+
+def test_checkin_lookup_cache_invalidates_attendees_and_badges():
+    cache = CheckinLookupCache()
+    cache.put((1, None), 'a', {'badge': 1})
+    cache.put((1, 'attraction'), 'a', {'badge': 1})
+    cache.put((2, None), 'b', {'badge': 2})
+    cache.put((3, None), 'c', {'badge': 3})
+
+    cache.invalidate(attendee_ids=['a'], badge_nums=[2])
+    assert cache.get((1, None)) is None
+    assert cache.get((1, 'attraction')) is None
+    assert cache.get((2, None)) is None
+    assert cache.get((3, None)) == {'badge': 3}
+
+    cache.invalidate()
+    assert cache.get((3, None)) is None
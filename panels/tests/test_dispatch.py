@@ -0,0 +1,61 @@
+from threading import Lock
+
+from panels.dispatch import Dispatcher, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.lock = Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+def test_token_bucket_allows_bursts_then_holds_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(5, burst=3, clock=clock, sleep=clock.sleep)
+    for i in range(3):
+        bucket.acquire()
+    assert clock.now == 0
+
+    for i in range(10):
+        bucket.acquire()
+    assert abs(clock.now - 2.0) < 1e-9
+
+
+def test_token_bucket_refills_up_to_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.try_acquire() == 1
+
+    clock.now += 60
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 1
+
+
+def test_dispatcher_throttles_each_channel_separately():
+    clock = FakeClock()
+    buckets = {
+        'sms': TokenBucket(2, clock=clock, sleep=clock.sleep),
+        'email': TokenBucket(1000, burst=1000, clock=clock, sleep=clock.sleep)}
+
+    def send(dispatcher, channel, i):
+        dispatcher.throttle(channel)
+        return i
+
+    with Dispatcher(4, buckets) as dispatcher:
+        emails = [dispatcher.submit(send, dispatcher, 'email', i) for i in range(20)]
+        assert [future.result() for future in emails] == list(range(20))
+        assert clock.now == 0
+
+        texts = [dispatcher.submit(send, dispatcher, 'sms', i) for i in range(5)]
+        assert [future.result() for future in texts] == list(range(5))
+    assert clock.now >= 2.0
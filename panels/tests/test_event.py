@@ -29,3 +29,49 @@ def test_half_hours():
         c.EPOCH + timedelta(minutes=30),
         c.EPOCH + timedelta(minutes=60)
     }
+
+
+def test_overlapping_events():
+    from panels.model_checks import overlapping_events
+
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    with Session() as session:
+        first = Event(location=location, start_time=c.EPOCH, duration=2, name='First')
+        second = Event(location=location, start_time=c.EPOCH + timedelta(hours=2), duration=2, name='Second')
+        session.add_all([first, second])
+        session.flush()
+
+        event = Event(location=location, start_time=c.EPOCH + timedelta(hours=1), duration=2, name='New')
+        session.add(event)
+        assert not overlapping_events(event)
+
+        event.duration = 3
+        assert overlapping_events(event) == '"Second" overlaps with the time/duration you specified for "New"'
+        assert not overlapping_events(event, second.id)
+
+        event.start_time = c.EPOCH + timedelta(minutes=30)
+        assert overlapping_events(event) == '"First" overlaps with the time/duration you specified for "New"'
+
+        event.location = c.EVENT_LOCATION_OPTS[1][0]
+        assert not overlapping_events(event)
+
+        session.rollback()
+
+
+def test_overlapping_events_finds_the_longest_events():
+    from panels.model_checks import overlapping_events
+
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    longest = max(duration for duration, label in c.EVENT_DURATION_OPTS)
+    with Session() as session:
+        session.add(Event(location=location, start_time=c.EPOCH, duration=longest, name='Marathon'))
+        session.flush()
+
+        event = Event(location=location, start_time=c.EPOCH + timedelta(minutes=30 * (longest - 1)), duration=1, name='New')
+        session.add(event)
+        assert overlapping_events(event) == '"Marathon" overlaps with the time/duration you specified for "New"'
+
+        event.start_time = c.EPOCH + timedelta(minutes=30 * longest)
+        assert not overlapping_events(event)
+
+        session.rollback()
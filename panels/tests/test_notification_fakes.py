@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from twilio.base.exceptions import TwilioRestException
+
+from panels.notification_fakes import EmailSink, FakeTwilioClient, SimulatedClock
+
+
+def test_simulated_clock_fast_forwards():
+    start = datetime(2030, 1, 1, tzinfo=pytz.UTC)
+    clock = SimulatedClock(start)
+    assert start <= clock() < start + timedelta(seconds=5)
+
+    clock.advance(3600)
+    assert start + timedelta(hours=1) <= clock() < start + timedelta(hours=1, seconds=5)
+
+
+def test_fake_twilio_client_sends_and_fails():
+    client = FakeTwilioClient(error_codes={'+12025550199': 21211})
+    message = client.messages.create(to='+12025550143', from_='+12025550100', body='Hi')
+    assert message.sid and not message.error_code
+    assert client.sent == [message]
+
+    with pytest.raises(TwilioRestException) as error:
+        client.messages.create(to='+12025550199', from_='+12025550100', body='Hi')
+    assert error.value.code == 21211
+    assert client.sent == [message]
+
+
+def test_fake_twilio_client_lists_received_messages():
+    clock = SimulatedClock()
+    client = FakeTwilioClient(clock=clock)
+    first = client.receive('+12025550143', '+12025550100', 'N')
+    clock.advance(60)
+    second = client.receive('+12025550144', '+12025550100', 'Y')
+    client.receive('+12025550145', '+12025550111', 'N')
+
+    assert client.messages.list(to='+12025550100') == [first, second]
+    assert client.messages.list(to='+12025550100', date_sent_after=second.date_sent) == [second]
+
+
+def test_email_sink_captures_emails():
+    sink = EmailSink()
+    sink('from@example.com', 'to@example.com', subject='Hello', body='<p>Hi</p>', format='html', ident='abc')
+    assert sink.sent == [{
+        'source': 'from@example.com',
+        'dest': 'to@example.com',
+        'subject': 'Hello',
+        'body': '<p>Hi</p>',
+        'format': 'html',
+        'ident': 'abc'}]
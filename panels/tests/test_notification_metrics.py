@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from panels.notification_metrics import LagHistogram, NotificationMetrics
+
+
+def test_lag_histogram_buckets():
+    histogram = LagHistogram()
+    for seconds in [-90, 0, 10, 45, 45, 5000]:
+        histogram.add(seconds)
+
+    result = histogram.to_dict()
+    assert result['count'] == 6
+    assert result['min'] == -90 and result['max'] == 5000
+    assert result['buckets']['<= -60s'] == 1
+    assert result['buckets']['<= 0s'] == 1
+    assert result['buckets']['<= 30s'] == 1
+    assert result['buckets']['<= 60s'] == 2
+    assert result['buckets']['> 1800s'] == 1
+
+
+def test_notification_metrics_keeps_recent_runs():
+    metrics = NotificationMetrics(interval=180, history=2)
+    due_at = datetime(2030, 1, 1, tzinfo=pytz.UTC)
+    for i in range(3):
+        with metrics.run('panels_send_notifications') as run:
+            run.scanned['attraction'] += i
+            run.record_sent('TEXT', due_at, due_at + timedelta(seconds=20))
+
+    runs = metrics.to_dict()['panels_send_notifications']['runs']
+    assert [run['scanned'] for run in runs] == [{'attraction': 2}, {'attraction': 1}]
+    assert runs[0]['sent'] == {'TEXT': 1}
+    assert runs[0]['lag']['buckets']['<= 30s'] == 1
+
+
+def test_notification_metrics_flags_overruns_and_errors():
+    metrics = NotificationMetrics(interval=0)
+    with pytest.raises(ValueError):
+        with metrics.run('panels_check_notification_replies'):
+            raise ValueError()
+
+    task = metrics.to_dict()['panels_check_notification_replies']
+    assert task['overruns'] == 1
+    assert task['runs'][0]['failures'] == 1
@@ -0,0 +1,74 @@
+import os
+from uuid import uuid4
+
+import pytest
+from uber.jinja import JinjaEnv
+
+import panels
+from panels import *
+from panels.notification_templates import TEXT_TPL, NotificationRenderer, UnsharedAttributeError, _SharedSignup
+
+
+# Every attraction email is rendered through NotificationRenderer
+ATTRACTION_EMAILS = sorted(
+    'emails/' + filename for filename in os.listdir(os.path.join(os.path.dirname(panels.__file__), 'templates', 'emails'))
+    if filename.startswith('attractions_'))
+
+
+def _signups(count):
+    attraction = Attraction(name='Test Attraction', advance_checkin=300)
+    feature = AttractionFeature(name='Test Feature')
+    feature.attraction = attraction
+    event = AttractionEvent(
+        id=str(uuid4()),
+        location=c.EVENT_LOCATION_OPTS[0][0],
+        start_time=datetime.now(pytz.UTC) + timedelta(hours=1))
+    event.feature = feature
+    event.attraction = attraction
+
+    signups = []
+    for i in range(count):
+        signup = AttractionSignup(attraction_event_id=event.id)
+        signup.attendee = Attendee(id=str(uuid4()), first_name='Attendee {}'.format(i))
+        signup.event = event
+        signups.append(signup)
+    return signups
+
+
+def test_renderer_matches_rendering_each_message():
+    assert {'emails/attractions_notification.html', 'emails/attractions_welcome.html'} <= set(ATTRACTION_EMAILS)
+
+    renderer = NotificationRenderer()
+    checkin = 'is in 5 minutes'
+    for template_name in ATTRACTION_EMAILS:
+        for signup in _signups(3):
+            expected = JinjaEnv.env().get_template(template_name).render({'signup': signup, 'checkin': checkin, 'c': c})
+            body = renderer.email(template_name, signup, checkin)
+            assert body == expected
+            assert signup.attendee.first_name in body
+            assert signup.attendee.id in body
+
+            assert renderer.text(signup, checkin) == TEXT_TPL.format(signup=signup, checkin=checkin)
+
+
+def test_renderer_shares_renders_per_event_and_checkin():
+    renderer = NotificationRenderer()
+    signups = _signups(5)
+    for signup in signups:
+        renderer.email('emails/attractions_notification.html', signup, 'is right now')
+        renderer.text(signup, 'is right now')
+    renderer.email('emails/attractions_notification.html', signups[0], 'is in 1 minute')
+
+    assert len(renderer._emails) == 2
+    assert len(renderer._texts) == 1
+
+
+@pytest.mark.parametrize('source', [
+    '{{ signup.attendee.last_name }}',
+    '{{ signup.attendee.full_name }}',
+    '{% if signup.attendee.notification_pref %}text{% endif %}',
+    '{{ signup.checkin_time }}'])
+def test_shared_signup_rejects_per_attendee_attributes(source):
+    signup = _signups(1)[0]
+    with pytest.raises(UnsharedAttributeError):
+        JinjaEnv.env().from_string(source).render({'signup': _SharedSignup(signup.event)})
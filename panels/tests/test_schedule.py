@@ -1,5 +1,6 @@
 import pytest
 import pytz
+from sqlalchemy import event as sa_event
 from panels import *
 from panels.site_sections import schedule
 
@@ -43,7 +44,7 @@ def create_events():
 
 
 def test_csv(create_events, admin_attendee):
-    response = schedule.Root().csv()
+    response = b''.join(schedule.Root().csv())
     if isinstance(response, bytes):
         response = response.decode('utf-8')
 
@@ -53,10 +54,149 @@ def test_csv(create_events, admin_attendee):
 
 
 def test_schedule_tsv(create_events):
-    response = schedule.Root().schedule_tsv()
+    response = b''.join(schedule.Root().schedule_tsv())
     if isinstance(response, bytes):
         response = response.decode('utf-8')
 
     lines = response.split('\n')
     assert len(lines) == 41
     assert lines[0].strip() == 'Session Title\tDate\tTime Start\tTime End\tRoom/Location\tSchedule Track (Optional)\tDescription (Optional)'
+
+
+def test_current_and_upcoming_events(create_events):
+    with Session() as session:
+        current, upcoming = session.current_and_upcoming_events(UTC20DAYSLATER)
+        assert len(current) == len(c.EVENT_LOCATION_OPTS)
+        assert upcoming == []
+
+        current, upcoming = session.current_and_upcoming_events(UTC20DAYSLATER - timedelta(hours=1))
+        assert current == []
+        assert len(upcoming) == len(c.EVENT_LOCATION_OPTS)
+
+        current, upcoming = session.current_and_upcoming_events(UTC20DAYSLATER - timedelta(hours=5))
+        assert current == upcoming == []
+
+
+def _count_queries(func):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa_event.listen(Session.engine, 'before_cursor_execute', count)
+    try:
+        result = func()
+    finally:
+        sa_event.remove(Session.engine, 'before_cursor_execute', count)
+    return len(statements), result
+
+
+def _panels_json():
+    return json.loads(''.join(schedule._stream_panels_json()))
+
+
+def test_panels_json_query_count_does_not_grow_with_panelists(create_events):
+    query_count, panels = _count_queries(_panels_json)
+    assert all(panel['panelists'] == [] for panel in panels)
+
+    with Session() as session:
+        attendees = [
+            Attendee(first_name='Panelist', last_name=str(i), email='panelist{}@example.com'.format(i))
+            for i in range(3)]
+        session.add_all(attendees)
+        for index in range(len(c.EVENT_LOCATION_OPTS)):
+            session.add(Event(
+                location=c.EVENT_LOCATION_OPTS[index][0],
+                start_time=UTC20DAYSLATER + timedelta(hours=1),
+                duration=1,
+                name='Extra Event {}'.format(index)))
+        session.flush()
+        for event in session.query(Event).all():
+            for attendee in attendees:
+                session.add(AssignedPanelist(event_id=event.id, attendee_id=attendee.id))
+
+    try:
+        assert _count_queries(_panels_json)[0] == query_count
+        panels = _panels_json()
+        assert len(panels) == 2 * len(c.EVENT_LOCATION_OPTS)
+        assert all(panel['panelists'] == ['Panelist 0', 'Panelist 1', 'Panelist 2'] for panel in panels)
+    finally:
+        with Session() as session:
+            session.query(AssignedPanelist).delete(synchronize_session=False)
+            session.query(Event).filter(Event.name.startswith('Extra Event')).delete(synchronize_session=False)
+            session.query(Attendee).filter(Attendee.first_name == 'Panelist').delete(synchronize_session=False)
+
+
+def test_apply_schedule_batch(create_events):
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    with Session() as session:
+        first, second = [
+            Event(location=location, start_time=c.EPOCH + timedelta(hours=i), duration=2, name='Batch {}'.format(i))
+            for i in range(2)]
+        session.add_all([first, second])
+        session.commit()
+
+        # Each move lands on the other event's old slot, which is only free
+        # once the whole batch has been applied
+        errors = schedule._apply_schedule_batch(session, [
+            {'action': 'move', 'id': first.id, 'location': location, 'start_slot': 2},
+            {'action': 'move', 'id': second.id, 'location': location, 'start_slot': 0}])
+        assert errors == [None, None]
+        assert (first.start_time, second.start_time) == (c.EPOCH + timedelta(hours=1), c.EPOCH)
+
+        errors = schedule._apply_schedule_batch(session, [
+            {'action': 'move', 'id': first.id, 'location': location, 'start_slot': 1},
+            {'action': 'swap', 'id1': first.id, 'id2': 'nonexistent'},
+            {'action': 'delete', 'id': first.id}])
+        assert errors == [
+            '"Batch 1" overlaps with the time/duration you specified for "Batch 0"',
+            'No such event',
+            "Unknown action 'delete'"]
+
+        session.expire_all()
+        assert first.start_time == c.EPOCH + timedelta(hours=1)
+
+        session.delete(first)
+        session.delete(second)
+
+
+def test_apply_schedule_batch_rejects_malformed_operations(create_events):
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    with Session() as session:
+        event = Event(location=location, start_time=c.EPOCH, duration=2, name='Batch')
+        session.add(event)
+        session.commit()
+
+        errors = schedule._apply_schedule_batch(session, [
+            {'action': 'move', 'id': event.id, 'location': location, 'start_slot': 4},
+            {'action': 'move', 'id': event.id},
+            {'action': 'swap', 'id1': [event.id], 'id2': event.id},
+            {'action': 'move', 'id': {}, 'location': location, 'start_slot': 4},
+            {'action': 'move', 'id': event.id, 'location': [location], 'start_slot': 4},
+            {'action': ['move']}])
+        assert errors == [
+            None,
+            'Missing location, start_slot for move',
+            'Invalid event id',
+            'Invalid event id',
+            'Invalid location or start slot',
+            "Unknown action ['move']"]
+
+        session.expire_all()
+        assert event.start_time == c.EPOCH
+
+        session.delete(event)
+
+
+def test_edit_payload(create_events):
+    with Session() as session:
+        payload = schedule._edit_payload(session)
+        assert len(payload['ids']) == len(c.EVENT_LOCATION_OPTS)
+        assert all(len(payload[key]) == len(payload['ids']) for key in ['names', 'durations', 'slots', 'locations', 'panelists'])
+
+        slot = payload['slots'][0]
+        assert len(schedule._edit_payload(session, start_slot=slot, end_slot=slot + 1)['ids']) == len(payload['ids'])
+        assert schedule._edit_payload(session, end_slot=slot)['ids'] == []
+
+        location = c.EVENT_LOCATION_OPTS[0][0]
+        assert schedule._edit_payload(session, locations=[location])['locations'] == [location]
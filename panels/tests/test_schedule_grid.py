@@ -0,0 +1,148 @@
+from panels import *
+from panels.schedule_grid import ScheduleGrid, ScheduleVersion, build_schedule_grid, layout_location, schedule_grid, schedule_version
+
+
+LOCATIONS = [(1, 'Room 1'), (2, 'Room 2')]
+
+
+def _event(location, slot, duration, name='Event'):
+    return Event(
+        name=name,
+        location=location,
+        start_time=c.EPOCH + timedelta(minutes=30 * slot),
+        duration=duration)
+
+
+def _cells(schedule, slot, location):
+    return dict(schedule[slot][1])[location]
+
+
+def test_layout_location_empty():
+    max_simul, cells = layout_location([], 10)
+    assert max_simul == 1
+    assert not cells
+
+
+def test_layout_location_back_to_back_events_do_not_overlap():
+    e1, e2 = _event(1, 0, 2), _event(1, 2, 2)
+    max_simul, cells = layout_location([(0, 2, e1), (2, 2, e2)], 10)
+    assert max_simul == 1
+    assert e1.colspan == e2.colspan == 1
+    assert cells[0] == [e1]
+    assert cells[1] == [1]
+    assert cells[2] == [e2]
+
+
+def test_layout_location_overlapping_events():
+    e1, e2, e3 = _event(1, 0, 4), _event(1, 1, 2), _event(1, 6, 1)
+    max_simul, cells = layout_location([(0, 4, e1), (1, 2, e2), (6, 1, e3)], 10)
+    assert max_simul == 2
+    assert e1.colspan == e2.colspan == 1
+    assert e3.colspan == 2
+
+
+def test_layout_location_ignores_events_outside_con_for_max_simul():
+    e1, e2 = _event(1, -2, 2), _event(1, -2, 2)
+    max_simul, cells = layout_location([(-2, 2, e1), (-2, 2, e2)], 10)
+    assert max_simul == 1
+    assert cells[-2] == [e1, e2]
+
+
+def test_build_schedule_grid():
+    e1, e2, e3 = _event(1, 0, 2), _event(1, 1, 1), _event(2, 1, 1)
+    schedule, max_simul = build_schedule_grid([e1, e2, e3], LOCATIONS, c.EPOCH, 4)
+
+    assert max_simul == [(1, 'Room 1', 2), (2, 'Room 2', 1)]
+    assert [half_hour for half_hour, row in schedule] == [c.EPOCH + timedelta(minutes=30 * i) for i in range(4)]
+    assert [location for location, cells in schedule[0][1]] == [1, 2]
+
+    assert _cells(schedule, 0, 1) == [e1, c.EVENT_OPEN]
+    assert _cells(schedule, 1, 1) == [e2, 1]
+    assert _cells(schedule, 2, 1) == [c.EVENT_OPEN, c.EVENT_OPEN]
+    assert _cells(schedule, 0, 2) == [c.EVENT_OPEN]
+    assert _cells(schedule, 1, 2) == [e3]
+    assert e3.colspan == 1
+
+
+def _grid_event_names(session, location, grid=schedule_grid):
+    schedule, max_simul = grid.get(session)
+    index = [loc for loc, name in c.EVENT_LOCATION_OPTS].index(location)
+    return [e.name for e in schedule[0][1][index][1] if getattr(e, 'name', None)]
+
+
+def test_schedule_grid_tracks_event_writes():
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    with Session() as session:
+        assert _grid_event_names(session, location) == []
+        session.add(Event(location=location, start_time=c.EPOCH, duration=2, name='Grid Test'))
+
+    with Session() as session:
+        assert _grid_event_names(session, location) == ['Grid Test']
+        event = session.query(Event).filter_by(name='Grid Test').one()
+        event.name = 'Grid Test Renamed'
+
+    with Session() as session:
+        assert _grid_event_names(session, location) == ['Grid Test Renamed']
+        session.delete(session.query(Event).filter_by(name='Grid Test Renamed').one())
+
+    with Session() as session:
+        assert _grid_event_names(session, location) == []
+
+
+def test_schedule_grid_expires_changes_it_was_not_told_about():
+    now = [0]
+    grid = ScheduleGrid(ttl=60, clock=lambda: now[0])
+    location = c.EVENT_LOCATION_OPTS[0][0]
+    with Session() as session:
+        session.add(Event(location=location, start_time=c.EPOCH, duration=2, name='Grid TTL Test'))
+
+    with Session() as session:
+        assert _grid_event_names(session, location, grid) == ['Grid TTL Test']
+        session.query(Event).filter_by(name='Grid TTL Test') \
+            .update({'name': 'Grid TTL Test Renamed'}, synchronize_session=False)
+
+    with Session() as session:
+        assert _grid_event_names(session, location, grid) == ['Grid TTL Test']
+        now[0] = 60
+        assert _grid_event_names(session, location, grid) == ['Grid TTL Test Renamed']
+        session.delete(session.query(Event).filter_by(name='Grid TTL Test Renamed').one())
+
+
+def test_schedule_version_bumped_by_event_writes():
+    number = schedule_version.number
+    with Session() as session:
+        session.add(Event(location=c.EVENT_LOCATION_OPTS[0][0], start_time=c.EPOCH, duration=1, name='Version Test'))
+    assert schedule_version.number == number + 1
+
+    with Session() as session:
+        session.delete(session.query(Event).filter_by(name='Version Test').one())
+    assert schedule_version.number == number + 2
+
+
+def test_schedule_version_caches_bodies_per_version():
+    number, etag, last_modified = schedule_version.current()
+    chunks = schedule_version.caching('test', number, iter([b'a', b'b']))
+    assert schedule_version.cached_body('test', number) is None
+    assert list(chunks) == [b'a', b'b']
+    assert schedule_version.cached_body('test', number) == b'ab'
+
+    schedule_version.bump()
+    assert schedule_version.cached_body('test', number) is None
+    assert schedule_version.etag != etag
+
+
+def test_schedule_version_expires():
+    now = [0]
+    version = ScheduleVersion(ttl=60, clock=lambda: now[0])
+    number, etag, last_modified = version.current()
+    list(version.caching('test', number, iter([b'a'])))
+
+    now[0] = 59
+    assert version.current()[1] == etag
+    now[0] = 60
+    assert version.current()[1] != etag
+    assert version.cached_body('test', number) is None
+
+
+def test_schedule_version_etags_differ_between_processes():
+    assert ScheduleVersion().etag != ScheduleVersion().etag
@@ -0,0 +1,41 @@
+from panels import *
+from panels.timetables import build_timetable, build_timetables
+
+
+LOCATION_1, LOCATION_2 = [loc for loc, label in c.EVENT_LOCATION_OPTS[:2]]
+LABEL_1, LABEL_2 = c.EVENT_LOCATIONS[LOCATION_1], c.EVENT_LOCATIONS[LOCATION_2]
+
+
+def _half_hour(i):
+    return c.EPOCH + timedelta(minutes=30 * i)
+
+
+def test_build_timetable_empty():
+    assert build_timetable([]) == ([], [])
+    assert build_timetable([(LOCATION_1, 'No Time', c.EPOCH, 0)]) == ([], [])
+
+
+def test_build_timetable():
+    schedule, locations = build_timetable([
+        (LOCATION_2, 'Second', _half_hour(3), 1),
+        (LOCATION_1, 'First', _half_hour(0), 2)])
+
+    assert locations == sorted([LABEL_1, LABEL_2])
+    first, second = locations.index(LABEL_1), locations.index(LABEL_2)
+    assert [when for when, cells in schedule] == [_half_hour(i) for i in range(4)]
+    assert schedule[0][1][first] == (2, 'First')
+    assert schedule[1][1][first] == (0, 'First')
+    assert schedule[2][1] == [(1, ''), (1, '')]
+    assert schedule[3][1][second] == (1, 'Second')
+    assert schedule[3][1][first] == (1, '')
+
+
+def test_build_timetables():
+    timetables = build_timetables([
+        ('a', LOCATION_1, 'First', _half_hour(0), 1),
+        ('b', LOCATION_2, 'Second', _half_hour(1), 1),
+        ('a', LOCATION_1, 'Third', _half_hour(1), 1)])
+
+    assert set(timetables) == {'a', 'b'}
+    assert [cells for when, cells in timetables['a'][0]] == [[(1, 'First')], [(1, 'Third')]]
+    assert timetables['b'] == ([[_half_hour(1), [(1, 'Second')]]], [LABEL_2])
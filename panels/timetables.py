@@ -0,0 +1,93 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from uber.config import c
+from panels.models import AssignedPanelist, Event, PanelApplication
+
+
+__all__ = ['build_timetable', 'build_timetables', 'panelist_timetables', 'poc_timetables']
+
+
+HALF_HOUR = timedelta(minutes=30)
+
+# Cell used for half hours with nothing scheduled in a location
+EMPTY_CELL = (1, '')
+
+
+def build_timetable(events):
+    """
+    Builds the personal timetable rendered by schedule/panelist_schedule.html
+    and panel_app_management/panel_poc_schedule.html.
+
+    Args:
+        events (iterable): `(location, name, start_time, duration)` tuples,
+            with `duration` given in half hours.
+
+    Returns:
+        tuple: `(schedule, locations)` where `locations` is the sorted list
+            of location labels used, and `schedule` has a
+            `[half_hour, cells]` row for every half hour from the first event
+            to the end of the last one. Each row has one `(rowspan, name)`
+            cell per location: the event's duration where it starts, 0 where
+            it continues, and `(1, '')` for open half hours.
+    """
+    events = [event for event in events if event[3]]
+    if not events:
+        return [], []
+
+    locations = sorted({c.EVENT_LOCATIONS[location] for location, name, start_time, duration in events})
+    columns = {label: i for i, label in enumerate(locations)}
+    first = min(start_time for location, name, start_time, duration in events)
+    last = max(start_time + HALF_HOUR * (duration - 1) for location, name, start_time, duration in events)
+
+    rows = [[EMPTY_CELL] * len(locations) for i in range(int((last - first) / HALF_HOUR) + 1)]
+    for location, name, start_time, duration in events:
+        column = columns[c.EVENT_LOCATIONS[location]]
+        start = int((start_time - first) / HALF_HOUR)
+        rows[start][column] = (duration, name)
+        for row in rows[start + 1:start + duration]:
+            row[column] = (0, name)
+
+    return [[first + HALF_HOUR * i, row] for i, row in enumerate(rows)], locations
+
+
+def build_timetables(rows):
+    """
+    Builds a timetable per attendee from `(attendee_id, location, name,
+    start_time, duration)` rows, returning a dict mapping each attendee id
+    to its `(schedule, locations)` tuple.
+    """
+    events = defaultdict(list)
+    for attendee_id, location, name, start_time, duration in rows:
+        events[attendee_id].append((location, name, start_time, duration))
+    return {attendee_id: build_timetable(attendee_events) for attendee_id, attendee_events in events.items()}
+
+
+def _filtered_timetables(query, attendee_column, attendee_ids):
+    if attendee_ids is not None:
+        query = query.filter(attendee_column.in_(attendee_ids))
+    return build_timetables(query)
+
+
+def panelist_timetables(session, attendee_ids=None):
+    """
+    Returns the timetables of every panelist (or just the given attendees)
+    for the events they're assigned to, from a single query.
+    """
+    query = session.query(
+        AssignedPanelist.attendee_id, Event.location, Event.name, Event.start_time, Event.duration) \
+        .join(Event, AssignedPanelist.event_id == Event.id)
+    return _filtered_timetables(query, AssignedPanelist.attendee_id, attendee_ids)
+
+
+def poc_timetables(session, attendee_ids=None):
+    """
+    Returns the timetables of every panel point of contact (or just the
+    given attendees) for the scheduled events of their applications, from a
+    single query.
+    """
+    query = session.query(
+        PanelApplication.poc_id, Event.location, Event.name, Event.start_time, Event.duration) \
+        .join(Event, PanelApplication.event_id == Event.id) \
+        .filter(PanelApplication.poc_id.isnot(None))
+    return _filtered_timetables(query, PanelApplication.poc_id, attendee_ids)